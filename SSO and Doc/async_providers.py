@@ -0,0 +1,245 @@
+"""
+Async External Provider Setup
+
+Coroutine versions of setup_saml_provider, setup_docusign_provider and
+update_secret for use with AsyncOAuthSession / AsyncSessionAuth
+(async_session.py). Provider configs are built by the same functions as the
+synchronous versions in setup_external_providers.py, and lookups share the
+session's ProviderRegistry.
+
+Usage:
+    async with await create_async_session_auth(env_id) as session:
+        await asyncio.gather(
+            setup_saml_provider_async(session, saml_xml, "Customer SSO"),
+            setup_docusign_provider_async(session, account_id, "account.docusign.net"),
+        )
+"""
+import asyncio
+import weakref
+from collections import Counter
+from typing import AsyncIterator, Dict, Optional
+
+from fast_json import response_json
+from session_metrics import async_operation
+from setup_external_providers import (
+    DOCUSIGN_TEMP_PROVIDER_ID,
+    PROVIDER_PAGE_SIZE,
+    SAML_TEMP_PROVIDER_ID,
+    ProviderPager,
+    _print_missing_account_id_warning,
+    _print_no_account_id_warning,
+    build_docusign_provider_config,
+    build_saml_provider_config,
+    docusign_error_message,
+    get_provider_registry,
+    parse_saml_provider_fields,
+    plan_provider_upsert,
+    provider_put_body,
+    session_base_uri,
+)
+
+
+async def aiter_external_providers(session, page_size: int = PROVIDER_PAGE_SIZE,
+                                   filters: Optional[Dict] = None) -> AsyncIterator[Dict]:
+    """Async version of iter_external_providers (same ProviderPager paging and filter pushdown)."""
+    pager = ProviderPager(page_size, filters)
+    while not pager.done:
+        page = response_json(await session.get(pager.path()))
+        providers = pager.unpaged_items(page) if pager.unpaged else pager.accept(page)
+        for provider in providers:
+            yield provider
+
+
+@async_operation('get_account_id')
+async def get_account_id_async(session) -> Optional[int]:
+    """Async version of get_account_id."""
+    try:
+        response = await session.get('/api/users/me')
+        account_id = response_json(response).get('account_id')
+        if account_id:
+            return account_id
+    except Exception:
+        pass
+    
+    registry = get_provider_registry(session)
+    providers = registry.providers() if registry.is_fresh else []
+    try:
+        if not providers:
+            async for provider in aiter_external_providers(session, page_size=1):
+                providers = [provider]
+                break
+    except Exception:
+        return None
+    for provider in providers:
+        if provider.get('account_id'):
+            return provider['account_id']
+    return None
+
+
+# One listing in flight per session, however many coroutines are looking up
+# providers. Locks are per event loop (an asyncio.Lock can't be shared between
+# loops), then per session; both levels go away with their loop/session.
+_listing_locks = weakref.WeakKeyDictionary()
+
+
+def _listing_lock(session) -> asyncio.Lock:
+    locks = _listing_locks.setdefault(asyncio.get_running_loop(), weakref.WeakKeyDictionary())
+    lock = locks.get(session)
+    if lock is None:
+        lock = locks[session] = asyncio.Lock()
+    return lock
+
+
+async def _get_provider_async(session, registry, provider_id: int) -> Optional[Dict]:
+    """Async ProviderRegistry.get: the fresh listing's entry, else GET /api/external_providers/{id}."""
+    if registry.is_fresh:
+        return registry.lookup_id(provider_id)
+    try:
+        provider = response_json(await session.get(f'/api/external_providers/{provider_id}'))
+    except Exception as e:
+        if getattr(getattr(e, 'response', None), 'status_code', None) == 404:
+            return None
+        raise
+    registry.record(provider)
+    return provider if isinstance(provider, dict) else None
+
+
+async def find_existing_provider_async(session, name: str, provider_type: str,
+                                      provider_id: Optional[int] = None) -> Optional[Dict]:
+    """Async version of find_existing_provider, sharing the session's ProviderRegistry."""
+    registry = get_provider_registry(session)
+    try:
+        if provider_id:
+            # A single provider never needs the whole listing
+            return await _get_provider_async(session, registry, provider_id)
+        async with _listing_lock(session):
+            if not registry.is_fresh:
+                # One unpaged request, like ProviderRegistry.refresh()
+                registry.replace(response_json(await session.get('/api/external_providers')))
+        return registry.lookup(name, provider_type)
+    except Exception as e:
+        print(f"Warning: Could not search for existing providers: {e}")
+        return None
+
+
+async def find_provider_by_name_type_async(session, name: str, provider_type: str) -> Optional[int]:
+    """Async version of find_provider_by_name_type, sharing the session's ProviderRegistry."""
+    provider = await find_existing_provider_async(session, name, provider_type)
+    return provider.get('id') if provider else None
+
+
+@async_operation('setup_saml_provider')
+async def setup_saml_provider_async(
+    session,
+    saml_xml: str,
+    provider_name: str,
+    account_id: Optional[int] = None,
+    base_uri: Optional[str] = None,
+    provides: list = None,
+    name_key: Optional[str] = None,
+    email_key: Optional[str] = None,
+    provider_id: Optional[int] = None,
+    entity_id: Optional[str] = None,
+    stats: Optional[Counter] = None
+) -> Dict:
+    """Async version of setup_saml_provider (same arguments and result)."""
+    saml_data = parse_saml_provider_fields(saml_xml, entity_id)
+    
+    if account_id is None:
+        account_id = await get_account_id_async(session)
+        if account_id is None:
+            raise ValueError(
+                "Could not determine account_id. Please provide it explicitly:\n"
+                "  setup_saml_provider_async(..., account_id=YOUR_ACCOUNT_ID)"
+            )
+    
+    if base_uri is None:
+        base_uri = session_base_uri(session)
+    
+    provider_config = build_saml_provider_config(
+        saml_data, provider_name, account_id, base_uri, provides, name_key, email_key
+    )
+    
+    existing = await find_existing_provider_async(session, provider_name, 'saml2', provider_id)
+    outcome, _ = plan_provider_upsert(provider_config, existing)
+    if stats is not None:
+        stats[outcome] += 1
+    if outcome == 'unchanged':
+        return existing
+    
+    provider_id = provider_id or (existing or {}).get('id')
+    response = await session.put(
+        f'/api/external_providers/{provider_id or SAML_TEMP_PROVIDER_ID}', json=provider_config
+    )
+    if response.status_code not in [200, 201]:
+        raise Exception(f"Failed to create/update SAML provider: {response.status_code} - {response.text}")
+    
+    provider_data = response_json(response)
+    get_provider_registry(session).record(provider_data)
+    return provider_data
+
+
+@async_operation('setup_docusign_provider')
+async def setup_docusign_provider_async(
+    session,
+    account_id_docusign: str,
+    base_url: str,
+    provider_name: str = "DocuSign Integration",
+    account_id: Optional[int] = None,
+    integration_key: Optional[str] = None,
+    secret: Optional[str] = None,
+    provider_id: Optional[int] = None,
+    environment: str = 'production',
+    stats: Optional[Counter] = None
+) -> Dict:
+    """Async version of setup_docusign_provider (same arguments and result)."""
+    if account_id is None:
+        account_id = await get_account_id_async(session)
+        if account_id is None:
+            _print_missing_account_id_warning()
+    
+    provider_config = build_docusign_provider_config(
+        account_id_docusign, base_url, provider_name, account_id, integration_key, environment
+    )
+    if not account_id:
+        _print_no_account_id_warning()
+    
+    existing = await find_existing_provider_async(session, provider_name, 'docusign', provider_id)
+    outcome, _ = plan_provider_upsert(provider_config, existing)
+    if stats is not None:
+        stats[outcome] += 1
+    
+    if outcome == 'unchanged':
+        provider_data = existing
+    else:
+        provider_id = provider_id or (existing or {}).get('id')
+        response = await session.put(
+            f'/api/external_providers/{provider_id or DOCUSIGN_TEMP_PROVIDER_ID}',
+            json=provider_put_body(provider_config, outcome)
+        )
+        if response.status_code not in [200, 201]:
+            raise Exception(docusign_error_message(response, account_id))
+        
+        provider_data = response_json(response)
+        get_provider_registry(session).record(provider_data)
+    
+    if secret and 'id' in provider_data:
+        await update_secret_async(session, provider_data['id'], secret)
+    
+    return provider_data
+
+
+@async_operation('update_secret')
+async def update_secret_async(session, provider_id: int, secret: str) -> bool:
+    """Async version of update_secret."""
+    try:
+        response = await session.post(
+            f'/api/external_providers/{provider_id}/updateSecret',
+            json={'secret': secret}
+        )
+        if response.status_code == 200:
+            return True
+        else:
+            raise Exception(f"Failed to update secret: {response.status_code} - {response.text}")
+    except Exception as e:
+        raise Exception(f"Error updating secret: {e}")
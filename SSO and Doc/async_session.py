@@ -0,0 +1,295 @@
+"""
+Asyncio Session Helpers for Luminance API
+
+Async counterparts of OAuthSession (oauth_session.py) and SessionAuth
+(session_auth_helper.py) with the same get/put/post/patch surface, built on a
+pooled httpx.AsyncClient so one process can keep hundreds of requests in flight
+without a thread per call.
+
+Requires: pip install httpx
+"""
+import asyncio
+import base64
+import os
+import weakref
+
+try:
+    import httpx
+except ImportError:
+    raise ImportError("httpx is required for async sessions. Run: pip install httpx")
+
+from fast_json import response_json
+from oauth_session import CachedToken, resolve_base_uri, token_cache, token_error_message
+from resilience import call_with_retry_async
+from session_auth_helper import extract_csrf_token, load_env
+from session_metrics import async_operation, instrumented_request_async
+
+# Errors worth retrying: the request never got a response
+TRANSIENT_ERRORS = (httpx.TransportError,)
+
+# Connection pool limits for clients created by this module
+DEFAULT_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20)
+DEFAULT_TIMEOUT = httpx.Timeout(30.0)
+
+
+def create_async_client(verify=True, limits=None, timeout=None) -> httpx.AsyncClient:
+    """Create a pooled AsyncClient. Share one between AsyncOAuthSessions to share its connections."""
+    return httpx.AsyncClient(verify=verify, limits=limits or DEFAULT_LIMITS, timeout=timeout or DEFAULT_TIMEOUT)
+
+
+class _AsyncSessionBase:
+    """Shared request plumbing; subclasses add authentication."""
+    def __init__(self, base_uri, client=None, verify=None, retry_policy=None):
+        self.base_uri = base_uri.rstrip('/')
+        self.retry_policy = retry_policy
+        # Disable SSL verification for development (like lumpy does for 8443)
+        if verify is None:
+            verify = '8443' not in base_uri
+        self._owns_client = client is None
+        self.client = client or create_async_client(verify=verify)
+    
+    def _url(self, path):
+        return f"{self.base_uri}{path}" if path.startswith('/') else f"{self.base_uri}/{path}"
+    
+    async def _send(self, method, url, **kwargs):
+        """One request with retries/circuit breaking per self.retry_policy (see resilience.py)."""
+        return await call_with_retry_async(
+            lambda: instrumented_request_async(self.client.request, method, url, **kwargs),
+            method, url, self.retry_policy, transient=TRANSIENT_ERRORS
+        )
+    
+    async def _request(self, method, path, **kwargs):
+        res = await self._send(method, self._url(path), **kwargs)
+        res.raise_for_status()
+        return res
+    
+    async def get(self, path, **kwargs):
+        return await self._request('GET', path, **kwargs)
+    
+    async def put(self, path, **kwargs):
+        return await self._request('PUT', path, **kwargs)
+    
+    async def post(self, path, **kwargs):
+        return await self._request('POST', path, **kwargs)
+    
+    async def patch(self, path, **kwargs):
+        return await self._request('PATCH', path, **kwargs)
+    
+    async def aclose(self):
+        """Close the underlying client if this session created it."""
+        if self._owns_client:
+            await self.client.aclose()
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+
+class AsyncOAuthSession(_AsyncSessionBase):
+    """
+    Async OAuth2 Bearer-token session, mirroring OAuthSession.
+    
+    The Authorization header is sent per request rather than stored on the
+    client, so several sessions (even for different environments) can share
+    one pooled client.
+    """
+    def __init__(self, base_uri, access_token, client=None, verify=None, token_source=None, on_unauthorized=None,
+                 retry_policy=None):
+        super().__init__(base_uri, client=client, verify=verify, retry_policy=retry_policy)
+        self.access_token = access_token
+        self.token_source = token_source
+        self.on_unauthorized = on_unauthorized
+    
+    async def _request(self, method, path, **kwargs):
+        if self.token_source is not None:
+            self.access_token = await self.token_source()
+        headers = {"Content-Type": "application/json", **kwargs.pop('headers', {})}
+        
+        headers["Authorization"] = f"Bearer {self.access_token}"
+        res = await self._send(method, self._url(path), headers=headers, **kwargs)
+        if res.status_code == 401 and self.on_unauthorized is not None:
+            # Token was revoked or expired early - drop it and try once more with a fresh one
+            self.on_unauthorized()
+            self.access_token = await self.token_source()
+            headers["Authorization"] = f"Bearer {self.access_token}"
+            res = await self._send(method, self._url(path), headers=headers, **kwargs)
+        res.raise_for_status()
+        return res
+
+
+class AsyncSessionAuth(_AsyncSessionBase):
+    """
+    Async session-based (cookie + CSRF) authentication, mirroring SessionAuth.
+    
+    Each instance owns its client, since the session cookie lives in the
+    client's cookie jar. Use `await AsyncSessionAuth.login(...)` to create one.
+    """
+    def __init__(self, base_uri, verify=None, limits=None):
+        if verify is None:
+            verify = '8443' not in base_uri
+        super().__init__(base_uri, client=create_async_client(verify=verify, limits=limits))
+        self._owns_client = True
+        self.csrf_token = None
+    
+    @classmethod
+    @async_operation('login')
+    async def login(cls, base_uri, username, password, verify=None, limits=None):
+        """Create a session and log in using session-based auth with CSRF tokens."""
+        self = cls(base_uri, verify=verify, limits=limits)
+        try:
+            # Step 1: Get CSRF token from login page
+            login_page = await self._send('GET', self.base_uri + '/login')
+            login_page.raise_for_status()
+            csrf_token = extract_csrf_token(login_page.text)
+            
+            # Step 2: POST to /auth/login with CSRF token
+            login_response = await self._send(
+                'POST', self.base_uri + '/auth/login',
+                data={
+                    'username': username,
+                    'password': password
+                },
+                headers={'X-CSRF-Token': csrf_token}
+            )
+            login_response.raise_for_status()
+            
+            # Step 3: Get new CSRF token from response
+            login_data = response_json(login_response)
+            if 'csrf' not in login_data:
+                raise ValueError("Could not get CSRF token from login response")
+            self.csrf_token = login_data['csrf']
+            self.client.headers['X-CSRF-Token'] = self.csrf_token
+        except BaseException:
+            await self.aclose()
+            raise
+        return self
+
+
+# Single-flight locks for async token fetches, per event loop (an asyncio.Lock
+# can't be shared between loops) and then keyed like token_cache. A loop's
+# locks go away with the loop.
+_token_locks = weakref.WeakKeyDictionary()
+
+
+def _token_lock(key) -> asyncio.Lock:
+    locks = _token_locks.setdefault(asyncio.get_running_loop(), {})
+    lock = locks.get(key)
+    if lock is None:
+        lock = locks[key] = asyncio.Lock()
+    return lock
+
+
+@async_operation('token_fetch')
+async def request_token_async(client: httpx.AsyncClient, base_uri: str, client_id: str,
+                              client_secret: str) -> CachedToken:
+    """Async version of oauth_session.request_token."""
+    token_url = f"{base_uri}/auth/oauth2/token"
+    auth_str = base64.b64encode(f"{client_id}:{client_secret}".encode()).decode()
+    
+    print(f"   Requesting token from: {token_url}")
+    print(f"   Using CLIENT_ID: {client_id[:8]}...")
+    
+    response = await call_with_retry_async(lambda: instrumented_request_async(
+        client.request, 'POST', token_url,
+        headers={
+            "Authorization": f"Basic {auth_str}",
+            "Content-Type": "application/x-www-form-urlencoded"
+        },
+        content="grant_type=client_credentials"
+    ), 'POST', token_url, transient=TRANSIENT_ERRORS)
+    if response.status_code != 200:
+        raise Exception(token_error_message(response))
+    
+    token_data = response_json(response)
+    print(f"   ✅ Token obtained successfully")
+    return CachedToken(token_data['access_token'], token_data.get('expires_in'))
+
+
+async def create_async_oauth_session(env_id: str, client_id: str = None, client_secret: str = None,
+                                     base_uri: str = None, client: httpx.AsyncClient = None) -> AsyncOAuthSession:
+    """
+    Create an async OAuth2 session for Luminance API.
+    
+    Tokens are shared with the synchronous create_oauth_session() through
+    oauth_session.token_cache; concurrent coroutines needing a new token for the
+    same (base_uri, client_id) wait on one token request.
+    
+    Args:
+        env_id: Luminance environment ID, moniker or URL
+        client_id: OAuth2 client ID (or from CLIENT_ID env var)
+        client_secret: OAuth2 client secret (or from SECRET_KEY env var)
+        base_uri: Optional full base URI (if provided, env_id is ignored)
+        client: Optional shared AsyncClient (see create_async_client)
+    
+    Returns:
+        AsyncOAuthSession instance
+    """
+    load_env()
+    if client_id is None:
+        client_id = os.getenv("CLIENT_ID")
+    if client_secret is None:
+        client_secret = os.getenv("SECRET_KEY")
+    
+    if not client_id or not client_secret:
+        raise ValueError("CLIENT_ID and SECRET_KEY (client_secret) are required for OAuth2")
+    
+    base_uri = base_uri.rstrip('/') if base_uri else resolve_base_uri(env_id)
+    key = (base_uri, client_id)
+    session = AsyncOAuthSession(base_uri, None, client=client)
+    
+    async def token_source():
+        access_token = token_cache.peek(key)
+        if access_token is not None:
+            return access_token
+        async with _token_lock(key):
+            # Another coroutine may have fetched a token while we were waiting
+            access_token = token_cache.peek(key)
+            if access_token is None:
+                token = await request_token_async(session.client, base_uri, client_id, client_secret)
+                token_cache.store(key, token)
+                access_token = token.access_token
+            return access_token
+    
+    def on_unauthorized():
+        token_cache.invalidate(key)
+    
+    session.token_source = token_source
+    session.on_unauthorized = on_unauthorized
+    session.access_token = await token_source()
+    return session
+
+
+async def create_async_session_auth(env_id: str, username: str = None, password: str = None,
+                                    base64_token: str = None) -> AsyncSessionAuth:
+    """
+    Create async session-based authentication (see create_session_auth).
+    
+    Args:
+        env_id: Environment ID or moniker
+        username: Username (or from env var)
+        password: Password (or from env var)
+        base64_token: Base64 encoded username:password token (alternative to username/password)
+    
+    Returns:
+        AsyncSessionAuth instance
+    """
+    base_uri = resolve_base_uri(env_id)
+    
+    # Get credentials
+    if base64_token:
+        creds = base64.b64decode(base64_token).decode().split(':')
+        username = creds[0]
+        password = creds[1] if len(creds) > 1 else ''
+    else:
+        load_env()
+        if not username:
+            username = os.getenv("USERNAME")
+        if not password:
+            password = os.getenv("PASSWORD")
+        
+        if not username or not password:
+            raise ValueError("Username and password required (or provide base64_token)")
+    
+    return await AsyncSessionAuth.login(base_uri, username, password)
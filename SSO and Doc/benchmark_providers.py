@@ -0,0 +1,592 @@
+#!/usr/bin/env python3
+"""
+Provisioning Benchmark Suite
+
+Measures the provisioning code paths against a local stand-in for the
+Luminance API, so results don't depend on a live environment, credentials or
+network jitter. The stub serves /auth/oauth2/token, /login, /auth/login,
+/api/users/me and /api/external_providers (list, GET by id, PUT upsert, updateSecret) with
+configurable latency and provider counts.
+
+For each case it records wall time (mean/median/p95/min), HTTP requests per
+operation (total and per endpoint) and peak Python memory (tracemalloc, in a
+separate pass so it doesn't skew timings), and writes them as JSON so runs
+can be compared across versions.
+
+The startup[...] cases time fresh interpreters importing / running
+setup_external_providers.py, report the time over a bare interpreter
+(overhead_ms) and which heavy modules got loaded; --startup-budget-ms turns
+them into a regression check.
+
+Usage:
+    python3 benchmark_providers.py [--latency-ms 20] [--providers 500] [--entities 2000]
+        [--iterations 10] [--cases parse_saml_xml,setup_saml_provider]
+        [--output results.json] [--compare previous-results.json]
+        [--startup-budget-ms 60]
+"""
+import argparse
+import base64
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import re
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+BENCHMARK_ACCOUNT_ID = 4242
+BENCHMARK_USERNAME = 'bench-user'
+BENCHMARK_PASSWORD = 'bench-password'
+BENCHMARK_CLIENT_ID = 'bench-client-id-0000'
+BENCHMARK_CLIENT_SECRET = 'bench-client-secret'
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+# Modules that dominate startup time; startup cases report which of these were loaded
+STARTUP_HEAVY_MODULES = (
+    'argparse', 'asyncio', 'concurrent.futures', 'csv', 'dotenv', 'lumpy', 'requests', 'urllib3',
+    'xml.etree.ElementTree', 'xml.parsers.expat'
+)
+
+
+# ============================================================================
+# SYNTHETIC SAML METADATA
+# ============================================================================
+
+MD_NS = 'urn:oasis:names:tc:SAML:2.0:metadata'
+DS_NS = 'http://www.w3.org/2000/09/xmldsig#'
+
+
+def _fake_certificate(rng: random.Random, size: int = 900) -> str:
+    """Base64 text the size of a typical 2048-bit certificate, wrapped at 64 columns."""
+    text = base64.b64encode(bytes(rng.getrandbits(8) for _ in range(size))).decode()
+    return '\n'.join(text[i:i + 64] for i in range(0, len(text), 64))
+
+
+def _entity_descriptor(index: int, rng: random.Random) -> str:
+    host = f"idp{index}.bench.example.edu"
+    key_descriptor = (
+        '<md:KeyDescriptor use="{use}"><ds:KeyInfo><ds:X509Data><ds:X509Certificate>'
+        '{cert}</ds:X509Certificate></ds:X509Data></ds:KeyInfo></md:KeyDescriptor>'
+    )
+    return (
+        f'<md:EntityDescriptor entityID="https://{host}/idp/shibboleth">'
+        f'<md:IDPSSODescriptor protocolSupportEnumeration="urn:oasis:names:tc:SAML:2.0:protocol">'
+        + key_descriptor.format(use='encryption', cert=_fake_certificate(rng))
+        + key_descriptor.format(use='signing', cert=_fake_certificate(rng))
+        + f'<md:NameIDFormat>urn:oasis:names:tc:SAML:1.1:nameid-format:emailAddress</md:NameIDFormat>'
+        f'<md:SingleSignOnService Binding="urn:oasis:names:tc:SAML:2.0:bindings:HTTP-Redirect" '
+        f'Location="https://{host}/idp/profile/SAML2/Redirect/SSO"/>'
+        f'<md:SingleSignOnService Binding="urn:oasis:names:tc:SAML:2.0:bindings:HTTP-POST" '
+        f'Location="https://{host}/idp/profile/SAML2/POST/SSO"/>'
+        f'</md:IDPSSODescriptor>'
+        f'<md:Organization><md:OrganizationName xml:lang="en">Bench University {index}</md:OrganizationName>'
+        f'</md:Organization>'
+        f'</md:EntityDescriptor>'
+    )
+
+
+def generate_saml_metadata(entities: int = 1, seed: int = 0) -> str:
+    """
+    Generate IdP metadata: a single EntityDescriptor when entities == 1, else an
+    EntitiesDescriptor aggregate. Deterministic for a given seed.
+    """
+    rng = random.Random(seed)
+    namespaces = f'xmlns:md="{MD_NS}" xmlns:ds="{DS_NS}"'
+    if entities == 1:
+        descriptor = _entity_descriptor(0, rng)
+        return '<?xml version="1.0" encoding="UTF-8"?>\n' + descriptor.replace(
+            '<md:EntityDescriptor ', f'<md:EntityDescriptor {namespaces} ', 1
+        )
+    return (
+        f'<?xml version="1.0" encoding="UTF-8"?>\n<md:EntitiesDescriptor {namespaces} Name="bench-federation">'
+        + ''.join(_entity_descriptor(i, rng) for i in range(entities))
+        + '</md:EntitiesDescriptor>'
+    )
+
+
+def aggregate_entity_id(index: int) -> str:
+    return f"https://idp{index}.bench.example.edu/idp/shibboleth"
+
+
+# ============================================================================
+# STUB LUMINANCE API
+# ============================================================================
+
+class StubLuminanceServer:
+    """
+    In-process stand-in for the Luminance endpoints the provisioning code uses.
+    Every request sleeps `latency` seconds and is counted per endpoint.
+    """
+    def __init__(self, latency: float = 0.0, providers: int = 0, host: str = '127.0.0.1', port: int = 0):
+        self.latency = latency
+        self._lock = threading.Lock()
+        self.counts = {}
+        self.providers = {}
+        self.next_id = 1
+        self.sessions = set()
+        for i in range(providers):
+            self._insert({
+                'name': f'Existing Provider {i}',
+                'type': 'saml2' if i % 2 else 'docusign',
+                'account_id': BENCHMARK_ACCOUNT_ID,
+                'state': 'active',
+                'options': {}
+            })
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='stub-luminance', daemon=True)
+
+    @property
+    def base_uri(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _insert(self, provider: Dict) -> Dict:
+        provider = dict(provider, id=self.next_id)
+        self.providers[self.next_id] = provider
+        self.next_id += 1
+        return provider
+
+    def count(self, endpoint: str):
+        with self._lock:
+            self.counts[endpoint] = self.counts.get(endpoint, 0) + 1
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.counts)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Buffer headers and body into one write so keep-alive clients don't
+            # stall on delayed ACKs, which would swamp the simulated latency
+            wbufsize = 64 * 1024
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body, content_type='application/json', headers=None):
+                data = body.encode() if isinstance(body, str) else json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _body(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                return self.rfile.read(length) if length else b''
+
+            def _authenticated(self):
+                if self.headers.get('Authorization', '').startswith('Bearer '):
+                    return True
+                match = re.search(r'bench_sid=([^;]+)', self.headers.get('Cookie', ''))
+                return bool(match) and match.group(1) in server.sessions
+
+            def _route(self, method):
+                parsed = urlparse(self.path)
+                path = parsed.path.rstrip('/')
+                endpoint = re.sub(r'/\d+', '/{id}', path)
+                server.count(f"{method} {endpoint}")
+                if server.latency:
+                    time.sleep(server.latency)
+                body = self._body()
+
+                if method == 'POST' and path == '/auth/oauth2/token':
+                    token = base64.b64encode(os.urandom(24)).decode()
+                    return self._send(200, {'access_token': token, 'token_type': 'bearer', 'expires_in': 3600})
+                if method == 'GET' and path == '/login':
+                    return self._send(200, "<html><script>window.csrf = 'login-page-csrf';</script></html>",
+                                      content_type='text/html')
+                if method == 'POST' and path == '/auth/login':
+                    fields = parse_qs(body.decode())
+                    if fields.get('username') != [BENCHMARK_USERNAME] or fields.get('password') != [BENCHMARK_PASSWORD]:
+                        return self._send(401, {'message': 'Invalid credentials'})
+                    sid = base64.b16encode(os.urandom(8)).decode()
+                    with server._lock:
+                        server.sessions.add(sid)
+                    return self._send(200, {'csrf': f'csrf-{sid}'},
+                                      headers={'Set-Cookie': f'bench_sid={sid}; Path=/; HttpOnly'})
+
+                if not path.startswith('/api/'):
+                    return self._send(404, {'message': 'Not found'})
+                if not self._authenticated():
+                    return self._send(401, {'message': 'Unauthorized'})
+
+                if method == 'GET' and path == '/api/users/me':
+                    return self._send(200, {'id': 1, 'account_id': BENCHMARK_ACCOUNT_ID})
+                if method == 'GET' and path == '/api/external_providers':
+                    query = parse_qs(parsed.query)
+                    with server._lock:
+                        providers = list(server.providers.values())
+                    for field in ('name', 'type'):
+                        if field in query:
+                            providers = [p for p in providers if p.get(field) == query[field][0]]
+                    offset = int(query.get('offset', ['0'])[0])
+                    if 'limit' in query:
+                        providers = providers[offset:offset + int(query['limit'][0])]
+                    return self._send(200, providers)
+
+                match = re.fullmatch(r'/api/external_providers/(\d+)(/updateSecret)?', path)
+                if match and method == 'GET' and not match.group(2):
+                    with server._lock:
+                        provider = server.providers.get(int(match.group(1)))
+                    if provider is None:
+                        return self._send(404, {'message': 'Not found'})
+                    return self._send(200, provider)
+                if match and method == 'PUT' and not match.group(2):
+                    provider_id = int(match.group(1))
+                    config = json.loads(body or b'{}')
+                    with server._lock:
+                        if provider_id in server.providers:
+                            provider = dict(server.providers[provider_id], **config, id=provider_id)
+                            server.providers[provider_id] = provider
+                        else:
+                            provider = server._insert(config)
+                    return self._send(200, provider)
+                if match and method == 'POST' and match.group(2):
+                    return self._send(200, {'ok': True})
+                return self._send(404, {'message': 'Not found'})
+
+            def do_GET(self):
+                self._route('GET')
+
+            def do_POST(self):
+                self._route('POST')
+
+            def do_PUT(self):
+                self._route('PUT')
+
+            def do_PATCH(self):
+                self._route('PATCH')
+
+        return Handler
+
+
+# ============================================================================
+# MEASUREMENT
+# ============================================================================
+
+def _percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def _wall_ms(timings: List[float]) -> Dict[str, float]:
+    return {
+        'mean': round(statistics.mean(timings) * 1000, 3),
+        'median': round(statistics.median(timings) * 1000, 3),
+        'p95': round(_percentile(timings, 0.95) * 1000, 3),
+        'min': round(min(timings) * 1000, 3)
+    }
+
+
+def measure(fn: Callable, iterations: int, server: Optional[StubLuminanceServer] = None,
+            setup: Optional[Callable] = None) -> Dict:
+    """
+    Run fn(state) `iterations` times (state = setup() before each call, outside
+    the timed region) and return timing, request and peak-memory figures.
+    """
+    timings = []
+    request_totals = {}
+    quiet = io.StringIO()
+    for _ in range(iterations):
+        state = setup() if setup else None
+        before = server.snapshot() if server else {}
+        with contextlib.redirect_stdout(quiet):
+            started = time.perf_counter()
+            fn(state)
+            timings.append(time.perf_counter() - started)
+        if server:
+            for endpoint, count in server.snapshot().items():
+                delta = count - before.get(endpoint, 0)
+                if delta:
+                    request_totals[endpoint] = request_totals.get(endpoint, 0) + delta
+        quiet.seek(0)
+        quiet.truncate()
+
+    # Separate pass for memory - tracemalloc slows allocation-heavy code down a lot
+    state = setup() if setup else None
+    tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(quiet):
+            fn(state)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'iterations': iterations,
+        'wall_ms': _wall_ms(timings),
+        'requests_per_op': round(sum(request_totals.values()) / iterations, 2),
+        'requests_by_endpoint_per_op': {
+            endpoint: round(total / iterations, 2) for endpoint, total in sorted(request_totals.items())
+        },
+        'peak_memory_kb': round(peak / 1024, 1)
+    }
+
+
+# Runs in the child interpreter: import a module or run a script, then report
+# (on the last stderr line) which STARTUP_HEAVY_MODULES ended up loaded
+_STARTUP_PROBE = '''
+import json, sys
+target, heavy = sys.argv[1], sys.argv[2].split(',')
+sys.argv = sys.argv[3:] or [target]
+try:
+    if target.endswith('.py'):
+        import runpy
+        runpy.run_path(target, run_name='__main__')
+    else:
+        __import__(target)
+except SystemExit:
+    pass
+finally:
+    sys.stderr.write('\\n' + json.dumps(sorted(m for m in heavy if m in sys.modules)) + '\\n')
+'''
+
+
+def measure_startup(target: str, argv: Optional[List[str]] = None, iterations: int = 10) -> Dict:
+    """
+    Time `iterations` fresh interpreters that import `target` (a module name)
+    or run it as a script (a .py path, with argv), from process start to exit.
+    """
+    command = [sys.executable, '-c', _STARTUP_PROBE, target, ','.join(STARTUP_HEAVY_MODULES)]
+    if argv is not None:
+        command += [target] + argv
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [SCRIPT_DIR, os.getenv('PYTHONPATH')])))
+    # -B keeps runs comparable; the first (untimed) run compiles any stale .pyc files
+    subprocess.run(command, cwd=SCRIPT_DIR, env=env, capture_output=True)
+    command.insert(1, '-B')
+
+    timings = []
+    loaded = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        completed = subprocess.run(command, cwd=SCRIPT_DIR, env=env, capture_output=True, text=True)
+        timings.append(time.perf_counter() - started)
+        try:
+            loaded = json.loads(completed.stderr.strip().splitlines()[-1])
+        except (IndexError, ValueError):
+            raise RuntimeError(f"Startup probe failed: {completed.stderr.strip()[-500:]}")
+
+    return {
+        'iterations': iterations,
+        'wall_ms': _wall_ms(timings),
+        'requests_per_op': 0,
+        'modules_loaded': loaded
+    }
+
+
+# ============================================================================
+# CASES
+# ============================================================================
+
+def build_cases(server: StubLuminanceServer, entities: int) -> Dict[str, Dict]:
+    """Benchmark cases: name -> {'fn': ..., 'setup': ...}."""
+    from saml_metadata import parse_saml_xml
+    import oauth_session
+    import session_auth_helper
+
+    single_xml = generate_saml_metadata(1)
+    aggregate_xml = generate_saml_metadata(entities)
+    last_entity = aggregate_entity_id(entities - 1)
+    base_uri = server.base_uri
+
+    def new_session_auth(_=None):
+        return session_auth_helper.create_session_auth(
+            base_uri, username=BENCHMARK_USERNAME, password=BENCHMARK_PASSWORD
+        )
+
+    def cold_token_cache():
+        oauth_session.token_cache.invalidate()
+
+    def warm_token_cache():
+        oauth_session.create_oauth_session(
+            base_uri, BENCHMARK_CLIENT_ID, BENCHMARK_CLIENT_SECRET
+        )
+
+    def create_oauth(_):
+        oauth_session.create_oauth_session(base_uri, BENCHMARK_CLIENT_ID, BENCHMARK_CLIENT_SECRET)
+
+    def setup_saml(session):
+        from setup_external_providers import setup_saml_provider
+        setup_saml_provider(session, single_xml, 'Bench SSO', base_uri=base_uri)
+
+    def setup_docusign(session):
+        from setup_external_providers import setup_docusign_provider
+        setup_docusign_provider(
+            session, '633b43f4-367a-44cb-b843-6152672eee22', 'account-d.docusign.net',
+            provider_name='Bench DocuSign', environment='testing', secret='bench-docusign-secret'
+        )
+
+    return {
+        'parse_saml_xml[single]': {'fn': lambda _: parse_saml_xml(single_xml)},
+        f'parse_saml_xml[aggregate-{entities}]': {
+            'fn': lambda _: parse_saml_xml(aggregate_xml, entity_id=last_entity)
+        },
+        'create_oauth_session[cold]': {'fn': create_oauth, 'setup': cold_token_cache},
+        'create_oauth_session[warm]': {'fn': create_oauth, 'setup': warm_token_cache},
+        'create_session_auth': {'fn': new_session_auth},
+        'setup_saml_provider': {'fn': setup_saml, 'setup': new_session_auth},
+        'setup_docusign_provider': {'fn': setup_docusign, 'setup': new_session_auth},
+    }
+
+
+STARTUP_CASES = {
+    # Bare interpreter running the probe - the baseline overhead_ms is measured against
+    'startup[interpreter]': {'target': 'sys'},
+    'startup[import]': {'target': 'setup_external_providers'},
+    'startup[--help]': {'target': 'setup_external_providers.py', 'argv': ['--help']},
+}
+
+
+def run_startup_benchmarks(iterations: int = 10, only: Optional[List[str]] = None) -> Dict[str, Dict]:
+    """Run the selected startup cases; each gets overhead_ms (median over the bare interpreter)."""
+    results = {}
+    for name, case in STARTUP_CASES.items():
+        if only and not any(name.startswith(prefix) for prefix in only) and name != 'startup[interpreter]':
+            continue
+        print(f"Running {name}...", file=sys.stderr)
+        try:
+            results[name] = measure_startup(case['target'], case.get('argv'), iterations)
+        except Exception as e:
+            results[name] = {'error': f"{type(e).__name__}: {e}"}
+
+    baseline = results.get('startup[interpreter]', {}).get('wall_ms', {}).get('median')
+    for result in results.values():
+        if baseline is not None and 'wall_ms' in result:
+            result['overhead_ms'] = round(result['wall_ms']['median'] - baseline, 3)
+    return results
+
+
+def check_startup_budget(results: Dict, budget_ms: float) -> List[str]:
+    """Startup cases whose overhead_ms exceeds budget_ms, as messages."""
+    return [
+        f"{name}: {result['overhead_ms']:.1f} ms over the interpreter (budget {budget_ms:.1f} ms)"
+        for name, result in results['results'].items()
+        if name.startswith('startup[') and result.get('overhead_ms', 0) > budget_ms
+    ]
+
+
+def run_benchmarks(latency_ms: float = 20.0, providers: int = 500, entities: int = 2000,
+                   iterations: int = 10, only: Optional[List[str]] = None) -> Dict:
+    """Start a stub server, run the selected cases and return the results document."""
+    with StubLuminanceServer(latency=latency_ms / 1000.0, providers=providers) as server:
+        results = {}
+        for name, case in build_cases(server, entities).items():
+            if only and not any(name.startswith(prefix) for prefix in only):
+                continue
+            print(f"Running {name}...", file=sys.stderr)
+            try:
+                results[name] = measure(case['fn'], iterations, server, case.get('setup'))
+            except Exception as e:
+                results[name] = {'error': f"{type(e).__name__}: {e}"}
+
+    if not only or any(name.startswith(prefix) for name in STARTUP_CASES for prefix in only):
+        results.update(run_startup_benchmarks(iterations, only))
+
+    return {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'latency_ms': latency_ms,
+            'providers': providers,
+            'entities': entities,
+            'iterations': iterations
+        },
+        'results': results
+    }
+
+
+def compare(current: Dict, previous: Dict) -> str:
+    """Render a table of median wall time and requests/op against a previous results document."""
+    lines = [f"{'case':<40} {'median ms':>12} {'Δ':>8} {'req/op':>8} {'Δ':>8}"]
+    for name, result in current['results'].items():
+        old = previous.get('results', {}).get(name)
+        if 'error' in result:
+            lines.append(f"{name:<40} {'error':>12}")
+            continue
+        median = result['wall_ms']['median']
+        requests = result.get('requests_per_op', 0)
+        if not old or 'error' in old:
+            lines.append(f"{name:<40} {median:>12.3f} {'new':>8} {requests:>8.2f} {'':>8}")
+            continue
+        old_median = old['wall_ms']['median']
+        change = f"{(median - old_median) / old_median * 100:+.1f}%" if old_median else 'n/a'
+        lines.append(f"{name:<40} {median:>12.3f} {change:>8} {requests:>8.2f} "
+                     f"{requests - old.get('requests_per_op', 0):>+8.2f}")
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark provisioning paths against a local stub Luminance API')
+    parser.add_argument('--latency-ms', type=float, default=20.0, help='Simulated server latency per request')
+    parser.add_argument('--providers', type=int, default=500, help='Existing providers in the stub account')
+    parser.add_argument('--entities', type=int, default=2000, help='EntityDescriptors in the aggregate parse case')
+    parser.add_argument('--iterations', type=int, default=10, help='Timed runs per case')
+    parser.add_argument('--cases', help='Comma-separated case name prefixes to run (default: all)')
+    parser.add_argument('--output', help='Write results JSON to this file (default: stdout)')
+    parser.add_argument('--compare', help='Previous results JSON to compare against')
+    parser.add_argument('--startup-budget-ms', type=float,
+                        help='Exit non-zero if a startup case takes longer than this over a bare interpreter')
+    args = parser.parse_args()
+
+    results = run_benchmarks(
+        latency_ms=args.latency_ms, providers=args.providers, entities=args.entities,
+        iterations=args.iterations, only=args.cases.split(',') if args.cases else None
+    )
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Results written to {args.output}", file=sys.stderr)
+    else:
+        print(json.dumps(results, indent=2))
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            print(compare(results, json.load(f)), file=sys.stderr)
+
+    if args.startup_budget_ms is not None:
+        over_budget = check_startup_budget(results, args.startup_budget_ms)
+        for message in over_budget:
+            print(f"❌ Startup budget exceeded - {message}", file=sys.stderr)
+        if over_budget:
+            sys.exit(1)
+        print(f"✅ Startup within {args.startup_budget_ms:.1f} ms budget", file=sys.stderr)
+
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Record/Replay Transport
+
+Records the HTTP exchanges made by OAuthSession, SessionAuth, token requests
+and environment probes (everything that goes through transport.transports)
+to a compact cassette file, and replays them later without a network, a live
+environment or credentials. Replay can sleep for each exchange's recorded
+latency (scaled by latency_scale), so the provisioning path can be profiled
+and benchmarked offline, repeatably.
+
+Cassettes are JSONL (gzipped if the name ends in .gz): a header line, then one
+line per exchange with the method, path and query (the host is not recorded,
+so a cassette replays against any base URI), a digest of the request body,
+and the response status, headers, body and latency. Secrets are never
+written: request bodies are only kept as digests (of a canonical form with
+passwords/secrets masked, so the digest doesn't change with the secret or the
+JSON encoder), response fields such as access_token and csrf are masked, and
+Set-Cookie headers are dropped.
+
+Replay matches requests by method and path+query, in recorded order per
+match. With strict=True the body digest must match too and running out of
+recorded exchanges raises CassetteMiss; otherwise the last exchange for that
+match is repeated.
+
+Sessions pick up the cassette when they are created, so open them inside
+use_cassette(). lumpy.api.Session and the httpx-based async sessions have
+their own HTTP stacks and are not recorded.
+
+Usage:
+    from cassette import use_cassette
+
+    with use_cassette('docusign.cassette.jsonl.gz', mode='record'):
+        session = create_session_auth(env_id)
+        setup_docusign_provider(session, ...)
+
+    with use_cassette('docusign.cassette.jsonl.gz', latency_scale=1.0):
+        ...                                   # same calls, served from the cassette
+
+    python3 cassette.py record docusign.cassette.jsonl.gz -- test_docusign_setup.py
+    python3 cassette.py replay docusign.cassette.jsonl.gz [--latency-scale 1] [--strict] -- test_docusign_setup.py
+"""
+import base64
+import gzip
+import hashlib
+import json
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlparse
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from transport import transports
+
+CASSETTE_VERSION = 1
+# Request fields masked before a body is digested
+SECRET_REQUEST_FIELDS = frozenset(['password', 'client_secret', 'secret', 'new_secret'])
+# Response JSON fields masked before an exchange is written
+SECRET_RESPONSE_FIELDS = frozenset(['access_token', 'refresh_token', 'id_token', 'csrf', 'secret', 'password'])
+# Response headers not worth replaying (or secret, for Set-Cookie); bodies are stored decoded
+DROPPED_RESPONSE_HEADERS = frozenset([
+    'set-cookie', 'content-encoding', 'content-length', 'transfer-encoding', 'connection', 'keep-alive', 'date'
+])
+MASK = 'recorded-secret'
+
+
+class CassetteMiss(requests.RequestException):
+    """Replay found no recorded exchange for a request."""
+
+
+def _mask(value, fields):
+    if isinstance(value, dict):
+        return {k: MASK if k in fields else _mask(v, fields) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_mask(v, fields) for v in value]
+    return value
+
+
+def body_digest(body) -> Optional[str]:
+    """Digest of a request body in canonical form with secrets masked (None for no body)."""
+    if body is None:
+        return None
+    if isinstance(body, str):
+        body = body.encode()
+    if not isinstance(body, bytes):
+        # Streamed/file bodies can't be read without consuming them
+        return 'unreadable'
+    if body[:2] == b'\x1f\x8b':
+        body = gzip.decompress(body)
+    try:
+        canonical = json.dumps(_mask(json.loads(body), SECRET_REQUEST_FIELDS), sort_keys=True).encode()
+    except ValueError:
+        fields = parse_qsl(body.decode('utf-8', 'replace'), keep_blank_values=True)
+        canonical = urlencode(sorted((k, MASK if k in SECRET_REQUEST_FIELDS else v) for k, v in fields)).encode() \
+            if fields else body
+    return hashlib.sha256(canonical).hexdigest()[:16]
+
+
+def _match_key(method: str, url: str) -> Tuple[str, str]:
+    parsed = urlparse(url)
+    return method.upper(), parsed.path + (f'?{parsed.query}' if parsed.query else '')
+
+
+# ============================================================================
+# CASSETTE
+# ============================================================================
+
+class Cassette:
+    """
+    Recorded exchanges, loaded from / saved to a cassette file.
+
+    Args:
+        path: Cassette file (.gz for gzip)
+        mode: 'record' (send for real and record) or 'replay'
+        latency_scale: Replay sleeps recorded latency * latency_scale (0: no delay)
+        strict: Replay also matches body digests and never repeats an exchange
+    """
+    def __init__(self, path: str, mode: str = 'replay', latency_scale: float = 0.0, strict: bool = False):
+        if mode not in ('record', 'replay'):
+            raise ValueError(f"Unknown cassette mode {mode!r} (expected 'record' or 'replay')")
+        self.path = path
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self.strict = strict
+        self._lock = threading.Lock()
+        self.interactions: List[Dict] = []
+        self._queues: Dict[Tuple[str, str], List[Dict]] = {}
+        self._last: Dict[Tuple[str, str], Dict] = {}
+        self.played = 0
+        if mode == 'replay':
+            self.load()
+
+    def _open(self, mode: str):
+        return gzip.open(self.path, mode + 't', encoding='utf-8') if self.path.endswith('.gz') else \
+            open(self.path, mode, encoding='utf-8')
+
+    def load(self):
+        with self._open('r') as f:
+            header = json.loads(f.readline())
+            if header.get('cassette') != CASSETTE_VERSION:
+                raise ValueError(f"{self.path} is not a version {CASSETTE_VERSION} cassette")
+            self.interactions = [json.loads(line) for line in f if line.strip()]
+        self._queues = {}
+        for interaction in self.interactions:
+            self._queues.setdefault((interaction['method'], interaction['path']), []).append(interaction)
+
+    def save(self):
+        with self._lock:
+            interactions = list(self.interactions)
+        with self._open('w') as f:
+            f.write(json.dumps({'cassette': CASSETTE_VERSION, 'recorded_at': datetime.now(timezone.utc).isoformat(),
+                                'interactions': len(interactions)}) + '\n')
+            for interaction in interactions:
+                f.write(json.dumps(interaction, separators=(',', ':')) + '\n')
+
+    # --- recording ------------------------------------------------------------
+
+    def record(self, request, response, elapsed: float):
+        """Append one exchange (the response body must already have been read)."""
+        method, path = _match_key(request.method, request.url)
+        headers = {k: v for k, v in response.headers.items() if k.lower() not in DROPPED_RESPONSE_HEADERS}
+        interaction = {'method': method, 'path': path, 'body_sha': body_digest(request.body),
+                       'status': response.status_code, 'reason': response.reason, 'headers': headers,
+                       'elapsed_ms': round(elapsed * 1000, 3)}
+        content = response.content or b''
+        try:
+            if 'json' not in headers.get('Content-Type', headers.get('content-type', '')):
+                raise ValueError
+            interaction['json'] = _mask(json.loads(content), SECRET_RESPONSE_FIELDS)
+        except ValueError:
+            try:
+                interaction['text'] = content.decode('utf-8')
+            except UnicodeDecodeError:
+                interaction['base64'] = base64.b64encode(content).decode()
+        with self._lock:
+            self.interactions.append(interaction)
+
+    # --- replay -----------------------------------------------------------------
+
+    def play(self, request) -> Dict:
+        """The recorded exchange for request."""
+        key = _match_key(request.method, request.url)
+        digest = body_digest(request.body)
+        with self._lock:
+            queue = self._queues.get(key, [])
+            index = 0
+            if self.strict:
+                index = next((i for i, item in enumerate(queue) if item['body_sha'] == digest), None)
+            if queue and index is not None:
+                interaction = self._last[key] = queue.pop(index)
+            elif not self.strict and key in self._last:
+                interaction = self._last[key]
+            else:
+                raise CassetteMiss(f"No recorded exchange for {key[0]} {key[1]} in {self.path}")
+            self.played += 1
+        return interaction
+
+    def unplayed(self) -> int:
+        """Recorded exchanges not served yet."""
+        with self._lock:
+            return sum(len(queue) for queue in self._queues.values())
+
+
+def _build_response(interaction: Dict, request, elapsed: float) -> requests.Response:
+    if 'json' in interaction:
+        content = json.dumps(interaction['json']).encode()
+    elif 'base64' in interaction:
+        content = base64.b64decode(interaction['base64'])
+    else:
+        content = interaction.get('text', '').encode('utf-8')
+    response = requests.Response()
+    response.status_code = interaction['status']
+    response.reason = interaction.get('reason')
+    response.headers = CaseInsensitiveDict(interaction.get('headers') or {})
+    response.encoding = get_encoding_from_headers(response.headers)
+    response._content = content
+    response._content_consumed = True
+    response.url = request.url
+    response.request = request
+    response.elapsed = timedelta(seconds=elapsed)
+    return response
+
+
+class CassetteAdapter(BaseAdapter):
+    """Transport adapter that records through `adapter` or replays from the cassette."""
+    def __init__(self, cassette: Cassette, adapter: BaseAdapter):
+        super().__init__()
+        self.cassette = cassette
+        self.adapter = adapter
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        if self.cassette.mode == 'record':
+            started = time.perf_counter()
+            response = self.adapter.send(request, stream=stream, timeout=timeout, verify=verify,
+                                         cert=cert, proxies=proxies)
+            response.content  # read the body inside the timing (stream=True only defers this)
+            self.cassette.record(request, response, time.perf_counter() - started)
+            return response
+
+        interaction = self.cassette.play(request)
+        delay = interaction.get('elapsed_ms', 0) / 1000 * self.cassette.latency_scale
+        if delay:
+            time.sleep(delay)
+        response = _build_response(interaction, request, delay)
+        response.connection = self
+        return response
+
+    def close(self):
+        # The wrapped adapter is shared by the whole process; transports.close() closes it
+        pass
+
+
+@contextmanager
+def use_cassette(path: str, mode: str = 'replay', latency_scale: float = 0.0,
+                 strict: bool = False) -> Iterator[Cassette]:
+    """
+    Record to, or replay from, a cassette for the sessions created inside the
+    block. A recording is saved when the block exits (even on error).
+    """
+    cassette = Cassette(path, mode, latency_scale, strict)
+    previous = transports.intercept(lambda key, adapter: CassetteAdapter(cassette, adapter))
+    try:
+        yield cassette
+    finally:
+        transports.intercept(previous)
+        if mode == 'record':
+            cassette.save()
+
+
+def main():
+    import argparse
+    import runpy
+    import sys
+
+    parser = argparse.ArgumentParser(description='Run a script while recording or replaying its HTTP exchanges')
+    parser.add_argument('mode', choices=['record', 'replay'])
+    parser.add_argument('cassette', help='Cassette file (.jsonl, or .jsonl.gz for gzip)')
+    parser.add_argument('--latency-scale', type=float, default=0.0,
+                        help='Replay: sleep for recorded latency times this (default 0: no delay)')
+    parser.add_argument('--strict', action='store_true', help='Replay: match request bodies, never repeat exchanges')
+    parser.add_argument('script', help='Python script to run')
+    parser.add_argument('args', nargs=argparse.REMAINDER, help='Arguments for the script (after --)')
+    args = parser.parse_args()
+
+    script_args = args.args[1:] if args.args[:1] == ['--'] else args.args
+    sys.argv = [args.script] + script_args
+    started = time.perf_counter()
+    exit_code = 0
+    with use_cassette(args.cassette, args.mode, args.latency_scale, args.strict) as cassette:
+        try:
+            runpy.run_path(args.script, run_name='__main__')
+        except SystemExit as e:
+            exit_code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    elapsed = time.perf_counter() - started
+    if args.mode == 'record':
+        print(f"\n✅ Recorded {len(cassette.interactions)} exchanges to {args.cassette} in {elapsed:.2f}s",
+              file=sys.stderr)
+    else:
+        print(f"\n✅ Replayed {cassette.played} exchanges from {args.cassette} in {elapsed:.2f}s "
+              f"({cassette.unplayed()} unused)", file=sys.stderr)
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
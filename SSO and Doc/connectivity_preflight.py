@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+Credential and Connectivity Preflight
+
+Checks many environments at once before a rollout: for each entry it runs
+the OAuth2 client-credentials token exchange and (when a username/password is
+available) a SessionAuth login, concurrently across environments and within a
+per-environment deadline.
+
+The token exchange is made over a hand-built connection so each phase can be
+timed separately:
+    resolve_ms   env_id -> base URI (env_resolver; ~0 once cached)
+    dns_ms       host name lookup
+    connect_ms   TCP connect
+    tls_ms       TLS handshake (empty for http:// URIs)
+    ttfb_ms      request sent -> response status line and headers received
+    total_ms     DNS through the end of the token response body
+    login_ms     full SessionAuth login (login page + /auth/login)
+
+Results are printed as a table, slowest first, and can be written as JSON.
+
+Entries (CSV, JSON or JSONL, like the setup_external_providers.py manifest):
+    env_id, client_id, client_secret (or secret), [username, password]
+Missing credentials fall back to CLIENT_ID / SECRET_KEY / USERNAME / PASSWORD.
+
+Usage:
+    python3 connectivity_preflight.py --manifest fleet.csv [--workers 32] [--deadline 10] [--json out.json]
+
+Exit status is 1 if any environment failed a check.
+"""
+import base64
+import http.client
+import json
+import os
+import socket
+import ssl
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Dict, Iterable, List
+from urllib.parse import urlparse
+
+import requests
+
+from env_resolver import resolve_base_uri
+
+DEFAULT_DEADLINE = 10.0
+PHASES = ('resolve_ms', 'dns_ms', 'connect_ms', 'tls_ms', 'ttfb_ms', 'total_ms', 'login_ms')
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 1)
+
+
+def _remaining(deadline: float) -> float:
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceeded("Deadline exceeded")
+    return remaining
+
+
+# ============================================================================
+# TIMED TOKEN EXCHANGE
+# ============================================================================
+
+def _resolve(host: str, port: int, deadline: float) -> List[tuple]:
+    """getaddrinfo bounded by the deadline (the lookup itself can't be cancelled, so it runs on a daemon thread)."""
+    outcome = {}
+
+    def lookup():
+        try:
+            outcome['addresses'] = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        except Exception as e:
+            outcome['error'] = e
+
+    thread = threading.Thread(target=lookup, name=f"preflight-dns-{host}", daemon=True)
+    thread.start()
+    thread.join(_remaining(deadline))
+    if thread.is_alive():
+        raise DeadlineExceeded(f"DNS lookup for {host} exceeded the deadline")
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome['addresses']
+
+
+def _connect(addresses: List[tuple], deadline: float) -> socket.socket:
+    """Connect to the first address that accepts, trying each in turn until the deadline."""
+    error = None
+    for family, socktype, proto, _, address in addresses:
+        sock = socket.socket(family, socktype, proto)
+        try:
+            sock.settimeout(_remaining(deadline))
+            sock.connect(address)
+            return sock
+        except OSError as e:
+            sock.close()
+            error = e
+        except BaseException:
+            sock.close()
+            raise
+    raise error or OSError("No addresses to connect to")
+
+
+def timed_token_request(base_uri: str, client_id: str, client_secret: str, deadline: float) -> Dict:
+    """
+    POST {base_uri}/auth/oauth2/token on a fresh connection, timing each
+    phase. Returns {'status', 'ok', 'error', <phase>_ms...}; raises on
+    network errors and DeadlineExceeded.
+    """
+    parsed = urlparse(base_uri)
+    https = parsed.scheme == 'https'
+    host = parsed.hostname
+    port = parsed.port or (443 if https else 80)
+    timings = {}
+    started = time.monotonic()
+
+    addresses = _resolve(host, port, deadline)
+    timings['dns_ms'] = _ms(time.monotonic() - started)
+
+    mark = time.monotonic()
+    sock = _connect(addresses, deadline)
+    try:
+        timings['connect_ms'] = _ms(time.monotonic() - mark)
+
+        if https:
+            mark = time.monotonic()
+            context = ssl.create_default_context()
+            if '8443' in base_uri:
+                # Dev environments use self-signed certificates (same rule as request_token)
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+            sock.settimeout(_remaining(deadline))
+            sock = context.wrap_socket(sock, server_hostname=host)
+            timings['tls_ms'] = _ms(time.monotonic() - mark)
+
+        connection = http.client.HTTPSConnection(host, port) if https else http.client.HTTPConnection(host, port)
+        connection.sock = sock
+        auth = base64.b64encode(f"{client_id}:{client_secret}".encode()).decode()
+        mark = time.monotonic()
+        sock.settimeout(_remaining(deadline))
+        connection.request('POST', '/auth/oauth2/token', body='grant_type=client_credentials', headers={
+            'Authorization': f'Basic {auth}',
+            'Content-Type': 'application/x-www-form-urlencoded',
+            'Connection': 'close'
+        })
+        response = connection.getresponse()
+        timings['ttfb_ms'] = _ms(time.monotonic() - mark)
+        body = response.read()
+        timings['total_ms'] = _ms(time.monotonic() - started)
+    finally:
+        sock.close()
+
+    result = dict(timings, status=response.status, ok=False)
+    try:
+        result['ok'] = response.status == 200 and bool(json.loads(body).get('access_token'))
+    except (ValueError, AttributeError):
+        pass
+    if not result['ok']:
+        result['error'] = f"HTTP {response.status}: {body[:200].decode(errors='replace')}"
+    return result
+
+
+def timed_login(base_uri: str, username: str, password: str, deadline: float) -> Dict:
+    """
+    Full SessionAuth login (no retries, so slowness isn't hidden), each
+    request limited to the time left before the deadline.
+    """
+    from resilience import NO_RETRY
+    from session_auth_helper import SessionAuth
+
+    started = time.monotonic()
+    SessionAuth(base_uri, username, password, retry_policy=NO_RETRY, timeout=_remaining(deadline))
+    return {'login_ms': _ms(time.monotonic() - started), 'ok': True}
+
+
+# ============================================================================
+# PREFLIGHT
+# ============================================================================
+
+def check_environment(entry: Dict, deadline_seconds: float = DEFAULT_DEADLINE, executor=None) -> Dict:
+    """
+    Run the token and login checks for one entry; never raises. The login runs
+    on executor (run_preflight passes a shared pool), or on a private
+    single-use thread pool when executor is None.
+    """
+    deadline = time.monotonic() + deadline_seconds
+    result = {'env_id': entry['env_id'], 'token': 'skipped', 'login': 'skipped'}
+    try:
+        started = time.monotonic()
+        base_uri = resolve_base_uri(entry['env_id'])
+        result['resolve_ms'] = _ms(time.monotonic() - started)
+        result['base_uri'] = base_uri
+
+        client_id = entry.get('client_id') or os.getenv('CLIENT_ID')
+        client_secret = entry.get('client_secret') or entry.get('secret') or os.getenv('SECRET_KEY')
+        if client_id and client_secret:
+            try:
+                token = timed_token_request(base_uri, client_id, client_secret, deadline)
+                result['token'] = 'ok' if token.pop('ok') else 'failed'
+                if 'error' in token:
+                    result['token_error'] = token.pop('error')
+                result.update(token)
+            except (DeadlineExceeded, socket.timeout) as e:
+                result['token'], result['token_error'] = 'timeout', str(e) or 'Timed out'
+            except Exception as e:
+                result['token'], result['token_error'] = 'failed', f"{type(e).__name__}: {e}"
+
+        username = entry.get('username') or os.getenv('USERNAME')
+        password = entry.get('password') or os.getenv('PASSWORD')
+        if username and password:
+            # The login's requests time out on their own; the overall deadline
+            # across its two requests is enforced from outside
+            private = ThreadPoolExecutor(max_workers=1, thread_name_prefix='preflight-login') \
+                if executor is None else None
+            future = (executor or private).submit(timed_login, base_uri, username, password, deadline)
+            try:
+                login = future.result(timeout=max(0.0, deadline - time.monotonic()))
+                result['login'] = 'ok'
+                result['login_ms'] = login['login_ms']
+            except (FutureTimeout, DeadlineExceeded, requests.Timeout):
+                result['login'], result['login_error'] = 'timeout', 'Deadline exceeded'
+            except Exception as e:
+                result['login'], result['login_error'] = 'failed', f"{type(e).__name__}: {e}"
+            finally:
+                if private is not None:
+                    # The login's own timeouts end it; don't wait for that here
+                    private.shutdown(wait=False)
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    result['ok'] = 'error' not in result and result['token'] in ('ok', 'skipped') and \
+        result['login'] in ('ok', 'skipped')
+    return result
+
+
+def run_preflight(entries: Iterable[Dict], max_workers: int = 32,
+                  deadline_seconds: float = DEFAULT_DEADLINE) -> List[Dict]:
+    """Check every entry concurrently. Results are in input order."""
+    from session_auth_helper import load_env
+
+    load_env()
+    entries = list(entries)
+    # Logins run on their own pool so a hung login can't starve the checks waiting on it
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='preflight') as checks, \
+            ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='preflight-login') as logins:
+        return list(checks.map(lambda entry: check_environment(entry, deadline_seconds, logins), entries))
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def summarize(results: List[Dict]) -> Dict:
+    """Failure counts plus p50/p95 of each phase across environments."""
+    summary = {
+        'environments': len(results),
+        'failed': sum(1 for r in results if not r['ok']),
+        'token_failures': sum(1 for r in results if r['token'] in ('failed', 'timeout')),
+        'login_failures': sum(1 for r in results if r['login'] in ('failed', 'timeout')),
+        'phases': {}
+    }
+    for phase in PHASES:
+        values = [r[phase] for r in results if r.get(phase) is not None]
+        if values:
+            summary['phases'][phase] = {'p50': _percentile(values, 0.5), 'p95': _percentile(values, 0.95)}
+    return summary
+
+
+def format_table(results: List[Dict]) -> str:
+    """Fixed-width table of results, slowest (by total + login time) first."""
+    def slowness(r):
+        return (r.get('total_ms') or 0) + (r.get('login_ms') or 0)
+
+    def cell(value):
+        return '-' if value is None else f"{value:.0f}"
+
+    header = f"{'env_id':<40} {'token':>7} {'session':>7} " + ' '.join(f"{p[:-3]:>8}" for p in PHASES) + "  error"
+    lines = [header, '-' * len(header)]
+    for r in sorted(results, key=slowness, reverse=True):
+        error = r.get('error') or r.get('token_error') or r.get('login_error') or ''
+        lines.append(f"{r['env_id'][:40]:<40} {r['token']:>7} {r['login']:>7} "
+                     + ' '.join(f"{cell(r.get(p)):>8}" for p in PHASES)
+                     + f"  {error.splitlines()[0][:80] if error else ''}")
+    return '\n'.join(lines)
+
+
+def main():
+    import argparse
+    from setup_external_providers import iter_manifest
+
+    parser = argparse.ArgumentParser(description='Check credentials and connectivity for many environments')
+    parser.add_argument('--manifest', required=True, help='Environments with credentials (CSV, JSON or JSONL)')
+    parser.add_argument('--workers', type=int, default=32, help='Environments checked concurrently')
+    parser.add_argument('--deadline', type=float, default=DEFAULT_DEADLINE,
+                        help='Seconds allowed per environment for all of its checks')
+    parser.add_argument('--json', help='Also write results and summary as JSON here ("-" for stdout)')
+    args = parser.parse_args()
+
+    results = run_preflight(iter_manifest(args.manifest), args.workers, args.deadline)
+    summary = summarize(results)
+
+    if args.json == '-':
+        print(json.dumps({'summary': summary, 'results': results}, indent=2))
+    else:
+        print(format_table(results))
+        print()
+        for phase, stats in summary['phases'].items():
+            print(f"{phase[:-3]:>8}: p50 {stats['p50']:.0f} ms, p95 {stats['p95']:.0f} ms")
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump({'summary': summary, 'results': results}, f, indent=2)
+            print(f"\nResults written to {args.json}")
+
+    if summary['failed']:
+        print(f"\n❌ {summary['failed']} of {summary['environments']} environments failed "
+              f"({summary['token_failures']} token, {summary['login_failures']} login)", file=sys.stderr)
+        sys.exit(1)
+    print(f"\n✅ All {summary['environments']} environments passed", file=sys.stderr)
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+DocuSign Pending Provider Watcher
+
+setup_docusign_provider() creates DocuSign providers in the 'pending' state
+until Luminance support activates them. This watcher tracks the pending
+DocuSign providers of many environments and reports when their state changes.
+
+Each environment is polled with a single filtered list call
+(/api/external_providers?type=docusign), however many providers it has
+pending. Poll intervals adapt per environment: they start at --min-interval,
+grow by --backoff after each poll where nothing changed (up to
+--max-interval), and drop back to the minimum as soon as something does.
+Environments whose providers are no longer pending stop being polled.
+
+Events are written as JSON lines:
+    {"event": "watching", "env_id": ..., "provider_id": ..., "name": ..., "state": "pending", ...}
+    {"event": "activated", ..., "from": "pending", "to": "active", "pending_seconds": 5400.0}
+    {"event": "state_changed", ..., "from": "pending", "to": "<other state>"}
+    {"event": "removed", ...}           provider deleted while being watched
+    {"event": "poll_error", "env_id": ..., "error": ...}
+    {"event": "settled", "env_id": ...} environment has nothing pending left
+    {"event": "abandoned", "env_id": ...} too many consecutive poll errors
+
+Usage:
+    python3 docusign_watcher.py --manifest wave.csv --secret <SECRET_KEY> \
+        [--min-interval 60] [--max-interval 1800] [--output events.jsonl] [--state watch-state.json]
+"""
+import heapq
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, Optional
+
+from resilience import CircuitOpenError
+from setup_external_providers import iter_external_providers
+
+PENDING_STATE = 'pending'
+ACTIVE_STATE = 'active'
+DEFAULT_MIN_INTERVAL = 60.0
+DEFAULT_MAX_INTERVAL = 1800.0
+DEFAULT_BACKOFF = 1.5
+# Consecutive failed polls after which an environment is given up on
+DEFAULT_MAX_ERRORS = 10
+# +/- fraction of randomness added to each interval so environments don't poll in lockstep
+INTERVAL_JITTER = 0.1
+
+
+class WatchedEnvironment:
+    """Polling state for one environment."""
+    def __init__(self, env_id: str, secret: str, interval: float):
+        self.env_id = env_id
+        self.secret = secret
+        self.interval = interval
+        self.next_poll = 0.0
+        self.polls = 0
+        self.errors = 0
+        self.abandoned = False
+        # provider id -> {'name', 'state', 'pending_since'} for providers seen pending
+        self.providers: Dict[int, Dict] = {}
+
+    @property
+    def settled(self) -> bool:
+        return self.polls > 0 and not any(p['state'] == PENDING_STATE for p in self.providers.values())
+
+    @property
+    def finished(self) -> bool:
+        return self.settled or self.abandoned
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class PendingProviderWatcher:
+    """
+    Polls environments for pending DocuSign providers and calls on_event(dict)
+    for every state transition.
+
+    Args:
+        on_event: Called (from worker threads, serialised) with each event dict
+        pool: provisioning_server.WarmSessionPool used to log in (default: a new one)
+        min_interval / max_interval: Bounds for the per-environment poll interval (seconds)
+        backoff: Interval multiplier after a poll with no transitions
+        max_workers: Environments polled concurrently
+        max_errors: Consecutive failed polls before an environment is abandoned
+    """
+    def __init__(self, on_event: Callable[[Dict], None], pool=None,
+                 min_interval: float = DEFAULT_MIN_INTERVAL, max_interval: float = DEFAULT_MAX_INTERVAL,
+                 backoff: float = DEFAULT_BACKOFF, max_workers: int = 8, max_errors: int = DEFAULT_MAX_ERRORS):
+        if pool is None:
+            from provisioning_server import WarmSessionPool
+            pool = WarmSessionPool(idle_ttl=max_interval * 2)
+        self.pool = pool
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.max_workers = max_workers
+        self.max_errors = max_errors
+        self.environments: Dict[str, WatchedEnvironment] = {}
+        self.list_calls = 0
+        self._on_event = on_event
+        self._event_lock = threading.Lock()
+
+    def add_environment(self, env_id: str, secret: str, providers: Optional[Dict[int, Dict]] = None):
+        """Start watching env_id (optionally with provider state restored from a previous run)."""
+        environment = WatchedEnvironment(env_id, secret, self.min_interval)
+        environment.providers = dict(providers or {})
+        self.environments[env_id] = environment
+
+    def _emit(self, event: str, environment: WatchedEnvironment, **fields):
+        with self._event_lock:
+            self._on_event(dict(event=event, env_id=environment.env_id, at=_now_iso(), **fields))
+
+    def _jittered(self, interval: float) -> float:
+        return interval * random.uniform(1 - INTERVAL_JITTER, 1 + INTERVAL_JITTER)
+
+    def poll(self, environment: WatchedEnvironment) -> int:
+        """
+        List environment's DocuSign providers once, emit transitions and
+        schedule its next poll. Returns the number of transitions.
+        """
+        now = time.time()
+        try:
+            session = self.pool.acquire(environment.env_id, environment.secret).session
+            with self._event_lock:
+                self.list_calls += 1
+            listed = {p['id']: p for p in iter_external_providers(session, filters={'type': 'docusign'})
+                      if p.get('id') is not None}
+        except Exception as e:
+            if not isinstance(e, CircuitOpenError):
+                # Could be an expired login - start from a fresh one next time
+                self.pool.discard(environment.env_id, environment.secret)
+            self._emit('poll_error', environment, error=str(e))
+            environment.errors += 1
+            if environment.errors >= self.max_errors:
+                environment.abandoned = True
+                self._emit('abandoned', environment, errors=environment.errors)
+            environment.interval = min(self.max_interval, environment.interval * self.backoff)
+            environment.next_poll = time.monotonic() + self._jittered(environment.interval)
+            return 0
+
+        environment.errors = 0
+        transitions = 0
+        for provider_id, tracked in list(environment.providers.items()):
+            if tracked['state'] != PENDING_STATE:
+                continue
+            current = listed.get(provider_id)
+            common = dict(provider_id=provider_id, name=tracked['name'])
+            if current is None:
+                del environment.providers[provider_id]
+                self._emit('removed', environment, **common)
+                transitions += 1
+            elif current.get('state') != PENDING_STATE:
+                tracked['state'] = current.get('state')
+                event = 'activated' if tracked['state'] == ACTIVE_STATE else 'state_changed'
+                self._emit(event, environment, **common, **{'from': PENDING_STATE, 'to': tracked['state']},
+                           pending_seconds=round(now - tracked['pending_since'], 1))
+                transitions += 1
+
+        for provider_id, provider in listed.items():
+            if provider.get('state') == PENDING_STATE and provider_id not in environment.providers:
+                environment.providers[provider_id] = {
+                    'name': provider.get('name'), 'state': PENDING_STATE, 'pending_since': now
+                }
+                self._emit('watching', environment, provider_id=provider_id, name=provider.get('name'),
+                           state=PENDING_STATE)
+                transitions += 1
+
+        environment.polls += 1
+        if environment.settled:
+            self._emit('settled', environment)
+        # Something changed: look again soon; otherwise back off
+        environment.interval = self.min_interval if transitions else min(
+            self.max_interval, environment.interval * self.backoff
+        )
+        environment.next_poll = time.monotonic() + self._jittered(environment.interval)
+        return transitions
+
+    def run(self, stop: Optional[threading.Event] = None):
+        """
+        Poll until every environment has settled or been abandoned (or stop is set). Due
+        environments are polled concurrently, at most max_workers at a time.
+        """
+        stop = stop or threading.Event()
+        schedule = [(0.0, env_id) for env_id in self.environments]
+        heapq.heapify(schedule)
+        in_flight = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='docusign-watch') as executor:
+            while (schedule or in_flight) and not stop.is_set():
+                now = time.monotonic()
+                while schedule and schedule[0][0] <= now and len(in_flight) < self.max_workers:
+                    _, env_id = heapq.heappop(schedule)
+                    environment = self.environments[env_id]
+                    in_flight[executor.submit(self.poll, environment)] = environment
+
+                timeout = max(0.0, schedule[0][0] - now) if schedule and len(in_flight) < self.max_workers else None
+                if in_flight:
+                    done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        environment = in_flight.pop(future)
+                        future.result()
+                        if not environment.finished:
+                            heapq.heappush(schedule, (environment.next_poll, environment.env_id))
+                elif timeout:
+                    stop.wait(timeout)
+
+    def state(self) -> Dict[str, Dict]:
+        """Tracked providers per environment, for saving with save_state()."""
+        return {
+            env_id: {str(provider_id): dict(provider) for provider_id, provider in environment.providers.items()}
+            for env_id, environment in self.environments.items()
+        }
+
+
+def load_state(path: str) -> Dict[str, Dict[int, Dict]]:
+    """Read a state file written by save_state(); missing file -> {}."""
+    try:
+        with open(path, 'r') as f:
+            saved = json.load(f)
+    except FileNotFoundError:
+        return {}
+    return {env_id: {int(provider_id): p for provider_id, p in providers.items()}
+            for env_id, providers in saved.items()}
+
+
+def save_state(path: str, state: Dict):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f, indent=2)
+    # Atomic replace, so an interrupted write never leaves a truncated file
+    os.replace(path + '.tmp', path)
+
+
+def watch_environments(entries: Iterable[Dict], out, default_secret: Optional[str] = None,
+                       state_path: Optional[str] = None, **options) -> Dict:
+    """
+    Watch the environments of manifest entries (only env_id and secret are
+    used), writing events to `out` as JSON lines.
+
+    Returns:
+        Counts of each event type plus `list_calls`.
+    """
+    counts = {}
+    saved = load_state(state_path) if state_path else {}
+
+    def on_event(event):
+        counts[event['event']] = counts.get(event['event'], 0) + 1
+        out.write(json.dumps(event, default=str) + '\n')
+        out.flush()
+        if state_path and event['event'] not in ('poll_error', 'watching'):
+            save_state(state_path, watcher.state())
+
+    watcher = PendingProviderWatcher(on_event, **options)
+    for entry in entries:
+        secret = entry.get('secret') or default_secret
+        if not secret:
+            raise ValueError(f"No secret for environment {entry['env_id']} and no --secret given")
+        watcher.add_environment(entry['env_id'], secret, saved.get(entry['env_id']))
+    try:
+        watcher.run()
+    finally:
+        if state_path:
+            save_state(state_path, watcher.state())
+    return dict(counts, list_calls=watcher.list_calls)
+
+
+def main():
+    import argparse
+    from setup_external_providers import iter_manifest
+
+    parser = argparse.ArgumentParser(description='Report when pending DocuSign providers are activated')
+    parser.add_argument('--manifest', required=True, help='Manifest of environments to watch (CSV, JSON or JSONL)')
+    parser.add_argument('--secret', help='Luminance API secret key (default for entries without one)')
+    parser.add_argument('--min-interval', type=float, default=DEFAULT_MIN_INTERVAL,
+                        help='Seconds between polls of an environment right after a change')
+    parser.add_argument('--max-interval', type=float, default=DEFAULT_MAX_INTERVAL,
+                        help='Longest gap between polls of an environment')
+    parser.add_argument('--backoff', type=float, default=DEFAULT_BACKOFF,
+                        help='Interval multiplier after a poll with no changes')
+    parser.add_argument('--workers', type=int, default=8, help='Environments polled concurrently')
+    parser.add_argument('--output', help='Append JSONL events here (default: stdout)')
+    parser.add_argument('--state', help='Remember pending providers here between runs')
+    args = parser.parse_args()
+
+    out = open(args.output, 'a') if args.output else sys.stdout
+    try:
+        summary = watch_environments(
+            iter_manifest(args.manifest), out, default_secret=args.secret, state_path=args.state,
+            min_interval=args.min_interval, max_interval=args.max_interval, backoff=args.backoff,
+            max_workers=args.workers
+        )
+    except KeyboardInterrupt:
+        print("Stopped", file=sys.stderr)
+        return None
+    finally:
+        if args.output:
+            out.close()
+
+    print(f"✅ All watched providers settled: {summary.get('activated', 0)} activated, "
+          f"{summary.get('state_changed', 0)} changed state, {summary.get('removed', 0)} removed "
+          f"({summary['list_calls']} list calls)", file=sys.stderr)
+    if summary.get('abandoned'):
+        print(f"❌ {summary['abandoned']} environments abandoned after repeated poll errors", file=sys.stderr)
+        sys.exit(1)
+    return summary
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""
+Environment Resolver
+
+Turns an environment ID, moniker, hostname or URL into a base URI. This is the
+one place that logic lives; oauth_session, session_auth_helper,
+setup_external_providers and test_oauth_credentials.py all call
+resolve_base_uri().
+
+- Full URLs and *.luminance.com hostnames are used as given.
+- Numeric IDs (e.g. '006403') go through lumpy.api.default_base_uri, or
+  https://<id>.support.luminance.com when lumpy isn't installed.
+- Bare monikers could live on either .app.luminance.com or
+  .support.luminance.com. Both candidates are probed concurrently with short
+  timeouts, and the first healthy one in CANDIDATE_DOMAINS order wins (so
+  .support is only chosen when .app is unhealthy, however fast it answers),
+  so a wrong guess never costs a failed token or login request. Healthy means
+  /login serves the login page (with its CSRF token) or redirects within the
+  same host; other redirects and auth challenges don't count.
+
+Probe results are cached in memory and on disk ($LUMINANCE_RESOLVER_CACHE or
+~/.luminance/resolved_environments.json) for $LUMINANCE_RESOLVER_TTL seconds
+(default 7 days), so later runs skip resolution entirely.
+
+Usage:
+    from env_resolver import resolve_base_uri, resolver
+
+    base_uri = resolve_base_uri('paddy-integrations-corporate-internal')
+    resolver.forget('paddy-integrations-corporate-internal')   # re-probe next time
+"""
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+from urllib.parse import urljoin, urlparse
+
+from tracing import span
+
+CANDIDATE_DOMAINS = ('app.luminance.com', 'support.luminance.com')
+DEFAULT_CACHE_TTL = float(os.getenv("LUMINANCE_RESOLVER_TTL", str(7 * 24 * 3600)))
+# (connect, read) timeouts for a probe
+PROBE_TIMEOUT = (2.0, 3.0)
+# Redirects from /login that still count as healthy if they stay on the same host
+REDIRECT_STATUSES = frozenset([301, 302, 303, 307, 308])
+
+
+def default_cache_path() -> str:
+    return os.getenv("LUMINANCE_RESOLVER_CACHE") or \
+        os.path.join(os.path.expanduser("~"), ".luminance", "resolved_environments.json")
+
+
+def static_base_uri(env_id: str) -> Optional[str]:
+    """The base URI for env_id if it can be worked out without probing, else None."""
+    if env_id.startswith('http://') or env_id.startswith('https://'):
+        # Full URL provided
+        return env_id.rstrip('/')
+    if '.app.luminance.com' in env_id or '.support.luminance.com' in env_id:
+        # Moniker with domain provided (e.g., 'paddy-integrations-corporate-internal.app.luminance.com')
+        return f"https://{env_id}".rstrip('/')
+    if len(env_id) == 6 and env_id.isdigit():
+        # Numeric ID (e.g., '006403') - lives on support.luminance.com
+        try:
+            import lumpy.api
+        except ImportError:
+            return f"https://{env_id}.support.luminance.com"
+        return lumpy.api.default_base_uri(env_id)
+    return None
+
+
+def candidate_base_uris(moniker: str) -> List[str]:
+    """Base URIs a bare moniker might resolve to, most common first."""
+    return [f"https://{moniker}.{domain}" for domain in CANDIDATE_DOMAINS]
+
+
+def probe(base_uri: str, timeout=PROBE_TIMEOUT) -> bool:
+    """
+    Whether base_uri answers its /login page like a Luminance environment: the
+    login page itself (carrying the CSRF token a login needs), or a redirect
+    that stays on the same host. Wildcard DNS, parking pages and redirects or
+    auth challenges from other hosts are not healthy.
+    """
+    from session_auth_helper import extract_csrf_token
+    from session_metrics import instrumented_request
+    from transport import transports
+
+    try:
+        # Through the shared transport, so the winner's connection is reused
+        # by the token or login request that follows
+        response = instrumented_request(
+            transports.request, 'GET', f"{base_uri}/login", timeout=timeout, allow_redirects=False
+        )
+    except Exception:
+        return False
+    if response.status_code in REDIRECT_STATUSES:
+        location = urljoin(f"{base_uri}/login", response.headers.get('Location') or '')
+        return urlparse(location).netloc.lower() == urlparse(base_uri).netloc.lower()
+    if response.status_code != 200:
+        return False
+    try:
+        extract_csrf_token(response.text)
+    except ValueError:
+        return False
+    return True
+
+
+class EnvironmentResolver:
+    """
+    Resolves environment IDs with probing and a TTL'd disk cache.
+
+    Args:
+        cache_path: JSON cache file (None disables the disk cache)
+        ttl: Seconds a probed result is trusted
+        prober: probe-compatible function, base_uri -> bool
+    """
+    def __init__(self, cache_path: Optional[str] = None, ttl: float = DEFAULT_CACHE_TTL, prober=probe):
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.prober = prober
+        self._lock = threading.Lock()
+        self._entries: Optional[Dict[str, Dict]] = None
+        self._probe_locks: Dict[str, threading.Lock] = {}
+
+    # --- cache -----------------------------------------------------------
+
+    def _load(self) -> Dict[str, Dict]:
+        if self._entries is None:
+            self._entries = {}
+            if self.cache_path:
+                try:
+                    with open(self.cache_path, 'r') as f:
+                        self._entries = json.load(f)
+                except (OSError, ValueError):
+                    pass
+        return self._entries
+
+    def _save(self):
+        if not self.cache_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.cache_path) or '.', mode=0o700, exist_ok=True)
+            tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(self._entries, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.cache_path)
+        except OSError:
+            # The cache is an optimisation; resolution still works without it
+            pass
+
+    def cached(self, env_id: str) -> Optional[str]:
+        """The cached base URI for env_id if it hasn't expired."""
+        with self._lock:
+            entry = self._load().get(env_id)
+        if entry and time.time() - entry.get('resolved_at', 0) < self.ttl:
+            return entry['base_uri']
+        return None
+
+    def remember(self, env_id: str, base_uri: str):
+        with self._lock:
+            # Merge with what other processes may have written meanwhile
+            self._entries = None
+            self._load()[env_id] = {'base_uri': base_uri, 'resolved_at': time.time()}
+            self._save()
+
+    def forget(self, env_id: str):
+        """Drop env_id from the cache (e.g. after the environment moved)."""
+        with self._lock:
+            self._entries = None
+            if self._load().pop(env_id, None) is not None:
+                self._save()
+
+    # --- resolution --------------------------------------------------------
+
+    def probe_first_healthy(self, candidates: List[str]) -> Optional[str]:
+        """
+        Probe all candidates at once and return the first healthy one in
+        candidate order (not the first to answer), or None. A later candidate
+        only wins once every earlier one has been found unhealthy, so the
+        result doesn't depend on which host happens to respond faster.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        executor = ThreadPoolExecutor(max_workers=len(candidates), thread_name_prefix='env-probe')
+        try:
+            futures = [executor.submit(self.prober, candidate) for candidate in candidates]
+            for candidate, future in zip(candidates, futures):
+                if future.result():
+                    return candidate
+            return None
+        finally:
+            # Don't wait for later probes once an earlier candidate is healthy
+            executor.shutdown(wait=False)
+
+    def resolve(self, env_id: str) -> str:
+        """Return the base URI for env_id, probing (once per TTL) if it is a bare moniker."""
+        env_id = env_id.strip()
+        static = static_base_uri(env_id)
+        if static is not None:
+            return static
+        cached = self.cached(env_id)
+        if cached:
+            return cached
+
+        with self._lock:
+            probe_lock = self._probe_locks.setdefault(env_id, threading.Lock())
+        # Concurrent callers for the same moniker share one round of probes
+        with probe_lock:
+            cached = self.cached(env_id)
+            if cached:
+                return cached
+            candidates = candidate_base_uris(env_id)
+            base_uri = self.probe_first_healthy(candidates)
+            if base_uri is None:
+                # Nothing answered (offline, or a host that blocks /login) - fall
+                # back to the usual guess without caching it
+                return candidates[0]
+            self.remember(env_id, base_uri)
+            return base_uri
+
+
+resolver = EnvironmentResolver(default_cache_path())
+
+
+def resolve_base_uri(env_id: str) -> str:
+    """Turn an environment ID, moniker, hostname or URL into a base URI."""
+    with span('resolve_environment', env_id=env_id) as current:
+        base_uri = resolver.resolve(env_id)
+        current.set_attribute('base_uri', base_uri)
+        return base_uri
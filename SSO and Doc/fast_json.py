@@ -0,0 +1,207 @@
+"""
+Fast JSON Encoding/Decoding for API Payloads
+
+Uses orjson when it is installed (several times faster than the stdlib json
+module on large provider lists) and the stdlib otherwise; results are the
+same either way. Set LUMINANCE_JSON_BACKEND=json to force the stdlib.
+
+- loads()/dumps(): module-level codec. Anything orjson can't encode
+  (non-string dict keys, ...), rejects as invalid or would write
+  differently (NaN/Infinity, which orjson turns into null) goes to the
+  stdlib, so results and errors don't depend on the backend. The one exception:
+  integers wider than 64 bits, which the API never sends, decode as floats
+  under orjson
+- response_json(response): response.json() for requests/httpx/lumpy responses
+- iter_json_array(response): yield the items of a JSON array response one at
+  a time, from the stream when the response was requested with stream=True,
+  so a huge unpaged list is never held as one decoded list
+- json_body(kwargs): turn a json= request argument into a compact
+  pre-encoded body, gzipped when LUMINANCE_GZIP_REQUEST_MIN_BYTES is set
+  (only for servers that accept Content-Encoding: gzip request bodies)
+
+Responses need nothing here: requests and httpx already send
+Accept-Encoding: gzip, deflate and decompress transparently.
+
+Usage:
+    from fast_json import iter_json_array, json_body, response_json
+
+    data = response_json(session.get('/api/users/me'))
+    session.session.request('PUT', url, **json_body({'json': config}))
+"""
+import gzip
+import json
+import math
+import os
+from typing import Dict, Iterator
+
+# Chunk size when decoding a streamed response
+STREAM_CHUNK_SIZE = 64 * 1024
+# Gzip request bodies at least this large (0 = never)
+GZIP_REQUEST_MIN_BYTES = int(os.getenv("LUMINANCE_GZIP_REQUEST_MIN_BYTES", "0"))
+
+_UNRESOLVED = object()
+_orjson = _UNRESOLVED
+
+
+def _fast_backend():
+    """orjson, imported on first use (keeps it out of startup), or None."""
+    global _orjson
+    if _orjson is _UNRESOLVED:
+        module = None
+        if os.getenv("LUMINANCE_JSON_BACKEND", "orjson") != "json":
+            try:
+                import orjson as module
+            except ImportError:
+                pass
+        _orjson = module
+    return _orjson
+
+
+def backend() -> str:
+    """Name of the JSON backend in use: 'orjson' or 'json'."""
+    return 'json' if _fast_backend() is None else 'orjson'
+
+
+def loads(data):
+    """Decode JSON from bytes or str."""
+    orjson = _fast_backend()
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # Invalid JSON raises the stdlib's error, whichever backend is in use
+            pass
+    return json.loads(data)
+
+
+def _has_non_finite(obj) -> bool:
+    if isinstance(obj, float):
+        return not math.isfinite(obj)
+    if isinstance(obj, dict):
+        return any(_has_non_finite(value) for value in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return any(_has_non_finite(value) for value in obj)
+    return False
+
+
+def dumps(obj) -> bytes:
+    """Encode obj as compact UTF-8 JSON bytes (NaN/Infinity rejected, as requests does)."""
+    orjson = _fast_backend()
+    if orjson is not None:
+        try:
+            encoded = orjson.dumps(obj)
+        except TypeError:
+            pass
+        else:
+            # orjson writes NaN/Infinity as null; only output containing null
+            # needs checking, and the stdlib then raises ValueError for them
+            if b'null' not in encoded or not _has_non_finite(obj):
+                return encoded
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False, allow_nan=False).encode('utf-8')
+
+
+def response_json(response):
+    """Decode a response's JSON body (requests, httpx and lumpy responses alike)."""
+    content = response.content
+    if not content or not content.strip():
+        # Preserve the error response.json() raises for an empty body
+        return response.json()
+    return loads(content)
+
+
+# ============================================================================
+# INCREMENTAL DECODING
+# ============================================================================
+
+def _chunks(response) -> Iterator[bytes]:
+    consumed = getattr(response, '_content_consumed', True)
+    if not consumed and hasattr(response, 'iter_content'):
+        return response.iter_content(STREAM_CHUNK_SIZE)
+    content = response.content
+    return (content[i:i + STREAM_CHUNK_SIZE] for i in range(0, len(content), STREAM_CHUNK_SIZE))
+
+
+def iter_json_array(response) -> Iterator:
+    """
+    Yield the items of a top-level JSON array response as they are decoded.
+
+    Reads the body in chunks (straight from the connection if the response
+    was requested with stream=True and hasn't been read yet), so memory holds
+    one chunk plus the item being decoded rather than the whole list. The
+    response is closed once the array ends or iteration stops.
+
+    Raises:
+        ValueError: the body is not a JSON array (json.JSONDecodeError for
+                    malformed JSON)
+    """
+    import codecs
+
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder('utf-8-sig')()
+    buffer, position, started = '', 0, False
+    try:
+        chunks = _chunks(response)
+        exhausted = False
+        while True:
+            # Skip whitespace and separators up to the next item
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position < len(buffer):
+                if not started:
+                    if buffer[position] != '[':
+                        raise ValueError("Response is not a JSON array")
+                    started = True
+                    position += 1
+                    continue
+                if buffer[position] == ']':
+                    return
+                try:
+                    item, end = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    if exhausted:
+                        raise
+                    end = None
+                # An item is complete once a separator follows it; until then a
+                # number such as '-1.' may continue in the next chunk
+                if end is not None and (end < len(buffer) and buffer[end] in ' \t\r\n,]' or exhausted):
+                    position = end
+                    yield item
+                    continue
+            elif exhausted:
+                raise ValueError("Response ended before the JSON array was closed")
+
+            chunk = next(chunks, None)
+            if chunk is None:
+                exhausted = True
+                buffer = buffer[position:] + text.decode(b'', final=True)
+            else:
+                buffer = buffer[position:] + text.decode(chunk)
+            position = 0
+    finally:
+        close = getattr(response, 'close', None)
+        if close is not None:
+            close()
+
+
+# ============================================================================
+# REQUEST BODIES
+# ============================================================================
+
+def json_body(kwargs: Dict, gzip_min_bytes: int = GZIP_REQUEST_MIN_BYTES) -> Dict:
+    """
+    Request kwargs with any json= argument replaced by an encoded data= body
+    and a Content-Type header, gzipped (Content-Encoding: gzip) if it is at
+    least gzip_min_bytes long and gzip_min_bytes is set.
+    """
+    if kwargs.get('json') is None:
+        return kwargs
+    kwargs = dict(kwargs)
+    body = dumps(kwargs.pop('json'))
+    headers = dict(kwargs.get('headers') or {})
+    headers.setdefault('Content-Type', 'application/json')
+    if gzip_min_bytes and len(body) >= gzip_min_bytes:
+        body = gzip.compress(body, compresslevel=6)
+        headers['Content-Encoding'] = 'gzip'
+    kwargs['data'] = body
+    kwargs['headers'] = headers
+    return kwargs
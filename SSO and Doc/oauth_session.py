@@ -4,54 +4,245 @@ OAuth2 Session Helper for Luminance API
 This module provides an OAuth2-based session that works with the setup_external_providers scripts.
 """
 import base64
-import requests
 import os
+import threading
+import time
+
+from env_resolver import resolve_base_uri  # noqa: F401 - re-exported for existing callers
+from fast_json import json_body, response_json
+from resilience import call_with_retry
+from session_metrics import instrumented_request, operation
+from transport import transports
+
+# Tokens are treated as expired this many seconds before the server says they
+# are (at most a tenth of the token's lifetime, so short-lived tokens stay usable)
+TOKEN_EXPIRY_SKEW = 60
+# Once this fraction of a token's lifetime has passed, it is refreshed in the background
+TOKEN_REFRESH_AHEAD = 0.8
+
+
+class CachedToken:
+    """
+    An access token plus when it was issued and how long it lives (monotonic
+    clock). A token issued without expires_in has no known lifetime and is
+    used until the API rejects it with a 401.
+    """
+    def __init__(self, access_token, expires_in=None):
+        self.access_token = access_token
+        self.issued_at = time.monotonic()
+        self.lifetime = None if expires_in in (None, '') else float(expires_in)
+    
+    @property
+    def expires_at(self):
+        return None if self.lifetime is None else self.issued_at + self.lifetime
+    
+    def is_valid(self, now=None):
+        if self.lifetime is None:
+            return True
+        now = time.monotonic() if now is None else now
+        return now < self.expires_at - min(TOKEN_EXPIRY_SKEW, self.lifetime / 10)
+    
+    def needs_refresh(self, now=None):
+        if self.lifetime is None:
+            return False
+        now = time.monotonic() if now is None else now
+        return now >= self.issued_at + self.lifetime * TOKEN_REFRESH_AHEAD
+
+
+class TokenCache:
+    """
+    Thread-safe OAuth2 token cache keyed by (base_uri, client_id).
+    
+    Tokens are reused until shortly before expiry. Concurrent callers that find
+    no valid token share a single token request (single-flight), and tokens
+    close to expiry are refreshed on a background thread while the current one
+    keeps being served.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens = {}
+        self._fetch_locks = {}
+    
+    def _fetch_lock(self, key):
+        with self._lock:
+            lock = self._fetch_locks.get(key)
+            if lock is None:
+                lock = self._fetch_locks[key] = threading.Lock()
+            return lock
+    
+    def get(self, key, fetch):
+        """
+        Return a valid access token for key, calling fetch() (which must return
+        a CachedToken) only when there is none.
+        """
+        token = self._tokens.get(key)
+        if token is not None and token.is_valid():
+            if token.needs_refresh():
+                self._refresh_in_background(key, fetch)
+            return token.access_token
+        
+        with self._fetch_lock(key):
+            # Another thread may have fetched a token while we were waiting
+            token = self._tokens.get(key)
+            if token is not None and token.is_valid():
+                return token.access_token
+            token = fetch()
+            self._tokens[key] = token
+            return token.access_token
+    
+    def _refresh_in_background(self, key, fetch):
+        lock = self._fetch_lock(key)
+        if not lock.acquire(blocking=False):
+            # A refresh for this key is already in flight
+            return
+        
+        def refresh():
+            try:
+                self._tokens[key] = fetch()
+            except Exception:
+                # Keep serving the current token; the next foreground call retries
+                pass
+            finally:
+                lock.release()
+        
+        threading.Thread(target=refresh, name=f"oauth-refresh-{key[1][:8]}", daemon=True).start()
+    
+    def peek(self, key):
+        """Return the cached access token for key if it is still valid, else None."""
+        token = self._tokens.get(key)
+        return token.access_token if token is not None and token.is_valid() else None
+    
+    def store(self, key, token):
+        """Cache a CachedToken fetched outside get() (e.g. by the async session)."""
+        self._tokens[key] = token
+    
+    def invalidate(self, key=None):
+        """Drop one cached token, or all of them if key is None."""
+        with self._lock:
+            if key is None:
+                self._tokens.clear()
+            else:
+                self._tokens.pop(key, None)
+
+
+# Process-wide cache shared by every create_oauth_session() call
+token_cache = TokenCache()
 
 
 class OAuthSession:
     """
     OAuth2-based session that mimics lumpy.api.Session interface
     but uses Bearer token authentication instead of session cookies.
+    
+    If token_source is given it is called before each request to get the
+    current access token, so long-lived sessions pick up refreshed tokens.
+    Failed requests are retried according to retry_policy (default:
+    resilience.DEFAULT_RETRY_POLICY). json= bodies are encoded with fast_json.
     """
-    def __init__(self, base_uri, access_token, verify=None):
+    # get(..., stream=True) is honoured (see fast_json.iter_json_array)
+    supports_streaming = True
+    
+    def __init__(self, base_uri, access_token, verify=None, token_source=None, on_unauthorized=None,
+                 retry_policy=None):
         self.base_uri = base_uri.rstrip('/')
-        self.session = requests.Session()
+        # Own headers, but connections come from the host's shared pool
+        self.session = transports.session(self.base_uri)
         self.session.headers.update({
-            "Authorization": f"Bearer {access_token}",
             "Content-Type": "application/json"
         })
+        self._set_token(access_token)
+        self.token_source = token_source
+        self.on_unauthorized = on_unauthorized
+        self.retry_policy = retry_policy
         # Disable SSL verification for development (like lumpy does for 8443)
         if verify is None:
             self.session.verify = '8443' not in base_uri
         else:
             self.session.verify = verify
     
-    def get(self, path, **kwargs):
+    def _set_token(self, access_token):
+        self.access_token = access_token
+        self.session.headers["Authorization"] = f"Bearer {access_token}"
+    
+    def _request(self, method, path, **kwargs):
         url = f"{self.base_uri}{path}" if path.startswith('/') else f"{self.base_uri}/{path}"
-        res = self.session.get(url, **kwargs)
+        if self.token_source is not None:
+            access_token = self.token_source()
+            if access_token != self.access_token:
+                self._set_token(access_token)
+        kwargs = json_body(kwargs)
+        send = lambda: instrumented_request(self.session.request, method, url, **kwargs)
+        res = call_with_retry(send, method, url, self.retry_policy)
+        if res.status_code == 401 and self.on_unauthorized is not None:
+            # Token was revoked or expired early - drop it and try once more with a fresh one
+            self.on_unauthorized()
+            self._set_token(self.token_source())
+            res = call_with_retry(send, method, url, self.retry_policy)
         res.raise_for_status()
         return res
     
+    def get(self, path, **kwargs):
+        return self._request('GET', path, **kwargs)
+    
     def put(self, path, **kwargs):
-        url = f"{self.base_uri}{path}" if path.startswith('/') else f"{self.base_uri}/{path}"
-        res = self.session.put(url, **kwargs)
-        res.raise_for_status()
-        return res
+        return self._request('PUT', path, **kwargs)
     
     def post(self, path, **kwargs):
-        url = f"{self.base_uri}{path}" if path.startswith('/') else f"{self.base_uri}/{path}"
-        res = self.session.post(url, **kwargs)
-        res.raise_for_status()
-        return res
+        return self._request('POST', path, **kwargs)
     
     def patch(self, path, **kwargs):
-        url = f"{self.base_uri}{path}" if path.startswith('/') else f"{self.base_uri}/{path}"
-        res = self.session.patch(url, **kwargs)
-        res.raise_for_status()
-        return res
+        return self._request('PATCH', path, **kwargs)
 
 
-def create_oauth_session(env_id: str, client_id: str = None, client_secret: str = None, base_uri: str = None) -> OAuthSession:
+def token_error_message(response) -> str:
+    """Describe a failed token request, including the OAuth2 error fields if present."""
+    error_msg = f"OAuth2 token request failed with status {response.status_code}"
+    try:
+        error_data = response_json(response)
+        if isinstance(error_data, dict):
+            error_msg += f"\n   Error: {error_data.get('error', 'Unknown error')}"
+            if 'error_description' in error_data:
+                error_msg += f"\n   Description: {error_data['error_description']}"
+        else:
+            error_msg += f": {error_data}"
+    except:
+        error_msg += f"\n   Response: {response.text[:500]}"
+    return error_msg
+
+
+@operation('token_fetch')
+def request_token(base_uri: str, client_id: str, client_secret: str) -> CachedToken:
+    """Exchange client credentials for an access token at {base_uri}/auth/oauth2/token."""
+    token_url = f"{base_uri}/auth/oauth2/token"
+    
+    # Create Basic Auth header
+    auth_str = base64.b64encode(f"{client_id}:{client_secret}".encode()).decode()
+    
+    # Get access token
+    print(f"   Requesting token from: {token_url}")
+    print(f"   Using CLIENT_ID: {client_id[:8]}...")
+    
+    response = call_with_retry(lambda: instrumented_request(
+        transports.request, 'POST', token_url,
+        headers={
+            "Authorization": f"Basic {auth_str}",
+            "Content-Type": "application/x-www-form-urlencoded"
+        },
+        data="grant_type=client_credentials",
+        verify='8443' not in base_uri  # Disable SSL verify for dev environments
+    ), 'POST', token_url)
+    
+    if response.status_code != 200:
+        raise Exception(token_error_message(response))
+    
+    token_data = response_json(response)
+    token = CachedToken(token_data['access_token'], token_data.get('expires_in'))
+    print(f"   ✅ Token obtained successfully")
+    return token
+
+
+def create_oauth_session(env_id: str, client_id: str = None, client_secret: str = None, base_uri: str = None,
+                         use_cache: bool = True) -> OAuthSession:
     """
     Create an OAuth2 session for Luminance API.
     
@@ -60,12 +251,12 @@ def create_oauth_session(env_id: str, client_id: str = None, client_secret: str
         client_id: OAuth2 client ID (or from CLIENT_ID env var)
         client_secret: OAuth2 client secret (or from SECRET_KEY env var)
         base_uri: Optional full base URI (if provided, env_id is ignored)
+        use_cache: Reuse/refresh tokens through the process-wide token_cache
+                   (if False, a new token is requested and never refreshed)
     
     Returns:
         OAuthSession instance
     """
-    import lumpy.api
-    
     if client_id is None:
         client_id = os.getenv("CLIENT_ID")
     if client_secret is None:
@@ -74,60 +265,21 @@ def create_oauth_session(env_id: str, client_id: str = None, client_secret: str
     if not client_id or not client_secret:
         raise ValueError("CLIENT_ID and SECRET_KEY (client_secret) are required for OAuth2")
     
-    # Determine base_uri
-    if base_uri:
-        # Use provided base URI directly
-        pass
-    elif env_id.startswith('http://') or env_id.startswith('https://'):
-        # Full URL provided
-        base_uri = env_id.rstrip('/')
-    elif '.app.luminance.com' in env_id or '.support.luminance.com' in env_id:
-        # Moniker with domain provided (e.g., 'paddy-integrations-corporate-internal.app.luminance.com')
-        base_uri = f"https://{env_id}" if not env_id.startswith('http') else env_id
-        base_uri = base_uri.rstrip('/')
-    elif len(env_id) == 6 and env_id.isdigit():
-        # Numeric ID (e.g., '006403') - use support.luminance.com
-        base_uri = lumpy.api.default_base_uri(env_id)
-    else:
-        # Assume it's a moniker - try .app.luminance.com first (most common)
-        base_uri = f"https://{env_id}.app.luminance.com"
+    # Determine base_uri (a provided base_uri takes precedence over env_id)
+    base_uri = base_uri.rstrip('/') if base_uri else resolve_base_uri(env_id)
     
-    token_url = f"{base_uri}/auth/oauth2/token"
+    if not use_cache:
+        return OAuthSession(base_uri, request_token(base_uri, client_id, client_secret).access_token)
     
-    # Create Basic Auth header
-    auth_str = base64.b64encode(f"{client_id}:{client_secret}".encode()).decode()
+    key = (base_uri, client_id)
     
-    # Get access token
-    print(f"   Requesting token from: {token_url}")
-    print(f"   Using CLIENT_ID: {client_id[:8]}...")
+    def fetch():
+        return request_token(base_uri, client_id, client_secret)
     
-    response = requests.post(
-        token_url,
-        headers={
-            "Authorization": f"Basic {auth_str}",
-            "Content-Type": "application/x-www-form-urlencoded"
-        },
-        data="grant_type=client_credentials",
-        verify='8443' not in base_uri  # Disable SSL verify for dev environments
-    )
+    def token_source():
+        return token_cache.get(key, fetch)
     
-    # Better error handling
-    if response.status_code != 200:
-        error_msg = f"OAuth2 token request failed with status {response.status_code}"
-        try:
-            error_data = response.json()
-            if isinstance(error_data, dict):
-                error_msg += f"\n   Error: {error_data.get('error', 'Unknown error')}"
-                if 'error_description' in error_data:
-                    error_msg += f"\n   Description: {error_data['error_description']}"
-            else:
-                error_msg += f": {error_data}"
-        except:
-            error_msg += f"\n   Response: {response.text[:500]}"
-        raise Exception(error_msg)
-    
-    token_data = response.json()
-    access_token = token_data['access_token']
-    print(f"   ✅ Token obtained successfully")
+    def on_unauthorized():
+        token_cache.invalidate(key)
     
-    return OAuthSession(base_uri, access_token)
+    return OAuthSession(base_uri, token_source(), token_source=token_source, on_unauthorized=on_unauthorized)
@@ -0,0 +1,565 @@
+#!/usr/bin/env python3
+"""
+Provisioning Server
+
+Long-running local service exposing setup_saml_provider, setup_docusign_provider
+and update_secret over HTTP (or a Unix socket), so callers like the Power Apps
+automation don't pay for interpreter start, imports and a login on every
+request.
+
+Authenticated sessions are kept warm per environment (together with the
+environment's account_id and provider listing) and reused until they have
+been idle for --session-ttl seconds. Requests run on a bounded worker pool;
+requests for the same environment are handled one at a time so two
+concurrent creates can't both add a provider.
+
+Endpoints (JSON request and response bodies):
+    POST /saml        env_id, secret, saml_xml (the metadata XML itself, not a
+                      path), [saml_entity_id, provider_name, provides, name_key,
+                      email_key, provider_id]
+    POST /docusign    env_id, secret, account_id_docusign, base_url,
+                      [provider_name, integration_key, docusign_secret,
+                      provider_id, environment]
+    POST /secret      env_id, secret, provider_id, provider_secret
+    GET  /health      worker and warm session counts
+
+Over TCP every request must carry Authorization: Bearer <token>, where the
+token is --auth-token or PROVISIONING_SERVER_TOKEN; the Unix socket is
+restricted by file permissions (owner only) instead. env_id and secret may be
+omitted when a Unix-socket server was started with --env-id/--secret (these
+defaults are refused over TCP). Responses are {'provider': ..., 'outcome': ..., 'elapsed_ms': ...}
+or {'error': ...} with status 400 (bad request), 502 (Luminance API failure)
+or 503 (environment's host circuit is open), and 401 for a missing or wrong
+token.
+
+Usage:
+    PROVISIONING_SERVER_TOKEN=... python3 provisioning_server.py [--host 127.0.0.1] [--port 8765] [--workers 8]
+    python3 provisioning_server.py --unix-socket /run/luminance/provisioning.sock [--env-id ID --secret KEY]
+"""
+import hashlib
+import hmac
+import json
+import os
+import socketserver
+import stat
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Callable, Dict, Optional, Tuple
+
+from resilience import CircuitOpenError
+from setup_external_providers import (
+    get_account_id,
+    get_provider_registry,
+    open_session,
+    setup_docusign_provider,
+    setup_saml_provider,
+    update_secret,
+)
+
+DEFAULT_PORT = 8765
+# Warm sessions idle longer than this are logged in again on next use
+DEFAULT_SESSION_TTL = 900.0
+DEFAULT_MAX_SESSIONS = 256
+MAX_BODY_BYTES = 8 * 1024 * 1024
+# Seconds an idle keep-alive connection may hold its worker
+KEEPALIVE_TIMEOUT = 1.0
+
+
+class BadRequest(ValueError):
+    """The request body is missing fields or malformed (reported as HTTP 400)."""
+
+
+class UnknownEndpoint(BadRequest):
+    """No operation is served at this path (reported as HTTP 404)."""
+
+
+class AccountIdUnavailable(Exception):
+    """
+    The environment's account_id couldn't be looked up. get_account_id()
+    hides the API error, and with a warm session the usual cause is that the
+    session has expired, so the request is retried once after a fresh login.
+    """
+
+
+# ============================================================================
+# WARM SESSIONS
+# ============================================================================
+
+class WarmEnvironment:
+    """An authenticated session for one environment plus what we've learnt about it."""
+    def __init__(self, session, base_uri: str):
+        self.session = session
+        self.base_uri = base_uri
+        self.account_id = None
+        self.last_used = time.monotonic()
+        # Serialises work on this environment (see module docstring)
+        self.lock = threading.Lock()
+
+    def resolve_account_id(self) -> int:
+        """
+        Raises:
+            AccountIdUnavailable: The lookup failed (typically an expired session)
+        """
+        if self.account_id is None:
+            self.account_id = get_account_id(self.session)
+            if self.account_id is None:
+                raise AccountIdUnavailable(f"Could not determine account_id for {self.base_uri}")
+        return self.account_id
+
+
+class WarmSessionPool:
+    """
+    Authenticated sessions keyed by (env_id, secret), created on first use.
+
+    The secret is only kept as a SHA-256 digest in the key. At most
+    max_sessions environments are kept; the least recently used is dropped.
+
+    Args:
+        idle_ttl: Seconds a session may sit unused before it is replaced
+        max_sessions: Environments kept warm at once
+        opener: open_session-compatible function, (env_id, secret) -> (session, base_uri)
+    """
+    def __init__(self, idle_ttl: float = DEFAULT_SESSION_TTL, max_sessions: int = DEFAULT_MAX_SESSIONS,
+                 opener: Callable = open_session):
+        self.idle_ttl = idle_ttl
+        self.max_sessions = max_sessions
+        self.opener = opener
+        self._lock = threading.Lock()
+        self._environments = OrderedDict()
+        self._login_locks = {}
+        self.counts = Counter()
+
+    @staticmethod
+    def _key(env_id: str, secret: str) -> Tuple[str, str]:
+        return env_id, hashlib.sha256(secret.encode()).hexdigest()
+
+    def _get_fresh(self, key) -> Optional[WarmEnvironment]:
+        with self._lock:
+            environment = self._environments.get(key)
+            if environment is None:
+                return None
+            if time.monotonic() - environment.last_used > self.idle_ttl:
+                del self._environments[key]
+                self.counts['expired'] += 1
+                return None
+            self._environments.move_to_end(key)
+            return environment
+
+    def acquire(self, env_id: str, secret: str) -> WarmEnvironment:
+        """Return the warm environment for (env_id, secret), logging in if needed."""
+        key = self._key(env_id, secret)
+        environment = self._get_fresh(key)
+        if environment is not None:
+            self.counts['hits'] += 1
+            return environment
+
+        with self._lock:
+            login_lock = self._login_locks.setdefault(key, threading.Lock())
+        # One login per environment however many requests arrive for it at once
+        with login_lock:
+            environment = self._get_fresh(key)
+            if environment is not None:
+                self.counts['hits'] += 1
+                return environment
+            session, base_uri = self.opener(env_id, secret)
+            environment = WarmEnvironment(session, base_uri)
+            with self._lock:
+                self._environments[key] = environment
+                self.counts['logins'] += 1
+                while len(self._environments) > self.max_sessions:
+                    evicted, _ = self._environments.popitem(last=False)
+                    self._login_locks.pop(evicted, None)
+                    self.counts['evicted'] += 1
+            return environment
+
+    def discard(self, env_id: str, secret: str):
+        """Forget the session for (env_id, secret), e.g. after it stopped being accepted."""
+        with self._lock:
+            if self._environments.pop(self._key(env_id, secret), None) is not None:
+                self.counts['discarded'] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(self.counts, warm=len(self._environments))
+
+
+def _is_auth_failure(error: Optional[BaseException]) -> bool:
+    """Whether error (or an exception it was raised from) means the session's login is no longer accepted."""
+    while error is not None:
+        if getattr(getattr(error, 'response', None), 'status_code', None) in (401, 403):
+            return True
+        # The setup functions re-raise API errors as plain Exceptions
+        error = error.__cause__ or error.__context__
+    return False
+
+
+# ============================================================================
+# OPERATIONS
+# ============================================================================
+
+def _require(body: Dict, *fields):
+    missing = [field for field in fields if body.get(field) in (None, '')]
+    if missing:
+        raise BadRequest(f"Missing required field(s): {', '.join(missing)}")
+
+
+def _saml(environment: WarmEnvironment, body: Dict, stats: Counter) -> Dict:
+    _require(body, 'saml_xml')
+    saml_xml = body['saml_xml']
+    # Only inline metadata: a path would let callers read (and, with
+    # saml_entity_id, write index sidecars next to) files on this host
+    if not isinstance(saml_xml, str) or not saml_xml.lstrip().startswith('<'):
+        raise BadRequest("saml_xml must be the SAML metadata XML itself, not a file path")
+    return setup_saml_provider(
+        session=environment.session,
+        saml_xml=saml_xml,
+        provider_name=body.get('provider_name') or 'SAML SSO',
+        account_id=environment.resolve_account_id(),
+        base_uri=environment.base_uri,
+        provides=body.get('provides') or ['auth'],
+        name_key=body.get('name_key'),
+        email_key=body.get('email_key'),
+        provider_id=body.get('provider_id'),
+        entity_id=body.get('saml_entity_id'),
+        stats=stats
+    )
+
+
+def _docusign(environment: WarmEnvironment, body: Dict, stats: Counter) -> Dict:
+    _require(body, 'account_id_docusign', 'base_url')
+    return setup_docusign_provider(
+        session=environment.session,
+        account_id_docusign=body['account_id_docusign'],
+        base_url=body['base_url'],
+        provider_name=body.get('provider_name') or 'DocuSign Integration',
+        account_id=environment.resolve_account_id(),
+        integration_key=body.get('integration_key'),
+        secret=body.get('docusign_secret'),
+        provider_id=body.get('provider_id'),
+        environment=body.get('environment') or 'production',
+        stats=stats
+    )
+
+
+def _secret(environment: WarmEnvironment, body: Dict, stats: Counter) -> Dict:
+    _require(body, 'provider_id', 'provider_secret')
+    update_secret(environment.session, body['provider_id'], body['provider_secret'])
+    provider = get_provider_registry(environment.session).lookup_id(body['provider_id'])
+    return provider or {'id': body['provider_id']}
+
+
+OPERATIONS = {
+    '/saml': _saml,
+    '/docusign': _docusign,
+    '/secret': _secret,
+}
+
+
+class ProvisioningService:
+    """
+    Runs OPERATIONS against warm sessions. Independent of the HTTP layer, so
+    it can also be driven directly (e.g. from tests or another server).
+    """
+    def __init__(self, pool: Optional[WarmSessionPool] = None, default_env_id: Optional[str] = None,
+                 default_secret: Optional[str] = None):
+        self.pool = pool or WarmSessionPool()
+        self.default_env_id = default_env_id
+        self.default_secret = default_secret
+
+    def handle(self, path: str, body: Dict, refresh_providers: bool = False) -> Dict:
+        """
+        Run the operation for path with a JSON request body. With
+        refresh_providers, the environment's cached provider listing is
+        dropped first (for retries of work that may already have created a
+        provider).
+
+        Raises:
+            UnknownEndpoint: No operation at path
+            BadRequest: Missing fields
+            CircuitOpenError: The environment's host is failing
+            Exception: The Luminance API rejected the request
+        """
+        operation = OPERATIONS.get(path)
+        if operation is None:
+            raise UnknownEndpoint(f"Unknown endpoint: {path}")
+        env_id = body.get('env_id') or self.default_env_id
+        secret = body.get('secret') or self.default_secret
+        if not env_id or not secret:
+            raise BadRequest("env_id and secret are required (or start the server with --env-id/--secret)")
+
+        started = time.monotonic()
+        stats = Counter()
+        for attempt in (1, 2):
+            environment = self.pool.acquire(env_id, secret)
+            try:
+                with environment.lock:
+                    environment.last_used = time.monotonic()
+                    if refresh_providers:
+                        get_provider_registry(environment.session).invalidate()
+                    provider = operation(environment, body, stats)
+                break
+            except Exception as e:
+                if attempt == 1 and (_is_auth_failure(e) or isinstance(e, AccountIdUnavailable)):
+                    # Session expired server-side - log in again and retry once
+                    self.pool.discard(env_id, secret)
+                    stats.clear()
+                    continue
+                raise
+
+        result = {'provider': provider, 'elapsed_ms': round((time.monotonic() - started) * 1000, 1)}
+        if stats:
+            result['outcome'] = next(iter(stats))
+        return result
+
+
+# ============================================================================
+# HTTP SERVER
+# ============================================================================
+
+class ProvisioningRequestHandler(BaseHTTPRequestHandler):
+    server_version = 'LuminanceProvisioning/1.0'
+    # Keep-alive, so callers can reuse one connection; an idle connection
+    # gives its worker back after `timeout` seconds, or straight after the
+    # response while other connections are waiting for a worker
+    protocol_version = 'HTTP/1.1'
+    timeout = KEEPALIVE_TIMEOUT
+    # Buffer each response into a single send; unbuffered, headers and body go
+    # out separately and Nagle + delayed ACK add ~40 ms to every request
+    wbufsize = 64 * 1024
+
+    def address_string(self):
+        # Unix socket peers have no (host, port) address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            sys.stderr.write(f"{self.address_string()} - {format % args}\n")
+
+    def _send_json(self, status: int, payload: Dict, headers: Optional[Dict] = None):
+        body = json.dumps(payload, default=str).encode()
+        self.send_response(status)
+        if self.server.has_waiting_connections():
+            self.close_connection = True
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _authorized(self) -> bool:
+        """Check the bearer token (TCP only), answering 401 if it is missing or wrong."""
+        token = self.server.auth_token
+        if token is None:
+            return True
+        supplied = self.headers.get('Authorization') or ''
+        if supplied.startswith('Bearer ') and hmac.compare_digest(supplied[7:].strip().encode(), token.encode()):
+            return True
+        # The request body is left unread, so the connection can't be reused
+        self.close_connection = True
+        self._send_json(401, {'error': 'Missing or invalid bearer token'}, {'WWW-Authenticate': 'Bearer'})
+        return False
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        if self.path != '/health':
+            self._send_json(404, {'error': f"Unknown endpoint: {self.path}"})
+            return
+        self._send_json(200, {
+            'status': 'ok',
+            'workers': self.server.max_workers,
+            'sessions': self.server.service.pool.stats()
+        })
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            if length > MAX_BODY_BYTES:
+                raise BadRequest(f"Request body larger than {MAX_BODY_BYTES} bytes")
+            body = json.loads(self.rfile.read(length) or b'{}')
+            if not isinstance(body, dict):
+                raise BadRequest("Request body must be a JSON object")
+            self._send_json(200, self.server.service.handle(self.path, body))
+        except UnknownEndpoint as e:
+            self._send_json(404, {'error': str(e)})
+        except ValueError as e:
+            # BadRequest, malformed JSON, or SAML metadata that can't be used
+            self._send_json(400, {'error': str(e)})
+        except CircuitOpenError as e:
+            self._send_json(503, {'error': str(e), 'retry_in': round(e.retry_in, 1)})
+        except Exception as e:
+            self._send_json(502, {'error': str(e)})
+
+
+class _WorkerPoolMixIn:
+    """
+    Handle each connection on a bounded ThreadPoolExecutor. Once every worker
+    is busy and max_workers more connections are queued, the accept loop
+    blocks, so excess load waits in the listen backlog instead of piling up
+    threads.
+    """
+    def init_workers(self, max_workers: int):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='provisioning')
+        self._slots = threading.BoundedSemaphore(2 * max_workers)
+        self._connections = 0
+        self._connections_lock = threading.Lock()
+
+    def has_waiting_connections(self) -> bool:
+        """Whether accepted connections are queued behind busy workers."""
+        return self._connections > self.max_workers
+
+    def process_request(self, request, client_address):
+        self._slots.acquire()
+        with self._connections_lock:
+            self._connections += 1
+        self._executor.submit(self._process_request_in_worker, request, client_address)
+
+    def _process_request_in_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            with self._connections_lock:
+                self._connections -= 1
+            self._slots.release()
+
+    def server_close(self):
+        super().server_close()
+        self._executor.shutdown(wait=True)
+
+
+class ProvisioningHTTPServer(_WorkerPoolMixIn, HTTPServer):
+    """TCP server; every request must present auth_token as a bearer token."""
+    def __init__(self, address: Tuple[str, int], service: ProvisioningService, max_workers: int = 8,
+                 verbose: bool = False, auth_token: Optional[str] = None):
+        if not auth_token:
+            raise ValueError("A TCP provisioning server needs an auth token (--auth-token or PROVISIONING_SERVER_TOKEN)")
+        self.service = service
+        self.verbose = verbose
+        self.auth_token = auth_token
+        self.init_workers(max_workers)
+        super().__init__(address, ProvisioningRequestHandler)
+
+
+class ProvisioningUnixServer(_WorkerPoolMixIn, socketserver.UnixStreamServer):
+    def __init__(self, path: str, service: ProvisioningService, max_workers: int = 8, verbose: bool = False):
+        try:
+            existing = os.lstat(path)
+        except FileNotFoundError:
+            existing = None
+        if existing is not None:
+            if not stat.S_ISSOCK(existing.st_mode):
+                raise ValueError(f"{path} exists and is not a socket; refusing to replace it")
+            # Left behind by a previous run
+            os.unlink(path)
+        self.service = service
+        self.verbose = verbose
+        # Access is controlled by the socket file's permissions
+        self.auth_token = None
+        self.init_workers(max_workers)
+        super().__init__(path, ProvisioningRequestHandler)
+
+    def server_bind(self):
+        # Request bodies carry API secrets - only the owner may connect. The
+        # socket is created with these permissions (not chmod-ed after bind),
+        # so there's no moment when others can connect.
+        previous_umask = os.umask(0o077)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(previous_umask)
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.server_address)
+        except OSError:
+            pass
+
+
+def create_server(service: ProvisioningService, host: str = '127.0.0.1', port: int = DEFAULT_PORT,
+                  unix_socket: Optional[str] = None, max_workers: int = 8, verbose: bool = False,
+                  auth_token: Optional[str] = None):
+    """
+    Build (but don't start) the HTTP or Unix-socket server for service.
+
+    Raises:
+        ValueError: TCP without auth_token, or TCP with default credentials
+                    (anyone able to connect could provision with them)
+    """
+    if unix_socket:
+        return ProvisioningUnixServer(unix_socket, service, max_workers, verbose)
+    if service.default_env_id or service.default_secret:
+        raise ValueError("Default env_id/secret are only allowed on a Unix socket server")
+    return ProvisioningHTTPServer((host, port), service, max_workers, verbose, auth_token)
+
+
+@contextmanager
+def running_server(server):
+    """Serve in a background thread for the duration of the block."""
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Serve external provider setup over HTTP with warm sessions')
+    parser.add_argument('--host', default='127.0.0.1', help='Interface to listen on')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='TCP port to listen on')
+    parser.add_argument('--unix-socket', help='Listen on this Unix socket instead of TCP')
+    parser.add_argument('--workers', type=int, default=8, help='Requests handled concurrently')
+    parser.add_argument('--session-ttl', type=float, default=DEFAULT_SESSION_TTL,
+                        help='Seconds an idle session is kept before logging in again')
+    parser.add_argument('--max-sessions', type=int, default=DEFAULT_MAX_SESSIONS,
+                        help='Environments kept warm at once')
+    parser.add_argument('--auth-token', default=os.getenv('PROVISIONING_SERVER_TOKEN'),
+                        help='Bearer token TCP callers must send (default: $PROVISIONING_SERVER_TOKEN)')
+    parser.add_argument('--env-id', help='Default environment for requests without env_id (Unix socket only)')
+    parser.add_argument('--secret', help='Default Luminance API secret key for requests without one '
+                                         '(Unix socket only)')
+    parser.add_argument('--verbose', action='store_true', help='Log every request to stderr')
+    args = parser.parse_args()
+    if not args.unix_socket:
+        if args.env_id or args.secret:
+            parser.error('--env-id/--secret are only allowed with --unix-socket')
+        if not args.auth_token:
+            parser.error('listening on TCP needs --auth-token or PROVISIONING_SERVER_TOKEN')
+
+    service = ProvisioningService(
+        WarmSessionPool(idle_ttl=args.session_ttl, max_sessions=args.max_sessions),
+        default_env_id=args.env_id, default_secret=args.secret
+    )
+    server = create_server(service, args.host, args.port, args.unix_socket, args.workers, args.verbose,
+                           args.auth_token)
+    where = args.unix_socket or f"http://{args.host}:{server.server_address[1]}"
+    print(f"✅ Provisioning server listening on {where} ({args.workers} workers)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
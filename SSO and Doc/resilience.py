@@ -0,0 +1,320 @@
+"""
+Retries, Backoff and Circuit Breaking for the Luminance Session Wrappers
+
+OAuthSession, SessionAuth and the asyncio sessions send each request through
+call_with_retry() (or call_with_retry_async()):
+
+- 429 responses, and 502/503/504 or connection errors on idempotent methods
+  (GET/PUT by default), are retried with exponential backoff and full jitter.
+- A Retry-After header (seconds or HTTP date) overrides the backoff delay. If
+  the server asks for a longer wait than the policy allows, the response is
+  returned instead of blocking a worker for minutes.
+- A circuit breaker per host counts consecutive failures (5xx and connection
+  errors). Once it opens, requests to that host fail fast with
+  CircuitOpenError until reset_timeout has passed; then a single probe request
+  decides whether it closes again.
+
+Usage:
+    from resilience import RetryPolicy, NO_RETRY
+
+    session.retry_policy = RetryPolicy(max_attempts=6, backoff_max=60)
+    session.retry_policy = NO_RETRY        # single attempt, no circuit breaker
+"""
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, FrozenSet, Optional, Tuple
+from urllib.parse import urlparse
+
+from tracing import span
+
+RETRY_STATUSES = frozenset([429, 502, 503, 504])
+IDEMPOTENT_METHODS = frozenset(['GET', 'PUT'])
+
+
+def requests_transient_errors() -> Tuple[type, ...]:
+    """requests errors that mean the request never got a response and is worth retrying."""
+    # Imported here so this module stays cheap to import for CLI paths that never send a request
+    import requests
+    return (requests.ConnectionError, requests.Timeout)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of sending a request to a host whose circuit is open."""
+    def __init__(self, host: str, failures: int, retry_in: float):
+        self.host = host
+        self.failures = failures
+        self.retry_in = retry_in
+        super().__init__(
+            f"Circuit open for {host} after {failures} consecutive failures; "
+            f"not sending requests for another {retry_in:.0f}s"
+        )
+
+
+class RetryPolicy:
+    """
+    How a session retries failed requests.
+
+    Args:
+        max_attempts: Total attempts per request, including the first
+        backoff_base: Delay cap (seconds) for the first retry; doubles each retry
+        backoff_max: Upper bound for the backoff delay
+        max_retry_after: Longest Retry-After the policy will wait for
+        retry_statuses: Statuses worth retrying (429 is retried for any method,
+                        the rest only for retry_methods)
+        retry_methods: Methods that are safe to repeat
+        circuit_breaker: Whether to use the per-host circuit breaker
+        failure_threshold: Consecutive failures that open a host's circuit
+        reset_timeout: Seconds an open circuit fails fast before allowing a probe
+    """
+    def __init__(self, max_attempts: int = 4, backoff_base: float = 0.5, backoff_max: float = 30.0,
+                 max_retry_after: float = 120.0, retry_statuses: FrozenSet[int] = RETRY_STATUSES,
+                 retry_methods: FrozenSet[str] = IDEMPOTENT_METHODS, circuit_breaker: bool = True,
+                 failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_retry_after = max_retry_after
+        self.retry_statuses = frozenset(retry_statuses)
+        self.retry_methods = frozenset(m.upper() for m in retry_methods)
+        self.circuit_breaker = circuit_breaker
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+    def backoff(self, retry_number: int) -> float:
+        """Full-jitter exponential backoff for the Nth retry (1-based)."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** (retry_number - 1))))
+
+    def is_retryable(self, method: str, status: Optional[int], error: Optional[Exception],
+                     transient: Tuple[type, ...]) -> bool:
+        if status is None:
+            return error is not None and isinstance(error, transient) and method in self.retry_methods
+        if status == 429:
+            # The server refused the request without processing it - safe for any method
+            return True
+        return status in self.retry_statuses and method in self.retry_methods
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+NO_RETRY = RetryPolicy(max_attempts=1, circuit_breaker=False)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date)."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    from email.utils import parsedate_to_datetime
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+# ============================================================================
+# CIRCUIT BREAKER
+# ============================================================================
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker for one host (closed -> open -> half-open)."""
+    def __init__(self, host: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self._probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self.opened_at is None:
+                return 'closed'
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                return 'half-open'
+            return 'open'
+
+    def before_request(self):
+        """Raise CircuitOpenError unless a request may be sent now."""
+        with self._lock:
+            if self.opened_at is None:
+                return
+            waited = time.monotonic() - self.opened_at
+            if waited >= self.reset_timeout and not self._probe_in_flight:
+                # Half-open: let one request through to see if the host has recovered
+                self._probe_in_flight = True
+                return
+            raise CircuitOpenError(self.host, self.failures, max(0.0, self.reset_timeout - waited))
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probe_in_flight or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+    def release(self):
+        """The request ended without telling us anything about the host (e.g. a local error)."""
+        with self._lock:
+            self._probe_in_flight = False
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(host: str, policy: RetryPolicy = DEFAULT_RETRY_POLICY) -> CircuitBreaker:
+    """Return the process-wide circuit breaker for host (created with policy's thresholds)."""
+    with _breakers_lock:
+        breaker = _breakers.get(host)
+        if breaker is None:
+            breaker = _breakers[host] = CircuitBreaker(host, policy.failure_threshold, policy.reset_timeout)
+        return breaker
+
+
+def reset_circuit_breakers():
+    with _breakers_lock:
+        _breakers.clear()
+
+
+# ============================================================================
+# RETRY LOOP
+# ============================================================================
+
+class _Attempts:
+    """Bookkeeping shared by the sync and async retry loops."""
+    def __init__(self, method: str, url: str, policy: Optional[RetryPolicy],
+                 transient: Optional[Tuple[type, ...]]):
+        self.method = method.upper()
+        self.policy = policy or DEFAULT_RETRY_POLICY
+        self.transient = transient if transient is not None else requests_transient_errors()
+        host = urlparse(url).netloc or url
+        self.breaker = get_circuit_breaker(host, self.policy) if self.policy.circuit_breaker else None
+
+    def before(self):
+        if self.breaker is not None:
+            self.breaker.before_request()
+
+    def after(self, attempt: int, response, error: Optional[Exception]) -> Optional[float]:
+        """Record the outcome; return the delay before retrying, or None to stop."""
+        status = getattr(response, 'status_code', None)
+        if self.breaker is not None:
+            if (status is None and isinstance(error, self.transient)) or (status is not None and status >= 500):
+                self.breaker.record_failure()
+            elif status is not None:
+                self.breaker.record_success()
+            else:
+                self.breaker.release()
+
+        if attempt >= self.policy.max_attempts or not self.policy.is_retryable(
+                self.method, status, error, self.transient):
+            return None
+        if self.breaker is not None and self.breaker.opened_at is not None:
+            # This failure opened the circuit - further attempts would fail fast anyway
+            return None
+
+        retry_after = parse_retry_after(response.headers.get('Retry-After')) if response is not None else None
+        if retry_after is not None:
+            return retry_after if retry_after <= self.policy.max_retry_after else None
+        return self.policy.backoff(attempt)
+
+
+def call_with_retry(send: Callable, method: str, url: str, policy: Optional[RetryPolicy] = None,
+                    transient: Optional[Tuple[type, ...]] = None):
+    """
+    Call send() (one HTTP attempt) until it succeeds or policy gives up.
+
+    send() may return a response of any status, or raise; exceptions that carry
+    a .response (requests.HTTPError) are judged by that response's status.
+    transient defaults to requests' connection and timeout errors.
+    Returns the last response, or re-raises the last exception.
+
+    Raises:
+        CircuitOpenError: url's host has failed repeatedly and is being skipped
+    """
+    attempts = _Attempts(method, url, policy, transient)
+    attempt = 0
+    while True:
+        attempt += 1
+        attempts.before()
+        try:
+            response, error = send(), None
+        except Exception as e:
+            response, error = getattr(e, 'response', None), e
+        delay = attempts.after(attempt, response, error)
+        if delay is None:
+            if error is not None:
+                raise error
+            return response
+        with span('retry_backoff', attempt=attempt, delay_seconds=round(delay, 3)):
+            time.sleep(delay)
+
+
+async def call_with_retry_async(send: Callable, method: str, url: str, policy: Optional[RetryPolicy] = None,
+                                transient: Optional[Tuple[type, ...]] = None):
+    """call_with_retry() for a coroutine function send(); waits with asyncio.sleep."""
+    import asyncio
+
+    attempts = _Attempts(method, url, policy, transient)
+    attempt = 0
+    while True:
+        attempt += 1
+        attempts.before()
+        try:
+            response, error = await send(), None
+        except Exception as e:
+            response, error = getattr(e, 'response', None), e
+        delay = attempts.after(attempt, response, error)
+        if delay is None:
+            if error is not None:
+                raise error
+            return response
+        with span('retry_backoff', attempt=attempt, delay_seconds=round(delay, 3)):
+            await asyncio.sleep(delay)
+
+
+class ResilientSession:
+    """
+    Wraps any session with get/put/post/patch(path, **kwargs) methods that
+    raise requests.HTTPError on failure (e.g. lumpy.api.Session) so its
+    requests are retried and circuit-broken like OAuthSession's. Other
+    attributes pass through to the wrapped session.
+    """
+    def __init__(self, session, base_uri: str, retry_policy: Optional[RetryPolicy] = None):
+        self._wrapped = session
+        self._base_uri = base_uri
+        self.retry_policy = retry_policy
+
+    def __getattr__(self, name):
+        return getattr(self._wrapped, name)
+
+    def _request(self, method, path, **kwargs):
+        send = getattr(self._wrapped, method.lower())
+        return call_with_retry(lambda: send(path, **kwargs), method, self._base_uri, self.retry_policy)
+
+    def get(self, path, **kwargs):
+        return self._request('GET', path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self._request('PUT', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self._request('POST', path, **kwargs)
+
+    def patch(self, path, **kwargs):
+        return self._request('PATCH', path, **kwargs)
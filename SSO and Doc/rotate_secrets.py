@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+Bulk Provider Secret Rotation
+
+Rotates the secrets of many external providers (DocuSign by default) across
+environments. updateSecret calls run concurrently under a global rate cap and
+a per-host concurrency limit, and every result is appended to a checkpoint
+journal as soon as it is known. Re-running the same command after an
+interruption skips every provider the journal records as already rotated to
+the same secret, so a rotation can be stopped and resumed at any point.
+
+Plan file (CSV, JSON or JSONL, like the setup_external_providers.py manifest),
+one row per environment or per provider:
+    env_id          Luminance environment (required)
+    secret          Luminance API secret key (default: --secret)
+    provider_id     Provider to rotate; if omitted, provider_name is looked up,
+    provider_name   and if both are omitted every provider of --type is rotated
+    new_secret      New provider secret (default: $NEW_PROVIDER_SECRET, see --new-secret-env)
+
+The journal is JSONL; only a fingerprint of each new secret is recorded, never
+the secret itself. A provider whose POST succeeded but whose journal line was
+not written before a crash is rotated again on resume - setting the same
+secret twice is harmless.
+
+Usage:
+    NEW_PROVIDER_SECRET=... python3 rotate_secrets.py --plan rotation.csv --secret <SECRET_KEY> \
+        --journal rotation.journal.jsonl [--workers 16] [--rate 10] [--per-host-limit 4]
+"""
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional
+
+from setup_external_providers import HostConcurrencyLimiter, backend_host, get_provider_registry, update_secret
+
+DEFAULT_PROVIDER_TYPE = 'docusign'
+DEFAULT_NEW_SECRET_ENV = 'NEW_PROVIDER_SECRET'
+
+
+def secret_fingerprint(secret: str) -> str:
+    """Short SHA-256 fingerprint of a secret, for the journal."""
+    return hashlib.sha256(secret.encode()).hexdigest()[:16]
+
+
+def journal_key(env_id: str, provider_id) -> str:
+    return f"{env_id}/{provider_id}"
+
+
+# ============================================================================
+# JOURNAL AND RATE CAP
+# ============================================================================
+
+class RotationJournal:
+    """
+    Append-only JSONL checkpoint journal. Each record is flushed and fsynced
+    before append() returns, so a crash loses at most the record being written.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+
+    def completed(self) -> Dict[str, str]:
+        """journal key -> secret fingerprint for every successful rotation recorded so far."""
+        done = {}
+        try:
+            with open(self.path, 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Torn final line from an interrupted write
+                        continue
+                    if record.get('status') == 'rotated':
+                        done[record['key']] = record.get('secret_fingerprint')
+        except FileNotFoundError:
+            pass
+        return done
+
+    def _open(self):
+        f = os.fdopen(os.open(self.path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o600), 'a+')
+        if f.seek(0, os.SEEK_END):
+            f.seek(f.tell() - 1)
+            if f.read(1) != '\n':
+                # Finish off a torn last line so the next record starts on its own line
+                f.write('\n')
+        return f
+
+    def append(self, record: Dict):
+        line = json.dumps(dict(record, at=datetime.now(timezone.utc).isoformat()), default=str) + '\n'
+        with self._lock:
+            if self._file is None:
+                self._file = self._open()
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class RateLimiter:
+    """Token bucket shared by all threads: at most `rate` calls per second, bursts of up to `burst`."""
+    def __init__(self, rate: float, burst: Optional[int] = None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+# ============================================================================
+# ROTATION
+# ============================================================================
+
+def resolve_targets(entry: Dict, session, provider_type: str = DEFAULT_PROVIDER_TYPE) -> List[Dict]:
+    """
+    The providers a plan row refers to, as [{'provider_id', 'name'}], using at
+    most one provider listing for the environment.
+    """
+    if entry.get('provider_id'):
+        return [{'provider_id': int(entry['provider_id']), 'name': entry.get('provider_name')}]
+    registry = get_provider_registry(session)
+    if entry.get('provider_name'):
+        provider = registry.find(entry['provider_name'], entry.get('provider_type') or provider_type)
+        if provider is None:
+            raise ValueError(f"No {entry.get('provider_type') or provider_type} provider named "
+                             f"{entry['provider_name']!r}")
+        return [{'provider_id': provider['id'], 'name': provider.get('name')}]
+    return [{'provider_id': p['id'], 'name': p.get('name')} for p in registry.providers()
+            if p.get('type') == (entry.get('provider_type') or provider_type)]
+
+
+def rotate_secrets(
+    entries: Iterable[Dict],
+    journal: RotationJournal,
+    default_secret: Optional[str] = None,
+    default_new_secret: Optional[str] = None,
+    provider_type: str = DEFAULT_PROVIDER_TYPE,
+    max_workers: int = 16,
+    rate: float = 10.0,
+    per_host_limit: int = 4,
+    pool=None,
+    verbose: bool = True
+) -> Dict:
+    """
+    Rotate the secrets of every provider in the plan, skipping those the
+    journal already records as rotated to the same secret.
+
+    Providers are resolved for all environments first (one listing each,
+    concurrently), then updateSecret calls run on max_workers threads at no
+    more than `rate` calls per second overall.
+
+    Returns:
+        Counts of `rotated`, `skipped`, `failed` providers and environments
+        that could not be resolved (`environment_errors`), plus timings.
+    """
+    if pool is None:
+        from provisioning_server import WarmSessionPool
+        pool = WarmSessionPool()
+    started = time.monotonic()
+    completed = journal.completed()
+    limiter = RateLimiter(rate) if rate else None
+    hosts = HostConcurrencyLimiter(per_host_limit)
+    summary = {'rotated': 0, 'skipped': 0, 'failed': 0, 'environment_errors': 0}
+    summary_lock = threading.Lock()
+
+    def count(outcome):
+        with summary_lock:
+            summary[outcome] += 1
+
+    def expand(entry):
+        secret = entry.get('secret') or default_secret
+        new_secret = entry.get('new_secret') or default_new_secret
+        if not secret:
+            raise ValueError("No secret in plan row and no --secret given")
+        if not new_secret:
+            raise ValueError("No new_secret in plan row and no default new secret")
+        environment = pool.acquire(entry['env_id'], secret)
+        with environment.lock:
+            targets = resolve_targets(entry, environment.session, provider_type)
+        explicit = bool(entry.get('provider_id') or entry.get('provider_name'))
+        return [dict(target, env_id=entry['env_id'], secret=secret, new_secret=new_secret, explicit=explicit,
+                     host=backend_host(environment.base_uri))
+                for target in targets]
+
+    def rotate(target):
+        key = journal_key(target['env_id'], target['provider_id'])
+        fingerprint = secret_fingerprint(target['new_secret'])
+        record = {'key': key, 'env_id': target['env_id'], 'provider_id': target['provider_id'],
+                  'name': target['name'], 'secret_fingerprint': fingerprint}
+        try:
+            with hosts.limit(target['host']):
+                if limiter:
+                    limiter.acquire()
+                session = pool.acquire(target['env_id'], target['secret']).session
+                update_secret(session, target['provider_id'], target['new_secret'])
+        except Exception as e:
+            journal.append(dict(record, status='failed', error=str(e)))
+            count('failed')
+            if verbose:
+                print(f"❌ {key}: {e}")
+            return
+        journal.append(dict(record, status='rotated'))
+        count('rotated')
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='rotate') as executor:
+        targets = {}
+        futures = {executor.submit(expand, entry): entry for entry in entries}
+        for future in as_completed(futures):
+            entry = futures[future]
+            try:
+                for target in future.result():
+                    # A provider listed more than once is rotated once; a row naming
+                    # it explicitly wins over a whole-environment row
+                    key = journal_key(target['env_id'], target['provider_id'])
+                    if key not in targets or target['explicit'] and not targets[key]['explicit']:
+                        targets[key] = target
+            except Exception as e:
+                journal.append({'key': journal_key(entry['env_id'], '*'), 'env_id': entry['env_id'],
+                                'status': 'failed', 'error': str(e)})
+                count('environment_errors')
+                if verbose:
+                    print(f"❌ {entry['env_id']}: {e}")
+
+        todo = []
+        for key, target in targets.items():
+            if completed.get(key) == secret_fingerprint(target['new_secret']):
+                count('skipped')
+            else:
+                todo.append(target)
+        if verbose:
+            print(f"Rotating {len(todo)} provider secrets ({summary['skipped']} already done, "
+                  f"{max_workers} workers, {rate or 'unlimited'}/s)...")
+        for future in as_completed([executor.submit(rotate, target) for target in todo]):
+            future.result()
+
+    elapsed = time.monotonic() - started
+    summary['wall_clock_seconds'] = round(elapsed, 3)
+    summary['rotations_per_second'] = round(summary['rotated'] / elapsed, 2) if elapsed else 0.0
+    return summary
+
+
+def main():
+    import argparse
+    from setup_external_providers import iter_manifest
+
+    parser = argparse.ArgumentParser(description='Rotate external provider secrets in bulk, resumably')
+    parser.add_argument('--plan', required=True, help='Rotation plan (CSV, JSON or JSONL)')
+    parser.add_argument('--journal', required=True, help='Append-only checkpoint journal (JSONL); reused to resume')
+    parser.add_argument('--secret', help='Luminance API secret key (default for rows without one)')
+    parser.add_argument('--new-secret-env', default=DEFAULT_NEW_SECRET_ENV,
+                        help='Environment variable holding the new secret for rows without new_secret')
+    parser.add_argument('--type', default=DEFAULT_PROVIDER_TYPE, help='Provider type rotated for whole-environment rows')
+    parser.add_argument('--workers', type=int, default=16, help='Concurrent updateSecret calls')
+    parser.add_argument('--rate', type=float, default=10.0, help='Maximum updateSecret calls per second (0: no cap)')
+    parser.add_argument('--per-host-limit', type=int, default=4, help='Maximum concurrent calls to one backend host, e.g. app.luminance.com')
+    args = parser.parse_args()
+
+    journal = RotationJournal(args.journal)
+    try:
+        summary = rotate_secrets(
+            iter_manifest(args.plan), journal, default_secret=args.secret,
+            default_new_secret=os.getenv(args.new_secret_env), provider_type=args.type,
+            max_workers=args.workers, rate=args.rate, per_host_limit=args.per_host_limit
+        )
+    finally:
+        journal.close()
+
+    print(f"\n{summary['rotated']} rotated, {summary['skipped']} already rotated, {summary['failed']} failed, "
+          f"{summary['environment_errors']} environments unreachable in {summary['wall_clock_seconds']}s "
+          f"({summary['rotations_per_second']}/s)")
+    if summary['failed'] or summary['environment_errors']:
+        print(f"❌ Re-run the same command to retry; progress is recorded in {args.journal}")
+        sys.exit(1)
+    print("✅ Rotation complete")
+    return summary
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+"""
+SAML Federation Metadata Index
+
+Build-once index over a federation metadata aggregate that maps each entityID
+to the byte range of its EntityDescriptor. The index is stored next to the
+source file (<file>.entityidx.json), or in $LUMINANCE_SAML_INDEX_CACHE
+(default ~/.luminance/saml_indexes) when that directory isn't writable, and
+rebuilt only when the source's size or modification time changes. Lookups
+slice the descriptor out of a memory-mapped copy of the file, so provisioning
+many tenants from one aggregate parses a single descriptor per tenant instead
+of the whole file.
+
+Usage:
+    from saml_index import open_metadata_index
+
+    index = open_metadata_index('edugain-aggregate.xml')
+    saml_xml = index.entity_xml('https://idp.example.edu/idp/shibboleth')
+    saml_data = index.parse_entity('https://idp.example.edu/idp/shibboleth')
+
+    # or from the command line, to (re)build and summarise the index:
+    python3 saml_index.py edugain-aggregate.xml
+"""
+import hashlib
+import json
+import mmap
+import os
+import re
+import sys
+import threading
+from typing import Dict, Optional
+from xml.parsers import expat
+
+from saml_metadata import ENTITY_DESCRIPTOR, READ_CHUNK_SIZE, parse_saml_xml
+
+INDEX_SUFFIX = '.entityidx.json'
+INDEX_VERSION = 2
+
+# Rest of a tag up to its closing '>', skipping any '>' inside quoted attribute values
+_TAG_REST = re.compile(rb'(?:[^>"\']|"[^"]*"|\'[^\']*\')*>')
+
+
+def default_index_cache_dir() -> str:
+    return os.getenv("LUMINANCE_SAML_INDEX_CACHE") or \
+        os.path.join(os.path.expanduser("~"), ".luminance", "saml_indexes")
+
+
+def cache_index_path(path: str) -> str:
+    """Index location in the cache directory, for metadata whose own directory is read-only."""
+    digest = hashlib.sha256(os.path.abspath(path).encode()).hexdigest()[:16]
+    return os.path.join(default_index_cache_dir(), f"{os.path.basename(path)}.{digest}{INDEX_SUFFIX}")
+
+
+def _source_signature(path: str) -> Dict:
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def build_index(path: str) -> Dict:
+    """
+    Scan a metadata file once and return its index dict:
+    {'version', 'source', 'encoding', 'namespaces': [...], 'entities': {entityID: [start, end, ns]}}
+    where start/end are byte offsets of the EntityDescriptor and ns indexes the
+    list of namespace declarations in scope for it.
+    """
+    parser = expat.ParserCreate(namespace_separator=' ')
+    scopes = [{}]
+    pending = {}
+    open_entities = []
+    entities = {}
+    namespaces = []
+    namespace_ids = {}
+    encoding = ['utf-8']
+
+    def xml_decl(version, declared_encoding, standalone):
+        if declared_encoding:
+            encoding[0] = declared_encoding
+
+    def start_ns(prefix, uri):
+        pending[prefix or ''] = uri
+
+    def start(name, attrs):
+        scope = scopes[-1]
+        if pending:
+            scope = dict(scope, **pending)
+            pending.clear()
+        scopes.append(scope)
+        if name == ENTITY_DESCRIPTOR and attrs.get('entityID'):
+            key = json.dumps(scope, sort_keys=True)
+            if key not in namespace_ids:
+                namespace_ids[key] = len(namespaces)
+                namespaces.append(scope)
+            open_entities.append((len(scopes), attrs['entityID'], parser.CurrentByteIndex, namespace_ids[key]))
+
+    def end(name):
+        if open_entities and open_entities[-1][0] == len(scopes):
+            _, entity_id, start_byte, ns_id = open_entities.pop()
+            # CurrentByteIndex is the start of the end tag, whose '>' is resolved
+            # below (or already the end of an empty <EntityDescriptor .../>)
+            entities.setdefault(entity_id, [start_byte, parser.CurrentByteIndex, ns_id])
+        scopes.pop()
+
+    parser.XmlDeclHandler = xml_decl
+    parser.StartNamespaceDeclHandler = start_ns
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+
+    signature = _source_signature(path)
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            parser.Parse(chunk, False)
+        parser.Parse(b'', True)
+
+        if entities:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for span in entities.values():
+                    if mm[span[1]:span[1] + 2] == b'</':
+                        span[1] = _TAG_REST.match(mm, span[1]).end()
+
+    return {
+        'version': INDEX_VERSION,
+        'source': signature,
+        'encoding': encoding[0],
+        'namespaces': namespaces,
+        'entities': entities
+    }
+
+
+class SamlMetadataIndex:
+    """
+    entityID -> EntityDescriptor lookups over one memory-mapped metadata file.
+
+    Args:
+        path: Metadata file
+        index_path: Where to keep the index (default: next to the file, falling
+                    back to the cache directory if that can't be written)
+    """
+    def __init__(self, path: str, index_path: Optional[str] = None):
+        self.path = path
+        self.index_path = index_path or path + INDEX_SUFFIX
+        self._index_paths = [self.index_path] if index_path else [self.index_path, cache_index_path(path)]
+        self._lock = threading.Lock()
+        self._file = None
+        self._mmap = None
+        self._index = None
+        self._load()
+
+    def _load(self):
+        """Load the stored index, rebuilding it if the source file has changed."""
+        signature = _source_signature(self.path)
+        index = None
+        for index_path in self._index_paths:
+            try:
+                with open(index_path, 'r') as f:
+                    index = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if isinstance(index, dict) and index.get('version') == INDEX_VERSION and \
+                    index.get('source') == signature:
+                self.index_path = index_path
+                break
+            index = None
+
+        if index is None:
+            index = build_index(self.path)
+            self._save(index)
+
+        self.close()
+        self._index = index
+        self._file = open(self.path, 'rb')
+        if index['source']['size']:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _save(self, index: Dict):
+        """Store the index at the first location that can be written."""
+        error = None
+        for index_path in self._index_paths:
+            tmp_path = f"{index_path}.{os.getpid()}.tmp"
+            try:
+                if index_path != self._index_paths[0]:
+                    os.makedirs(os.path.dirname(index_path), mode=0o700, exist_ok=True)
+                with open(tmp_path, 'w') as f:
+                    json.dump(index, f)
+                os.replace(tmp_path, index_path)
+                self.index_path = index_path
+                return
+            except OSError as e:
+                error = e
+        # Nowhere writable - keep the index for this process only
+        print(f"Warning: Could not save metadata index {self.index_path}: {error}")
+
+    def refresh(self):
+        """Reload (and rebuild if needed) when the source file has changed since it was opened."""
+        with self._lock:
+            if _source_signature(self.path) != self._index['source']:
+                self._load()
+
+    def __contains__(self, entity_id):
+        return entity_id in self._index['entities']
+
+    def __len__(self):
+        return len(self._index['entities'])
+
+    def entity_ids(self):
+        return list(self._index['entities'])
+
+    def entity_xml(self, entity_id: str) -> str:
+        """
+        Return a standalone XML document containing just this entity's
+        EntityDescriptor, with the namespaces it inherits from the aggregate
+        declared on a wrapper element.
+        """
+        with self._lock:
+            span = self._index['entities'].get(entity_id)
+            if span is None:
+                raise KeyError(f"EntityDescriptor {entity_id!r} not found in {self.path}")
+            start, end, ns_id = span
+            descriptor = self._mmap[start:end].decode(self._index['encoding'])
+            namespaces = self._index['namespaces'][ns_id]
+        declarations = ''.join(
+            f' xmlns:{prefix}="{uri}"' if prefix else f' xmlns="{uri}"'
+            for prefix, uri in namespaces.items()
+        )
+        return f'<EntityIndexSlice{declarations}>{descriptor}</EntityIndexSlice>'
+
+    def parse_entity(self, entity_id: str) -> Dict[str, Optional[str]]:
+        """parse_saml_xml() for one entity, parsing only its EntityDescriptor."""
+        return parse_saml_xml(self.entity_xml(entity_id), entity_id=entity_id)
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def open_metadata_index(path: str) -> SamlMetadataIndex:
+    """Return a process-wide SamlMetadataIndex for path, refreshed if the file has changed."""
+    path = os.path.abspath(path)
+    with _indexes_lock:
+        index = _indexes.get(path)
+        if index is None:
+            index = _indexes[path] = SamlMetadataIndex(path)
+    index.refresh()
+    return index
+
+
+def main():
+    if len(sys.argv) != 2:
+        print("Usage: python3 saml_index.py <metadata.xml>")
+        sys.exit(1)
+    index = open_metadata_index(sys.argv[1])
+    print(f"✅ {len(index)} entities indexed in {index.index_path}")
+
+
+if __name__ == "__main__":
+    main()
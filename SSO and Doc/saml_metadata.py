@@ -0,0 +1,280 @@
+"""
+SAML Metadata Parsing
+
+Single-pass, streaming extraction of the fields a SAML2 external provider
+needs (SSO entry point, signing certificate, entityID). Works on a single
+IdP's metadata as well as on federation aggregates (eduGAIN/InCommon style
+EntitiesDescriptor files with thousands of EntityDescriptors): each
+EntityDescriptor is cleared from memory once it has been read, so memory stays
+bounded by the largest descriptor and time is linear in the document size.
+
+Usage:
+    from saml_metadata import parse_saml_xml, parse_saml_file, iter_saml_entities
+
+    parse_saml_xml(xml_string)                               # single IdP
+    parse_saml_file('aggregate.xml', entity_id='https://idp.example.edu/idp')
+"""
+from typing import Dict, Iterator, Optional
+from xml.parsers import expat
+
+MD_NS = 'urn:oasis:names:tc:SAML:2.0:metadata'
+DS_NS = 'http://www.w3.org/2000/09/xmldsig#'
+
+# Element names as reported by expat with namespace_separator=' '
+ENTITY_DESCRIPTOR = f'{MD_NS} EntityDescriptor'
+IDP_SSO_DESCRIPTOR = f'{MD_NS} IDPSSODescriptor'
+SINGLE_SIGN_ON_SERVICE = f'{MD_NS} SingleSignOnService'
+KEY_DESCRIPTOR = f'{MD_NS} KeyDescriptor'
+X509_CERTIFICATE = f'{DS_NS} X509Certificate'
+
+# Characters/bytes fed to the parser at a time
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def format_certificate(cert_text: str) -> str:
+    """Format certificate text as PEM if needed."""
+    cert_text = cert_text.strip()
+    if not cert_text.startswith('-----BEGIN'):
+        # Add PEM headers if missing
+        cert_text = '-----BEGIN CERTIFICATE-----\n' + cert_text + '\n-----END CERTIFICATE-----'
+    return cert_text
+
+
+class _EntityCollector:
+    """Fields collected so far for one EntityDescriptor (or the document root)."""
+    def __init__(self, entity_id: Optional[str], depth: int):
+        self.entity_id = entity_id
+        self.depth = depth
+        self.entry_point = None
+        self.has_idp = False
+        self.idp_depth = None
+        self.key_descriptor_depth = None
+        self.key_descriptor_use = None
+        self.key_descriptor_cert = None
+        self.signing_key_found = False
+        self.signing_cert = None
+        self.first_key_found = False
+        self.first_key_cert = None
+        self.first_cert = None
+
+    def start(self, name, attrs, depth):
+        if name == IDP_SSO_DESCRIPTOR:
+            # Only the first IDPSSODescriptor is used
+            if not self.has_idp:
+                self.has_idp = True
+                self.idp_depth = depth
+        elif self.idp_depth is not None:
+            if name == SINGLE_SIGN_ON_SERVICE and self.entry_point is None:
+                self.entry_point = attrs.get('Location')
+            elif name == KEY_DESCRIPTOR and self.key_descriptor_depth is None:
+                self.key_descriptor_depth = depth
+                self.key_descriptor_use = attrs.get('use')
+                self.key_descriptor_cert = None
+
+    def end(self, name, depth):
+        if depth == self.key_descriptor_depth:
+            # Prefer the first use="signing" KeyDescriptor, else the first of any use
+            if self.key_descriptor_use == 'signing' and not self.signing_key_found:
+                self.signing_key_found = True
+                self.signing_cert = self.key_descriptor_cert
+            if not self.first_key_found:
+                self.first_key_found = True
+                self.first_key_cert = self.key_descriptor_cert
+            self.key_descriptor_depth = None
+        elif depth == self.idp_depth:
+            self.idp_depth = None
+
+    def certificate(self, cert_text):
+        if cert_text:
+            if self.first_cert is None:
+                self.first_cert = cert_text
+            if self.key_descriptor_depth is not None and self.key_descriptor_cert is None:
+                self.key_descriptor_cert = cert_text
+
+    def result(self) -> Dict[str, Optional[str]]:
+        if self.signing_key_found:
+            cert = self.signing_cert
+        else:
+            cert = self.first_key_cert
+        # Fall back to any certificate in the descriptor
+        cert = cert or self.first_cert
+        return {
+            'entry_point': self.entry_point,
+            'public_cert': format_certificate(cert) if cert else None,
+            'entity_id': self.entity_id,
+            'name_key': None,
+            'email_key': None
+        }
+
+
+# Elements the collectors act on; everything else only affects nesting depth
+_TRACKED_NAMES = frozenset([
+    ENTITY_DESCRIPTOR, IDP_SSO_DESCRIPTOR, SINGLE_SIGN_ON_SERVICE, KEY_DESCRIPTOR, X509_CERTIFICATE
+])
+
+
+class _MetadataScanner:
+    """
+    Drives expat over the document and routes events to the innermost
+    collector. No element tree is built: each descriptor is reduced to its
+    collector as it is read, and finished collectors are handed out per chunk.
+    """
+    def __init__(self):
+        self.parser = expat.ParserCreate(namespace_separator=' ')
+        self.parser.buffer_text = True
+        self.parser.StartElementHandler = self._start
+        self.parser.EndElementHandler = self._end
+        self.parser.CharacterDataHandler = self._characters
+        self.depth = 0
+        self.collectors = []
+        self.finished = []
+        self.root = None
+        self.cert_parts = None
+
+    def _start(self, name, attrs):
+        self.depth += 1
+        if name not in _TRACKED_NAMES:
+            if self.root is None:
+                # Document root that isn't an EntityDescriptor (e.g. EntitiesDescriptor)
+                self.root = _EntityCollector(attrs.get('entityID'), self.depth)
+                self.collectors.append(self.root)
+            return
+        if self.root is None:
+            # The document is a single EntityDescriptor
+            self.root = _EntityCollector(attrs.get('entityID'), self.depth)
+            self.collectors.append(self.root)
+        elif name == ENTITY_DESCRIPTOR:
+            self.collectors.append(_EntityCollector(attrs.get('entityID'), self.depth))
+        if name == X509_CERTIFICATE:
+            self.cert_parts = []
+        else:
+            self.collectors[-1].start(name, attrs, self.depth)
+
+    def _end(self, name):
+        if name in _TRACKED_NAMES:
+            collector = self.collectors[-1]
+            if name == X509_CERTIFICATE:
+                collector.certificate(''.join(self.cert_parts or ()).strip())
+                self.cert_parts = None
+            else:
+                collector.end(name, self.depth)
+                if name == ENTITY_DESCRIPTOR and collector is not self.root:
+                    self.finished.append(self.collectors.pop())
+        self.depth -= 1
+
+    def _characters(self, data):
+        if self.cert_parts is not None:
+            self.cert_parts.append(data)
+
+    def scan(self, source) -> Iterator[_EntityCollector]:
+        yielded = False
+        for chunk in _iter_chunks(source):
+            self.parser.Parse(chunk, False)
+            if self.finished:
+                finished, self.finished = self.finished, []
+                yielded = True
+                yield from finished
+        self.parser.Parse(b'', True)
+        if self.finished:
+            yielded = True
+            yield from self.finished
+        if self.root is not None and not yielded:
+            yield self.root
+
+
+def _iter_chunks(source):
+    if isinstance(source, (str, bytes)):
+        for start in range(0, len(source), READ_CHUNK_SIZE):
+            yield source[start:start + READ_CHUNK_SIZE]
+    else:
+        while True:
+            chunk = source.read(READ_CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+
+def _iter_collectors(source) -> Iterator[_EntityCollector]:
+    return _MetadataScanner().scan(source)
+
+
+def iter_saml_entities(source) -> Iterator[Dict[str, Optional[str]]]:
+    """
+    Stream the provider fields of every EntityDescriptor in SAML metadata.
+
+    Args:
+        source: XML as str/bytes, or a file object opened in text or binary mode
+
+    Yields:
+        One dict per EntityDescriptor, in document order, with the same keys as
+        parse_saml_xml(). Nothing else from the document is kept in memory. A document
+        with no nested EntityDescriptor yields a single dict for its root.
+
+    Raises:
+        xml.parsers.expat.ExpatError on malformed XML
+    """
+    for collector in _iter_collectors(source):
+        yield collector.result()
+
+
+def _select_entity(source, entity_id: Optional[str]) -> Optional[Dict[str, Optional[str]]]:
+    """Pick entity_id if given, else the first IdP (or failing that, the first entity)."""
+    first = None
+    for collector in _iter_collectors(source):
+        if entity_id is not None:
+            if collector.entity_id == entity_id:
+                return collector.result()
+            continue
+        if collector.has_idp:
+            return collector.result()
+        if first is None:
+            first = collector
+    return first.result() if first is not None else None
+
+
+def parse_saml_xml(saml_xml: str, entity_id: Optional[str] = None) -> Dict[str, Optional[str]]:
+    """
+    Parse SAML XML metadata to extract required configuration fields.
+
+    Args:
+        saml_xml: SAML metadata XML as string
+        entity_id: For aggregates, the entityID of the IdP to extract (default:
+                   the first EntityDescriptor that describes an IdP)
+
+    Returns:
+        Dictionary with extracted fields:
+        - entry_point: SSO URL (SingleSignOnService Location)
+        - public_cert: X509 certificate (from X509Certificate element)
+        - entity_id: Entity ID (from EntityDescriptor entityID)
+        - name_key: Optional name attribute key
+        - email_key: Optional email attribute key
+    """
+    try:
+        result = _select_entity(saml_xml, entity_id)
+    except expat.ExpatError as e:
+        raise ValueError(f"Invalid SAML XML: {e}")
+    except Exception as e:
+        raise ValueError(f"Error parsing SAML XML: {e}")
+
+    if result is None:
+        if entity_id is not None:
+            raise ValueError(f"EntityDescriptor {entity_id!r} not found in SAML metadata")
+        raise ValueError("Invalid SAML XML: no elements found")
+    return result
+
+
+def parse_saml_file(path: str, entity_id: Optional[str] = None) -> Dict[str, Optional[str]]:
+    """parse_saml_xml() for a metadata file, streamed from disk rather than read into memory."""
+    with open(path, 'rb') as f:
+        try:
+            result = _select_entity(f, entity_id)
+        except expat.ExpatError as e:
+            raise ValueError(f"Invalid SAML XML: {e}")
+        except Exception as e:
+            raise ValueError(f"Error parsing SAML XML: {e}")
+
+    if result is None:
+        if entity_id is not None:
+            raise ValueError(f"EntityDescriptor {entity_id!r} not found in {path}")
+        raise ValueError(f"Invalid SAML XML: no elements found in {path}")
+    return result
@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+"""
+SAML Metadata Preflight
+
+Checks a directory of customer IdP metadata files before rollout: each file is
+parsed (saml_metadata.parse_saml_file) and its signing certificate decoded to
+check expiry and key size. Files are processed across a process pool and one
+JSON line is printed per file as soon as it is done.
+
+Results are cached: decoded certificates by SHA-256 fingerprint, and parsed
+files by size + mtime, so repeat runs only re-parse files that changed. Expiry
+is re-evaluated on every run.
+
+Usage:
+    python3 saml_preflight.py /path/to/metadata-dir [--warn-days 30] [--min-rsa-bits 2048]
+        [--workers N] [--cache FILE] [--pattern '*.xml']
+
+Exit status is 1 if any file has an error (parse failure, missing fields,
+expired certificate, weak key), else 0.
+"""
+import argparse
+import base64
+import binascii
+import fnmatch
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+from saml_metadata import parse_saml_file
+
+CACHE_FILENAME = '.saml_preflight_cache.json'
+CACHE_VERSION = 1
+
+# SubjectPublicKeyInfo algorithms and named curves we can size
+RSA_OID = '1.2.840.113549.1.1.1'
+DSA_OID = '1.2.840.10040.4.1'
+EC_OID = '1.2.840.10045.2.1'
+ED25519_OID = '1.3.101.112'
+ED448_OID = '1.3.101.113'
+EC_CURVE_BITS = {
+    '1.2.840.10045.3.1.7': 256,  # P-256
+    '1.3.132.0.34': 384,         # P-384
+    '1.3.132.0.35': 521,         # P-521
+}
+COMMON_NAME_OID = '2.5.4.3'
+
+
+# ============================================================================
+# CERTIFICATE DECODING
+# ============================================================================
+
+def _read_tlv(data: bytes, pos: int):
+    """Read one DER element at pos. Returns (tag, value_start, value_end)."""
+    tag = data[pos]
+    length = data[pos + 1]
+    pos += 2
+    if length & 0x80:
+        num_bytes = length & 0x7f
+        length = int.from_bytes(data[pos:pos + num_bytes], 'big')
+        pos += num_bytes
+    if pos + length > len(data):
+        raise ValueError("truncated DER element")
+    return tag, pos, pos + length
+
+
+def _children(data: bytes, start: int, end: int):
+    """List (tag, value_start, value_end) for each element between start and end."""
+    children = []
+    while start < end:
+        tag, value_start, value_end = _read_tlv(data, start)
+        children.append((tag, value_start, value_end))
+        start = value_end
+    return children
+
+
+def _decode_oid(value: bytes) -> str:
+    parts = [value[0] // 40, value[0] % 40]
+    current = 0
+    for byte in value[1:]:
+        current = (current << 7) | (byte & 0x7f)
+        if not byte & 0x80:
+            parts.append(current)
+            current = 0
+    return '.'.join(str(part) for part in parts)
+
+
+def _decode_time(tag: int, value: bytes) -> datetime:
+    text = value.decode('ascii').rstrip('Z')
+    if tag == 0x17:
+        # UTCTime: two-digit year, 50-99 => 19xx
+        year = int(text[:2])
+        text = str(1900 + year if year >= 50 else 2000 + year) + text[2:]
+    return datetime.strptime(text[:14], '%Y%m%d%H%M%S').replace(tzinfo=timezone.utc)
+
+
+def _integer_bits(value: bytes) -> int:
+    return int.from_bytes(value, 'big').bit_length()
+
+
+def _common_name(data: bytes, start: int, end: int) -> Optional[str]:
+    for _, set_start, set_end in _children(data, start, end):
+        for _, seq_start, seq_end in _children(data, set_start, set_end):
+            attr = _children(data, seq_start, seq_end)
+            if len(attr) == 2 and _decode_oid(data[attr[0][1]:attr[0][2]]) == COMMON_NAME_OID:
+                return data[attr[1][1]:attr[1][2]].decode('utf-8', 'replace')
+    return None
+
+
+def _public_key(data: bytes, start: int, end: int):
+    """Return (key_type, key_bits) from a SubjectPublicKeyInfo."""
+    algorithm, key = _children(data, start, end)[:2]
+    algorithm_parts = _children(data, algorithm[1], algorithm[2])
+    oid = _decode_oid(data[algorithm_parts[0][1]:algorithm_parts[0][2]])
+    # BIT STRING value starts with an "unused bits" byte
+    key_bytes = data[key[1] + 1:key[2]]
+
+    if oid == RSA_OID:
+        modulus = _children(key_bytes, 0, len(key_bytes))[0]
+        _, modulus_start, modulus_end = _children(key_bytes, modulus[1], modulus[2])[0]
+        return 'RSA', _integer_bits(key_bytes[modulus_start:modulus_end])
+    if oid == EC_OID:
+        curve = algorithm_parts[1] if len(algorithm_parts) > 1 else None
+        curve_oid = _decode_oid(data[curve[1]:curve[2]]) if curve and curve[0] == 0x06 else None
+        return 'EC', EC_CURVE_BITS.get(curve_oid)
+    if oid == DSA_OID and len(algorithm_parts) > 1:
+        p = _children(data, algorithm_parts[1][1], algorithm_parts[1][2])[0]
+        return 'DSA', _integer_bits(data[p[1]:p[2]])
+    if oid == ED25519_OID:
+        return 'Ed25519', 256
+    if oid == ED448_OID:
+        return 'Ed448', 456
+    return oid, None
+
+
+def decode_certificate(cert_text: str) -> Dict:
+    """
+    Decode a PEM or bare base64 X509 certificate.
+
+    Returns:
+        Dictionary with fingerprint_sha256, subject_cn, not_before, not_after
+        (ISO 8601, UTC), key_type and key_bits
+    """
+    body = ''.join(
+        line for line in cert_text.strip().splitlines() if not line.startswith('-----')
+    )
+    try:
+        der = base64.b64decode(''.join(body.split()), validate=True)
+    except (binascii.Error, ValueError) as e:
+        raise ValueError(f"Certificate is not valid base64: {e}")
+
+    try:
+        _, cert_start, cert_end = _read_tlv(der, 0)
+        _, tbs_start, tbs_end = _children(der, cert_start, cert_end)[0]
+        fields = _children(der, tbs_start, tbs_end)
+        if fields[0][0] == 0xa0:
+            # Explicit [0] version
+            fields = fields[1:]
+        # serial, signature, issuer, validity, subject, subjectPublicKeyInfo
+        validity, subject, spki = fields[3], fields[4], fields[5]
+        not_before, not_after = [
+            _decode_time(tag, der[start:end]) for tag, start, end in _children(der, validity[1], validity[2])
+        ]
+        key_type, key_bits = _public_key(der, spki[1], spki[2])
+        subject_cn = _common_name(der, subject[1], subject[2])
+    except (IndexError, ValueError) as e:
+        raise ValueError(f"Could not decode X509 certificate: {e}")
+
+    return {
+        'fingerprint_sha256': hashlib.sha256(der).hexdigest(),
+        'subject_cn': subject_cn,
+        'not_before': not_before.isoformat(),
+        'not_after': not_after.isoformat(),
+        'key_type': key_type,
+        'key_bits': key_bits
+    }
+
+
+def certificate_fingerprint(cert_text: str) -> str:
+    """SHA-256 of the certificate's DER bytes (without decoding its fields)."""
+    body = ''.join(line for line in cert_text.strip().splitlines() if not line.startswith('-----'))
+    return hashlib.sha256(base64.b64decode(''.join(body.split()))).hexdigest()
+
+
+# ============================================================================
+# PER-FILE CHECKS
+# ============================================================================
+
+def inspect_file(path: str, known_fingerprints=frozenset()) -> Dict:
+    """
+    Parse one metadata file (runs in a worker process). The certificate is only
+    decoded if its fingerprint isn't in known_fingerprints.
+    """
+    record = {'file': path}
+    try:
+        saml_data = parse_saml_file(path)
+    except ValueError as e:
+        record['parse_error'] = str(e)
+        return record
+
+    record['entity_id'] = saml_data['entity_id']
+    record['entry_point'] = saml_data['entry_point']
+    cert_text = saml_data['public_cert']
+    if cert_text:
+        try:
+            fingerprint = certificate_fingerprint(cert_text)
+            record['fingerprint_sha256'] = fingerprint
+            if fingerprint not in known_fingerprints:
+                record['certificate'] = decode_certificate(cert_text)
+        except (ValueError, binascii.Error) as e:
+            record['certificate_error'] = str(e)
+    return record
+
+
+def evaluate(record: Dict, certificate: Optional[Dict], now: datetime, warn_days: int, min_rsa_bits: int) -> Dict:
+    """Turn a parsed record + decoded certificate into the output line with problems and status."""
+    problems = []
+    warnings = []
+    if 'parse_error' in record:
+        problems.append(record['parse_error'])
+    else:
+        if not record.get('entry_point'):
+            problems.append('missing entry_point (SingleSignOnService Location)')
+        if 'certificate_error' in record:
+            problems.append(record['certificate_error'])
+        elif certificate is None:
+            problems.append('missing X509 certificate')
+        else:
+            not_before = datetime.fromisoformat(certificate['not_before'])
+            not_after = datetime.fromisoformat(certificate['not_after'])
+            days_left = (not_after - now) / timedelta(days=1)
+            if not_after <= now:
+                problems.append(f"certificate expired on {certificate['not_after']}")
+            elif days_left <= warn_days:
+                warnings.append(f"certificate expires in {int(days_left)} days")
+            if not_before > now:
+                problems.append(f"certificate not valid until {certificate['not_before']}")
+            if certificate['key_type'] == 'RSA' and (certificate['key_bits'] or 0) < min_rsa_bits:
+                problems.append(f"RSA key is {certificate['key_bits']} bits (minimum {min_rsa_bits})")
+            elif certificate['key_bits'] is None:
+                warnings.append(f"could not determine key size for {certificate['key_type']} key")
+
+    line = {
+        'file': record['file'],
+        'status': 'error' if problems else 'warning' if warnings else 'ok',
+        'entity_id': record.get('entity_id'),
+        'entry_point': record.get('entry_point'),
+        'certificate': certificate,
+        'problems': problems,
+        'warnings': warnings
+    }
+    return line
+
+
+# ============================================================================
+# CACHE
+# ============================================================================
+
+def load_cache(path: str) -> Dict:
+    try:
+        with open(path, 'r') as f:
+            cache = json.load(f)
+        if cache.get('version') == CACHE_VERSION:
+            return cache
+    except (OSError, ValueError):
+        pass
+    return {'version': CACHE_VERSION, 'files': {}, 'certificates': {}}
+
+
+def save_cache(path: str, cache: Dict):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(cache, f)
+    os.replace(tmp_path, path)
+
+
+def _file_signature(path: str) -> Dict:
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+# ============================================================================
+# MAIN EXECUTION
+# ============================================================================
+
+def preflight_directory(directory: str, pattern: str = '*.xml', workers: Optional[int] = None,
+                        cache_path: Optional[str] = None, warn_days: int = 30,
+                        min_rsa_bits: int = 2048, out=sys.stdout) -> Dict:
+    """
+    Preflight every metadata file in directory matching pattern, writing one
+    JSON line per file to `out` as results arrive.
+
+    Returns:
+        Dictionary of counts: files, ok, warning, error, cached
+    """
+    cache_path = cache_path or os.path.join(directory, CACHE_FILENAME)
+    cache = load_cache(cache_path)
+    file_cache, cert_cache = cache['files'], cache['certificates']
+    now = datetime.now(timezone.utc)
+    counts = {'files': 0, 'ok': 0, 'warning': 0, 'error': 0, 'cached': 0}
+
+    paths = sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if fnmatch.fnmatch(name, pattern) and os.path.isfile(os.path.join(directory, name))
+    )
+
+    def emit(record):
+        certificate = cert_cache.get(record.get('fingerprint_sha256'))
+        line = evaluate(record, certificate, now, warn_days, min_rsa_bits)
+        counts['files'] += 1
+        counts[line['status']] += 1
+        out.write(json.dumps(line) + '\n')
+        out.flush()
+
+    # Unchanged files are answered straight from the cache
+    pending = []
+    for path in paths:
+        cached = file_cache.get(path)
+        if cached and cached['signature'] == _file_signature(path):
+            counts['cached'] += 1
+            emit(cached['record'])
+        else:
+            pending.append(path)
+
+    if pending:
+        known = frozenset(cert_cache)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(inspect_file, path, known): path for path in pending}
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    record = future.result()
+                except Exception as e:
+                    record = {'file': path, 'parse_error': f"Error inspecting file: {e}"}
+                certificate = record.pop('certificate', None)
+                if certificate is not None:
+                    cert_cache[certificate['fingerprint_sha256']] = certificate
+                file_cache[path] = {'signature': _file_signature(path), 'record': record}
+                emit(record)
+
+    # Forget files that have been removed from the directory
+    for path in list(file_cache):
+        if os.path.dirname(path) == directory and path not in paths:
+            del file_cache[path]
+    try:
+        save_cache(cache_path, cache)
+    except OSError as e:
+        print(f"Warning: Could not save preflight cache {cache_path}: {e}", file=sys.stderr)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Preflight a directory of SAML IdP metadata files')
+    parser.add_argument('directory', help='Directory containing metadata files')
+    parser.add_argument('--pattern', default='*.xml', help='Filename pattern to check (default: *.xml)')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: one per CPU)')
+    parser.add_argument('--cache', help=f'Cache file (default: <directory>/{CACHE_FILENAME})')
+    parser.add_argument('--warn-days', type=int, default=30, help='Warn when a certificate expires within this many days')
+    parser.add_argument('--min-rsa-bits', type=int, default=2048, help='Minimum acceptable RSA key size')
+    args = parser.parse_args()
+
+    directory = os.path.abspath(args.directory)
+    counts = preflight_directory(
+        directory, pattern=args.pattern, workers=args.workers, cache_path=args.cache,
+        warn_days=args.warn_days, min_rsa_bits=args.min_rsa_bits
+    )
+    print(f"{counts['files']} files: {counts['ok']} ok, {counts['warning']} warning, "
+          f"{counts['error']} error ({counts['cached']} unchanged since last run)", file=sys.stderr)
+    sys.exit(1 if counts['error'] else 0)
+
+
+if __name__ == "__main__":
+    main()
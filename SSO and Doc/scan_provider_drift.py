@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+External Provider Drift Scanner
+
+Read-only counterpart to the batch mode of setup_external_providers.py: for
+every environment in a desired-state manifest (same format as --manifest), it
+lists /api/external_providers, builds the config setup_saml_provider /
+setup_docusign_provider would have written, and reports any differences.
+
+One JSON line is written per desired provider as soon as its environment has
+been scanned, so results can be piped into other tools while the scan runs.
+The manifest is streamed (CSV/JSONL) and only a bounded number of
+environments are in flight, so memory stays flat however large the fleet is.
+
+Record fields: env_id, base_uri, provider ('saml' | 'docusign'), name, type,
+provider_id, status ('in_sync' | 'drifted' | 'missing' | 'error'),
+drift ({field: {'expected': ..., 'actual': ...}}), error, scanned_at.
+Certificates are reported as SHA-256 fingerprints rather than in full.
+
+Usage:
+    python3 scan_provider_drift.py --manifest desired.jsonl --secret <SECRET_KEY> \
+        [--workers 16] [--per-host-limit 2] [--output drift.jsonl]
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, TextIO
+
+from saml_preflight import certificate_fingerprint
+from setup_external_providers import (
+    HostConcurrencyLimiter,
+    backend_host,
+    build_docusign_provider_config,
+    build_saml_provider_config,
+    get_account_id,
+    get_base_uri,
+    get_provider_registry,
+    iter_manifest,
+    load_saml_xml,
+    open_session,
+    parse_saml_provider_fields,
+    provider_field_diff,
+)
+
+
+# ============================================================================
+# DESIRED STATE
+# ============================================================================
+
+def desired_providers(entry: Dict, account_id: Optional[int], base_uri: str) -> List[Dict]:
+    """
+    The provider configs provision_environment() would write for this manifest
+    entry, as [{'provider': 'saml' | 'docusign', 'config': {...} or 'error': ...}].
+    """
+    desired = []
+    if entry.get('saml_xml'):
+        item = {'provider': 'saml', 'name': entry.get('saml_name') or 'SAML SSO', 'type': 'saml2'}
+        try:
+            saml_data = parse_saml_provider_fields(
+                load_saml_xml(entry['saml_xml'], entry.get('saml_entity_id')), entry.get('saml_entity_id')
+            )
+            item['config'] = build_saml_provider_config(
+                saml_data, item['name'], account_id, base_uri, entry.get('saml_provides') or ['auth']
+            )
+        except Exception as e:
+            item['error'] = str(e)
+        desired.append(item)
+
+    if entry.get('docusign_account_id') and entry.get('docusign_base_url'):
+        item = {'provider': 'docusign', 'name': entry.get('docusign_name') or 'DocuSign Integration',
+                'type': 'docusign'}
+        try:
+            item['config'] = build_docusign_provider_config(
+                entry['docusign_account_id'], entry['docusign_base_url'], item['name'], account_id,
+                environment=entry.get('docusign_env') or 'production'
+            )
+        except Exception as e:
+            item['error'] = str(e)
+        desired.append(item)
+    return desired
+
+
+# ============================================================================
+# COMPARISON
+# ============================================================================
+
+def _display_option(key: str, value):
+    if key == 'public_cert' and isinstance(value, str):
+        try:
+            return f"sha256:{certificate_fingerprint(value)}"
+        except Exception:
+            return value
+    return value
+
+
+def provider_drift(desired: Dict, existing: Dict) -> Dict:
+    """
+    Field-by-field differences between a desired config and the stored
+    provider, using the same rules as the no-op check in the setup functions.
+    Options are reported individually as 'options.<key>'.
+    """
+    drift = {}
+    for field, (expected, actual) in provider_field_diff(desired, existing).items():
+        key = field.split('.', 1)[1] if field.startswith('options.') else field
+        drift[field] = {'expected': _display_option(key, expected), 'actual': _display_option(key, actual)}
+    return drift
+
+
+# ============================================================================
+# SCANNING
+# ============================================================================
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def scan_environment(entry: Dict, default_secret: Optional[str], limiter: HostConcurrencyLimiter) -> List[Dict]:
+    """Scan one environment; returns its drift records and never raises."""
+    base = {'env_id': entry['env_id']}
+    try:
+        secret = entry.get('secret') or default_secret
+        if not secret:
+            raise ValueError("No secret in manifest entry and no --secret given")
+        base_uri = get_base_uri(entry['env_id'])
+        base['base_uri'] = base_uri
+        with limiter.limit(backend_host(base_uri)):
+            session, base_uri = open_session(entry['env_id'], secret)
+            registry = get_provider_registry(session)
+            registry.refresh()
+            account_id = get_account_id(session)
+            if account_id is None:
+                # Desired configs would carry account_id=None and every
+                # provider would look drifted; setup would refuse this entry too
+                raise ValueError("Could not determine account_id, so drift can't be checked")
+            desired = desired_providers(entry, account_id, base_uri)
+    except Exception as e:
+        return [dict(base, status='error', error=str(e), scanned_at=_now())]
+
+    records = []
+    for item in desired:
+        record = dict(base, provider=item['provider'], name=item['name'], type=item['type'])
+        if 'error' in item:
+            record.update(status='error', error=item['error'])
+        else:
+            existing = registry.lookup(item['name'], item['type'])
+            if existing is None:
+                record.update(status='missing', provider_id=None)
+            else:
+                drift = provider_drift(item['config'], existing)
+                record.update(status='drifted' if drift else 'in_sync', provider_id=existing.get('id'))
+                if drift:
+                    record['drift'] = drift
+        record['scanned_at'] = _now()
+        records.append(record)
+    return records
+
+
+def scan_fleet(
+    entries: Iterable[Dict],
+    out: TextIO,
+    default_secret: Optional[str] = None,
+    max_workers: int = 8,
+    per_host_limit: int = 2
+) -> Dict:
+    """
+    Scan environments concurrently, writing JSONL drift records to `out` as
+    each environment finishes (so output is in completion order).
+
+    At most 2 * max_workers environments are queued at once, so `entries` can
+    be a generator over an arbitrarily large manifest.
+
+    Returns:
+        Counts by status plus `environments` and `wall_clock_seconds`.
+    """
+    limiter = HostConcurrencyLimiter(per_host_limit)
+    counts = {'in_sync': 0, 'drifted': 0, 'missing': 0, 'error': 0}
+    environments = 0
+    write_lock = threading.Lock()
+    started = time.monotonic()
+
+    def emit(records):
+        with write_lock:
+            for record in records:
+                counts[record['status']] = counts.get(record['status'], 0) + 1
+                out.write(json.dumps(record, default=str) + '\n')
+            out.flush()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = set()
+        for entry in entries:
+            if len(pending) >= 2 * max_workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    emit(future.result())
+            pending.add(pool.submit(scan_environment, entry, default_secret, limiter))
+            environments += 1
+        for future in as_completed(pending):
+            emit(future.result())
+
+    return dict(counts, environments=environments,
+                wall_clock_seconds=round(time.monotonic() - started, 3))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report external providers that have drifted from a manifest')
+    parser.add_argument('--manifest', required=True, help='Desired-state manifest (CSV, JSON or JSONL)')
+    parser.add_argument('--secret', help='Luminance API secret key (default for entries without one)')
+    parser.add_argument('--workers', type=int, default=8, help='Environments scanned concurrently')
+    parser.add_argument('--per-host-limit', type=int, default=2,
+                        help='Maximum concurrent environments against one backend host, e.g. app.luminance.com')
+    parser.add_argument('--output', help='Write JSONL drift records here (default: stdout)')
+    args = parser.parse_args()
+
+    out = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        summary = scan_fleet(iter_manifest(args.manifest), out, default_secret=args.secret,
+                             max_workers=args.workers, per_host_limit=args.per_host_limit)
+    finally:
+        if args.output:
+            out.close()
+
+    print(f"Scanned {summary['environments']} environments in {summary['wall_clock_seconds']}s: "
+          f"{summary['in_sync']} in sync, {summary['drifted']} drifted, {summary['missing']} missing, "
+          f"{summary['error']} errors", file=sys.stderr)
+    # Non-zero exit so CI/cron jobs notice drift
+    sys.exit(1 if summary['drifted'] or summary['missing'] or summary['error'] else 0)
+
+
+if __name__ == "__main__":
+    main()
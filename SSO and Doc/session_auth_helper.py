@@ -4,37 +4,233 @@ Helper to create session-based authentication for /api endpoints
 
 The /api/external_providers endpoints require session-based auth (not OAuth2).
 This helper creates a session using username:password authentication.
+
+Login state can optionally be persisted with a SessionStore so later runs
+reuse the session cookie instead of repeating the CSRF login handshake.
 """
 import os
 import base64
+import hashlib
+import json
+import threading
+import time
 import requests
 import re
-from dotenv import load_dotenv
+from contextlib import contextmanager
+
+from env_resolver import resolve_base_uri
+from fast_json import json_body, response_json
+from resilience import call_with_retry
+from session_metrics import instrumented_request, operation
+from tracing import span
+from transport import transports
+
+try:
+    import fcntl
+except ImportError:
+    # Windows - the store still works, just without cross-process locking
+    fcntl = None
+
+_env_loaded = False
+
+
+def load_env():
+    """
+    Load .env into os.environ the first time credentials are needed, rather
+    than at import time (callers that pass credentials explicitly never pay
+    for it). Existing environment variables are not overridden.
+    """
+    global _env_loaded
+    if _env_loaded:
+        return
+    _env_loaded = True
+    try:
+        from dotenv import load_dotenv
+    except ImportError:
+        return
+    load_dotenv()
+
+
+def extract_csrf_token(login_page_html):
+    """Pull the CSRF token out of the /login page."""
+    csrf_match = re.search(r"csrf.*?'([^']+)'", login_page_html)
+    if not csrf_match:
+        raise ValueError("Could not extract CSRF token from login page")
+    return csrf_match.group(1)
+
+
+class SessionStore:
+    """
+    On-disk store of login state (session cookies + CSRF token).
+    
+    One file per (base_uri, username) under `directory` (default:
+    $LUMINANCE_SESSION_STORE or ~/.luminance/sessions), written with 0600
+    permissions. Access to each entry is serialised with a file lock so
+    concurrent processes don't all log in at once.
+    """
+    def __init__(self, directory=None):
+        if not directory:
+            load_env()
+        self.directory = directory or os.getenv("LUMINANCE_SESSION_STORE") or \
+            os.path.join(os.path.expanduser("~"), ".luminance", "sessions")
+    
+    def _path(self, base_uri, username):
+        digest = hashlib.sha256(f"{base_uri.rstrip('/')}\n{username}".encode()).hexdigest()[:32]
+        return os.path.join(self.directory, f"{digest}.json")
+    
+    @contextmanager
+    def locked(self, base_uri, username):
+        """Hold an exclusive lock on the entry for (base_uri, username)."""
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        with open(self._path(base_uri, username) + ".lock", "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+    
+    def load(self, base_uri, username):
+        """Return the saved state dict ({'cookies': [...], 'csrf': ...}) or None."""
+        try:
+            with open(self._path(base_uri, username), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+    
+    def save(self, base_uri, username, cookies, csrf_token):
+        """Persist a cookie jar and CSRF token for (base_uri, username)."""
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        state = {
+            "base_uri": base_uri.rstrip('/'),
+            "csrf": csrf_token,
+            "saved_at": time.time(),
+            "cookies": [
+                {
+                    "name": c.name,
+                    "value": c.value,
+                    "domain": c.domain,
+                    "path": c.path,
+                    "secure": c.secure,
+                    "expires": c.expires
+                }
+                for c in cookies
+            ]
+        }
+        path = self._path(base_uri, username)
+        tmp_path = path + ".tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+    
+    def delete(self, base_uri, username):
+        try:
+            os.remove(self._path(base_uri, username))
+        except OSError:
+            pass
 
-load_dotenv()
 
 class SessionAuth:
-    """Session-based authentication for /api endpoints"""
-    def __init__(self, base_uri, username, password):
+    """
+    Session-based authentication for /api endpoints. Failed requests are
+    retried according to retry_policy (default: resilience.DEFAULT_RETRY_POLICY).
+    json= bodies are encoded with fast_json. timeout (seconds, or a
+    (connect, read) tuple as requests takes it) applies to every request,
+    including the login, unless a call passes its own.
+    
+    A session restored from the store can still expire mid-run; the first
+    401 it gets triggers one fresh login (saved back to the store) and the
+    request is retried.
+    """
+    # get(..., stream=True) is honoured (see fast_json.iter_json_array)
+    supports_streaming = True
+    
+    def __init__(self, base_uri, username, password, store=None, retry_policy=None, timeout=None):
         self.base_uri = base_uri.rstrip('/')
-        self.session = requests.Session()
-        self._login(username, password)
+        # Own cookie jar, but connections come from the host's shared pool
+        self.session = transports.session(self.base_uri)
+        self.csrf_token = None
+        self.retry_policy = retry_policy
+        self.timeout = timeout
+        self._username = username
+        self._password = password
+        self._store = store
+        self._restored = False
+        self._relogin_lock = threading.Lock()
+        if store is None:
+            self._login(username, password)
+            return
+        
+        with store.locked(self.base_uri, username):
+            self._restored = self._restore(store.load(self.base_uri, username))
+            if not self._restored:
+                self._login(username, password)
+                store.save(self.base_uri, username, self.session.cookies, self.csrf_token)
+    
+    @span('restore_session')
+    def _restore(self, state):
+        """
+        Load saved cookies + CSRF token and check them with one request.
+        Returns False (leaving a clean session) if there is no usable state.
+        """
+        if not state or not state.get("csrf"):
+            return False
+        for cookie in state.get("cookies", []):
+            self.session.cookies.set(
+                cookie["name"], cookie["value"],
+                domain=cookie.get("domain"), path=cookie.get("path") or "/",
+                secure=cookie.get("secure", False), expires=cookie.get("expires")
+            )
+        self.csrf_token = state["csrf"]
+        self.session.headers.update({'X-CSRF-Token': self.csrf_token})
+        
+        try:
+            check = instrumented_request(self.session.request, 'GET', self.base_uri + '/api/users/me',
+                                         timeout=self.timeout)
+            if check.status_code == 200:
+                return True
+        except requests.RequestException:
+            pass
+        
+        # Session has expired (or the check failed) - start again from scratch
+        self._clear()
+        return False
+    
+    def _clear(self):
+        self.session.cookies.clear()
+        self.session.headers.pop('X-CSRF-Token', None)
+        self.csrf_token = None
     
+    def _relogin(self):
+        """Replace an expired restored session with a fresh login (once), and save it."""
+        with self._relogin_lock:
+            if not self._restored:
+                # Another thread has already logged in again
+                return
+            with self._store.locked(self.base_uri, self._username):
+                self._clear()
+                self._login(self._username, self._password)
+                self._store.save(self.base_uri, self._username, self.session.cookies, self.csrf_token)
+            self._restored = False
+    
+    @operation('login')
     def _login(self, username, password):
         """Login using session-based auth with CSRF tokens"""
         # Step 1: Get CSRF token from login page
-        login_page = self.session.get(self.base_uri + '/login')
+        login_page = call_with_retry(
+            lambda: instrumented_request(self.session.request, 'GET', self.base_uri + '/login', timeout=self.timeout),
+            'GET', self.base_uri, self.retry_policy
+        )
         login_page.raise_for_status()
         
         # Extract CSRF token
-        csrf_match = re.search(r"csrf.*?'([^']+)'", login_page.text)
-        if not csrf_match:
-            raise ValueError("Could not extract CSRF token from login page")
-        csrf_token = csrf_match.group(1)
+        csrf_token = extract_csrf_token(login_page.text)
         
         # Step 2: POST to /auth/login with CSRF token
-        login_response = self.session.post(
-            self.base_uri + '/auth/login',
+        login_response = call_with_retry(lambda: instrumented_request(
+            self.session.request, 'POST', self.base_uri + '/auth/login',
             data={
                 'username': username,
                 'password': password
@@ -42,44 +238,47 @@ class SessionAuth:
             headers={
                 'X-CSRF-Token': csrf_token,
                 'Content-Type': 'application/x-www-form-urlencoded'
-            }
-        )
+            },
+            timeout=self.timeout
+        ), 'POST', self.base_uri, self.retry_policy)
         login_response.raise_for_status()
         
         # Step 3: Get new CSRF token from response
-        login_data = login_response.json()
+        login_data = response_json(login_response)
         if 'csrf' in login_data:
             self.csrf_token = login_data['csrf']
             self.session.headers.update({'X-CSRF-Token': self.csrf_token})
         else:
             raise ValueError("Could not get CSRF token from login response")
     
-    def get(self, path, **kwargs):
+    def _request(self, method, path, **kwargs):
         url = f"{self.base_uri}{path}" if path.startswith('/') else f"{self.base_uri}/{path}"
-        res = self.session.get(url, **kwargs)
+        kwargs = json_body(kwargs)
+        kwargs.setdefault('timeout', self.timeout)
+        send = lambda: instrumented_request(self.session.request, method, url, **kwargs)
+        res = call_with_retry(send, method, url, self.retry_policy)
+        if res.status_code == 401 and self._restored:
+            # The saved session expired since it was restored - log in again and retry once
+            self._relogin()
+            res = call_with_retry(send, method, url, self.retry_policy)
         res.raise_for_status()
         return res
     
+    def get(self, path, **kwargs):
+        return self._request('GET', path, **kwargs)
+    
     def put(self, path, **kwargs):
-        url = f"{self.base_uri}{path}" if path.startswith('/') else f"{self.base_uri}/{path}"
-        res = self.session.put(url, **kwargs)
-        res.raise_for_status()
-        return res
+        return self._request('PUT', path, **kwargs)
     
     def post(self, path, **kwargs):
-        url = f"{self.base_uri}{path}" if path.startswith('/') else f"{self.base_uri}/{path}"
-        res = self.session.post(url, **kwargs)
-        res.raise_for_status()
-        return res
+        return self._request('POST', path, **kwargs)
     
     def patch(self, path, **kwargs):
-        url = f"{self.base_uri}{path}" if path.startswith('/') else f"{self.base_uri}/{path}"
-        res = self.session.patch(url, **kwargs)
-        res.raise_for_status()
-        return res
+        return self._request('PATCH', path, **kwargs)
 
 
-def create_session_auth(env_id: str, username: str = None, password: str = None, base64_token: str = None):
+def create_session_auth(env_id: str, username: str = None, password: str = None, base64_token: str = None,
+                        session_store: SessionStore = None):
     """
     Create session-based authentication.
     
@@ -88,22 +287,13 @@ def create_session_auth(env_id: str, username: str = None, password: str = None,
         username: Username (or from env var)
         password: Password (or from env var)
         base64_token: Base64 encoded username:password token (alternative to username/password)
+        session_store: Optional SessionStore; a saved, still-valid session is reused
+                       (one request) and a full login is only done when it has expired
     
     Returns:
         SessionAuth instance
     """
-    import lumpy.api
-    
-    # Determine base_uri
-    if env_id.startswith('http'):
-        base_uri = env_id.rstrip('/')
-    elif '.app.luminance.com' in env_id or '.support.luminance.com' in env_id:
-        base_uri = f"https://{env_id}" if not env_id.startswith('http') else env_id
-        base_uri = base_uri.rstrip('/')
-    elif len(env_id) == 6 and env_id.isdigit():
-        base_uri = lumpy.api.default_base_uri(env_id)
-    else:
-        base_uri = f"https://{env_id}.app.luminance.com"
+    base_uri = resolve_base_uri(env_id)
     
     # Get credentials
     if base64_token:
@@ -112,6 +302,7 @@ def create_session_auth(env_id: str, username: str = None, password: str = None,
         username = creds[0]
         password = creds[1] if len(creds) > 1 else ''
     else:
+        load_env()
         if not username:
             username = os.getenv("USERNAME")
         if not password:
@@ -120,4 +311,4 @@ def create_session_auth(env_id: str, username: str = None, password: str = None,
         if not username or not password:
             raise ValueError("Username and password required (or provide base64_token)")
     
-    return SessionAuth(base_uri, username, password)
+    return SessionAuth(base_uri, username, password, store=session_store)
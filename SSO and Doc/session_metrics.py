@@ -0,0 +1,447 @@
+"""
+Request Instrumentation for the Session Wrappers
+
+OAuthSession, SessionAuth, their asyncio counterparts and the token/login
+requests behind them send every HTTP request through instrumented_request()
+(or instrumented_request_async()). With no hooks registered that is a plain
+call; once a hook is registered each request produces a RequestEvent (method,
+endpoint, status, latency, request/response bytes and the logical operation it
+was made for) that is passed to every hook.
+
+MetricsRecorder is the built-in hook: it aggregates events into counters and
+latency histograms and exports them as Prometheus text or a JSON snapshot.
+
+Usage:
+    from session_metrics import enable_metrics, operation
+
+    metrics = enable_metrics()
+    with operation('setup_saml_provider'):
+        ...                                   # requests are attributed to this operation
+    print(metrics.to_prometheus())
+    json.dump(metrics.snapshot(), f)
+"""
+import contextvars
+import functools
+import json
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from tracing import span
+
+# Latency histogram bucket upper bounds, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRIC_PREFIX = 'luminance_http'
+
+_hooks: List[Callable] = []
+_hooks_lock = threading.Lock()
+_current_operation = contextvars.ContextVar('luminance_operation', default=None)
+
+
+class RequestEvent:
+    """One completed (or failed) HTTP request."""
+    __slots__ = ('method', 'url', 'endpoint', 'status', 'elapsed', 'request_bytes', 'response_bytes',
+                 'operation', 'error')
+
+    def __init__(self, method, url, status, elapsed, request_bytes, response_bytes, operation, error=None):
+        self.method = method
+        self.url = url
+        self.endpoint = normalize_endpoint(url)
+        self.status = status
+        self.elapsed = elapsed
+        self.request_bytes = request_bytes
+        self.response_bytes = response_bytes
+        self.operation = operation
+        self.error = error
+
+    def to_dict(self) -> Dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def normalize_endpoint(url: str) -> str:
+    """Path with numeric IDs collapsed, so /api/external_providers/12 and /13 share a label."""
+    return re.sub(r'/\d+(?=/|$)', '/{id}', urlparse(url).path) or '/'
+
+
+# ============================================================================
+# HOOKS
+# ============================================================================
+
+def add_request_hook(hook: Callable[[RequestEvent], None]):
+    """Register hook(event) to be called after every request."""
+    with _hooks_lock:
+        if hook not in _hooks:
+            _hooks.append(hook)
+
+
+def remove_request_hook(hook: Callable[[RequestEvent], None]):
+    with _hooks_lock:
+        if hook in _hooks:
+            _hooks.remove(hook)
+
+
+def _body_length(body) -> int:
+    if body is None:
+        return 0
+    if isinstance(body, str):
+        return len(body.encode())
+    try:
+        return len(body)
+    except TypeError:
+        # Generators/file objects - size unknown without consuming them
+        return 0
+
+
+def _emit(event: RequestEvent):
+    for hook in list(_hooks):
+        try:
+            hook(event)
+        except Exception as e:
+            # A broken hook must never fail the request it is observing
+            print(f"Warning: request hook {hook!r} failed: {e}")
+
+
+def _request_size(response) -> int:
+    request = getattr(response, 'request', None)
+    try:
+        # requests: PreparedRequest.body, httpx: Request.content
+        return _body_length(getattr(request, 'body', None) or getattr(request, 'content', None))
+    except Exception:
+        return 0
+
+
+def _response_size(response) -> int:
+    """Body size without reading a streamed (stream=True) body that hasn't been read yet."""
+    if getattr(response, '_content_consumed', True):
+        try:
+            return len(response.content or b'')
+        except Exception:
+            # httpx raises ResponseNotRead for an unread streamed body
+            pass
+    try:
+        return int(response.headers.get('Content-Length') or 0)
+    except (AttributeError, ValueError):
+        return 0
+
+
+def _report(method, url, started, response=None, error=None):
+    elapsed = time.perf_counter() - started
+    if error is not None:
+        # Wrappers that raise for HTTP errors (lumpy's HTTPError) still carry the response
+        failed = getattr(error, 'response', None)
+        status = getattr(failed, 'status_code', None)
+        event = RequestEvent(method, url, status, elapsed,
+                             _request_size(failed) if status is not None else 0,
+                             _response_size(failed) if status is not None else 0,
+                             _current_operation.get(), error=f"{type(error).__name__}: {error}")
+    else:
+        event = RequestEvent(method, url, response.status_code, elapsed, _request_size(response),
+                             _response_size(response), _current_operation.get())
+    _emit(event)
+
+
+def instrumented_request(send: Callable, method: str, url: str, **kwargs):
+    """
+    Call send(method, url, **kwargs) (e.g. requests.Session.request) and report
+    the request to the registered hooks. Exceptions are reported and re-raised.
+    """
+    if not _hooks:
+        return send(method, url, **kwargs)
+
+    started = time.perf_counter()
+    try:
+        response = send(method, url, **kwargs)
+    except Exception as e:
+        _report(method, url, started, error=e)
+        raise
+    _report(method, url, started, response)
+    return response
+
+
+async def instrumented_request_async(send: Callable, method: str, url: str, **kwargs):
+    """instrumented_request() for a coroutine such as httpx.AsyncClient.request."""
+    if not _hooks:
+        return await send(method, url, **kwargs)
+
+    started = time.perf_counter()
+    try:
+        response = await send(method, url, **kwargs)
+    except Exception as e:
+        _report(method, url, started, error=e)
+        raise
+    _report(method, url, started, response)
+    return response
+
+
+def hooks_enabled() -> bool:
+    return bool(_hooks)
+
+
+class InstrumentedSession:
+    """
+    Wraps any session with get/put/post/patch(path, **kwargs) methods (e.g.
+    lumpy.api.Session) so its requests are reported to the hooks as well.
+    Other attributes pass through to the wrapped session.
+    """
+    def __init__(self, session):
+        self._wrapped = session
+
+    def __getattr__(self, name):
+        return getattr(self._wrapped, name)
+
+    def _request(self, method, path, **kwargs):
+        send = getattr(self._wrapped, method.lower())
+        return instrumented_request(lambda _method, _url, **kw: send(path, **kw), method, path, **kwargs)
+
+    def get(self, path, **kwargs):
+        return self._request('GET', path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self._request('PUT', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self._request('POST', path, **kwargs)
+
+    def patch(self, path, **kwargs):
+        return self._request('PATCH', path, **kwargs)
+
+
+# ============================================================================
+# LOGICAL OPERATIONS
+# ============================================================================
+
+_operation_listeners: List[Callable] = []
+
+
+@contextmanager
+def operation(name: str):
+    """
+    Attribute requests made inside this block (in this thread/task) to `name`.
+    Also usable as a decorator on plain functions. Operations started inside
+    another one are folded into the outer one, so e.g. the users/me lookup made
+    by setup_saml_provider counts towards setup_saml_provider. Every
+    operation, nested or not, is also a tracing span.
+    """
+    with span(name):
+        if _current_operation.get() is not None:
+            yield
+            return
+        token = _current_operation.set(name)
+        try:
+            for listener in list(_operation_listeners):
+                listener(name)
+            yield
+        finally:
+            _current_operation.reset(token)
+
+
+def async_operation(name: str):
+    """operation(name) as a decorator for coroutine functions."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with operation(name):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def current_operation() -> Optional[str]:
+    return _current_operation.get()
+
+
+# ============================================================================
+# AGGREGATION AND EXPORT
+# ============================================================================
+
+class MetricsRecorder:
+    """
+    Request hook that aggregates events per (operation, method, endpoint):
+    request counts by status, latency histogram, and bytes sent/received.
+    Also counts how many times each operation was entered, so requests per
+    operation can be derived.
+    """
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = {}       # (operation, method, endpoint, status) -> count
+            self.latency = {}        # (operation, method, endpoint) -> [bucket counts..., +Inf, sum, count]
+            self.bytes_sent = {}     # (operation, method, endpoint) -> bytes
+            self.bytes_received = {}
+            self.operations = {}     # operation -> times entered
+            self.started_at = time.time()
+
+    def __call__(self, event: RequestEvent):
+        operation_name = event.operation or ''
+        key = (operation_name, event.method, event.endpoint)
+        status = str(event.status) if event.status is not None else 'error'
+        with self._lock:
+            request_key = key + (status,)
+            self.requests[request_key] = self.requests.get(request_key, 0) + 1
+            histogram = self.latency.get(key)
+            if histogram is None:
+                histogram = self.latency[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if event.elapsed <= bound:
+                    histogram[i] += 1
+                    break
+            else:
+                histogram[len(self.buckets)] += 1
+            histogram[-2] += event.elapsed
+            histogram[-1] += 1
+            self.bytes_sent[key] = self.bytes_sent.get(key, 0) + event.request_bytes
+            self.bytes_received[key] = self.bytes_received.get(key, 0) + event.response_bytes
+
+    def operation_started(self, name: str):
+        with self._lock:
+            self.operations[name] = self.operations.get(name, 0) + 1
+
+    def snapshot(self) -> Dict:
+        """JSON-serialisable view of everything recorded so far."""
+        with self._lock:
+            endpoints = []
+            for key, histogram in sorted(self.latency.items()):
+                operation_name, method, endpoint = key
+                statuses = {
+                    status: count for (op, m, e, status), count in self.requests.items()
+                    if (op, m, e) == key
+                }
+                count = histogram[-1]
+                endpoints.append({
+                    'operation': operation_name or None,
+                    'method': method,
+                    'endpoint': endpoint,
+                    'count': count,
+                    'statuses': statuses,
+                    'latency_seconds': {
+                        'sum': round(histogram[-2], 6),
+                        'mean': round(histogram[-2] / count, 6) if count else 0.0,
+                        'buckets': dict(zip([str(b) for b in self.buckets] + ['+Inf'],
+                                            _cumulative(histogram[:-2])))
+                    },
+                    'request_bytes': self.bytes_sent.get(key, 0),
+                    'response_bytes': self.bytes_received.get(key, 0)
+                })
+
+            per_operation = {}
+            for entry in endpoints:
+                name = entry['operation']
+                if name is not None:
+                    per_operation[name] = per_operation.get(name, 0) + entry['count']
+            operations = {
+                name: {
+                    'calls': calls,
+                    'requests': per_operation.get(name, 0),
+                    'requests_per_call': round(per_operation.get(name, 0) / calls, 2) if calls else None
+                }
+                for name, calls in sorted(self.operations.items())
+            }
+            return {
+                'started_at': self.started_at,
+                'snapshot_at': time.time(),
+                'total_requests': sum(self.requests.values()),
+                'operations': operations,
+                'endpoints': endpoints
+            }
+
+    def to_json(self, **kwargs) -> str:
+        return json.dumps(self.snapshot(), **kwargs)
+
+    def to_prometheus(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        name = METRIC_PREFIX
+        lines = []
+        with self._lock:
+            lines += [f'# HELP {name}_requests_total HTTP requests made by the Luminance session wrappers.',
+                      f'# TYPE {name}_requests_total counter']
+            for (op, method, endpoint, status), count in sorted(self.requests.items()):
+                lines.append(f'{name}_requests_total{_labels(op, method, endpoint, status=status)} {count}')
+
+            lines += [f'# HELP {name}_request_duration_seconds HTTP request latency.',
+                      f'# TYPE {name}_request_duration_seconds histogram']
+            for (op, method, endpoint), histogram in sorted(self.latency.items()):
+                bounds = [_format_bound(b) for b in self.buckets] + ['+Inf']
+                for bound, count in zip(bounds, _cumulative(histogram[:-2])):
+                    lines.append(f'{name}_request_duration_seconds_bucket'
+                                 f'{_labels(op, method, endpoint, le=bound)} {count}')
+                labels = _labels(op, method, endpoint)
+                lines.append(f'{name}_request_duration_seconds_sum{labels} {histogram[-2]:.6f}')
+                lines.append(f'{name}_request_duration_seconds_count{labels} {histogram[-1]}')
+
+            for metric, values, help_text in (
+                ('request_bytes_total', self.bytes_sent, 'Request body bytes sent.'),
+                ('response_bytes_total', self.bytes_received, 'Response body bytes received.')
+            ):
+                lines += [f'# HELP {name}_{metric} {help_text}', f'# TYPE {name}_{metric} counter']
+                for (op, method, endpoint), value in sorted(values.items()):
+                    lines.append(f'{name}_{metric}{_labels(op, method, endpoint)} {value}')
+
+            lines += ['# HELP luminance_operations_total Logical operations started.',
+                      '# TYPE luminance_operations_total counter']
+            for op, count in sorted(self.operations.items()):
+                lines.append(f'luminance_operations_total{{operation="{_escape(op)}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path: str):
+        """Write a Prometheus text file (.prom/.txt) or a JSON snapshot (anything else)."""
+        if path.endswith(('.prom', '.txt')):
+            content = self.to_prometheus()
+        else:
+            content = self.to_json(indent=2)
+        with open(path, 'w') as f:
+            f.write(content)
+
+
+def _cumulative(counts) -> List[int]:
+    total = 0
+    result = []
+    for count in counts:
+        total += count
+        result.append(total)
+    return result
+
+
+def _format_bound(bound: float) -> str:
+    return repr(float(bound))
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(operation_name, method, endpoint, **extra) -> str:
+    pairs = [('operation', operation_name), ('method', method), ('endpoint', endpoint)] + list(extra.items())
+    return '{' + ','.join(f'{key}="{_escape(str(value))}"' for key, value in pairs) + '}'
+
+
+_recorder: Optional[MetricsRecorder] = None
+
+
+def enable_metrics() -> MetricsRecorder:
+    """Register (once) and return the process-wide MetricsRecorder."""
+    global _recorder
+    with _hooks_lock:
+        if _recorder is None:
+            _recorder = MetricsRecorder()
+        if _recorder not in _hooks:
+            _hooks.append(_recorder)
+        if _recorder.operation_started not in _operation_listeners:
+            _operation_listeners.append(_recorder.operation_started)
+    return _recorder
+
+
+def disable_metrics():
+    """Unregister the process-wide MetricsRecorder (its data is kept)."""
+    with _hooks_lock:
+        if _recorder is not None:
+            if _recorder in _hooks:
+                _hooks.remove(_recorder)
+            if _recorder.operation_started in _operation_listeners:
+                _operation_listeners.remove(_recorder.operation_started)
@@ -10,6 +10,7 @@ Can be run standalone or called programmatically from Power Apps automation.
 
 Usage:
     python3 setup_external_providers.py --env-id <ENV_ID> --secret <SECRET> [options]
+    python3 setup_external_providers.py --manifest wave.csv [--workers 16] [--per-host-limit 2]
 
 Or import and use programmatically:
     from setup_external_providers import setup_saml_provider, setup_docusign_provider
@@ -18,130 +19,50 @@ Or import and use programmatically:
 import os
 import sys
 import json
-import argparse
-import xml.etree.ElementTree as ET
-from typing import Dict, Optional, Tuple
-from urllib.parse import urlparse
+import time
+import threading
+import weakref
+from collections import Counter
+from itertools import islice
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import urlencode, urlparse
 import re
 
-try:
-    import lumpy.api
-    from dotenv import load_dotenv
-except ImportError:
-    print("Error: Required packages not installed. Run: pip install python-dotenv")
-    print("Also ensure 'lumpy' package is available in your Python path.")
-    sys.exit(1)
+# Heavier modules (lumpy/requests, the XML parser, argparse, csv, thread pools)
+# are imported on first use, so the process only pays for the paths it runs -
+# e.g. --help or a DocuSign-only run never loads the SAML/XML stack.
+from env_resolver import resolve_base_uri
+from fast_json import iter_json_array, response_json
+from resilience import ResilientSession
+from session_metrics import InstrumentedSession, enable_metrics, hooks_enabled, operation
+from tracing import enable_tracing, span
 
 
-# ============================================================================
-# SAML XML PARSING
-# ============================================================================
-
-def parse_saml_xml(saml_xml: str) -> Dict[str, Optional[str]]:
-    """
-    Parse SAML XML metadata to extract required configuration fields.
-    
-    Args:
-        saml_xml: SAML metadata XML as string
-        
-    Returns:
-        Dictionary with extracted fields:
-        - entry_point: SSO URL (SingleSignOnService Location)
-        - public_cert: X509 certificate (from X509Certificate element)
-        - entity_id: Entity ID (from EntityDescriptor entityID)
-        - name_key: Optional name attribute key
-        - email_key: Optional email attribute key
-    """
+def _lumpy_api():
+    """Import lumpy.api on first use (it pulls in the whole HTTP stack)."""
     try:
-        # Register namespaces
-        namespaces = {
-            'md': 'urn:oasis:names:tc:SAML:2.0:metadata',
-            'ds': 'http://www.w3.org/2000/09/xmldsig#',
-            'saml': 'urn:oasis:names:tc:SAML:2.0:assertion'
-        }
-        
-        root = ET.fromstring(saml_xml)
-        
-        result = {
-            'entry_point': None,
-            'public_cert': None,
-            'entity_id': None,
-            'name_key': None,
-            'email_key': None
-        }
-        
-        # Extract Entity ID
-        result['entity_id'] = root.get('entityID')
-        
-        # Find IDPSSODescriptor (Identity Provider)
-        idp_descriptor = root.find('.//md:IDPSSODescriptor', namespaces)
-        if idp_descriptor is None:
-            # Try without namespace prefix
-            idp_descriptor = root.find('.//{urn:oasis:names:tc:SAML:2.0:metadata}IDPSSODescriptor')
-        
-        if idp_descriptor is not None:
-            # Find SingleSignOnService (entry point)
-            sso_service = idp_descriptor.find('.//md:SingleSignOnService', namespaces)
-            if sso_service is None:
-                sso_service = idp_descriptor.find('.//{urn:oasis:names:tc:SAML:2.0:metadata}SingleSignOnService')
-            
-            if sso_service is not None:
-                result['entry_point'] = sso_service.get('Location')
-            
-            # Find KeyDescriptor with signing certificate
-            key_descriptor = idp_descriptor.find('.//md:KeyDescriptor[@use="signing"]', namespaces)
-            if key_descriptor is None:
-                # Try without use attribute
-                key_descriptor = idp_descriptor.find('.//md:KeyDescriptor', namespaces)
-            if key_descriptor is None:
-                # Try without namespace
-                key_descriptor = idp_descriptor.find('.//{urn:oasis:names:tc:SAML:2.0:metadata}KeyDescriptor')
-            
-            if key_descriptor is not None:
-                # Find X509Certificate
-                cert_elem = key_descriptor.find('.//ds:X509Certificate', namespaces)
-                if cert_elem is None:
-                    cert_elem = key_descriptor.find('.//{http://www.w3.org/2000/09/xmldsig#}X509Certificate')
-                
-                if cert_elem is not None and cert_elem.text:
-                    cert_text = cert_elem.text.strip()
-                    # Format as PEM if not already
-                    if not cert_text.startswith('-----BEGIN'):
-                        cert_text = '-----BEGIN CERTIFICATE-----\n' + cert_text + '\n-----END CERTIFICATE-----'
-                    result['public_cert'] = cert_text
-        
-        # Try to find certificate in root if not found in IDP descriptor
-        if not result['public_cert']:
-            cert_elem = root.find('.//ds:X509Certificate', namespaces)
-            if cert_elem is None:
-                cert_elem = root.find('.//{http://www.w3.org/2000/09/xmldsig#}X509Certificate')
-            if cert_elem is not None and cert_elem.text:
-                cert_text = cert_elem.text.strip()
-                if not cert_text.startswith('-----BEGIN'):
-                    cert_text = '-----BEGIN CERTIFICATE-----\n' + cert_text + '\n-----END CERTIFICATE-----'
-                result['public_cert'] = cert_text
-        
-        return result
-        
-    except ET.ParseError as e:
-        raise ValueError(f"Invalid SAML XML: {e}")
-    except Exception as e:
-        raise ValueError(f"Error parsing SAML XML: {e}")
+        import lumpy.api
+    except ImportError:
+        print("Error: Required packages not installed.")
+        print("Ensure 'lumpy' package is available in your Python path.")
+        sys.exit(1)
+    return lumpy.api
 
 
-def format_certificate(cert_text: str) -> str:
-    """Format certificate text as PEM if needed."""
-    cert_text = cert_text.strip()
-    if not cert_text.startswith('-----BEGIN'):
-        # Add PEM headers if missing
-        cert_text = '-----BEGIN CERTIFICATE-----\n' + cert_text + '\n-----END CERTIFICATE-----'
-    return cert_text
+def __getattr__(name):
+    # SAML metadata parsing lives in saml_metadata.py; re-exported lazily for existing callers
+    if name in ('format_certificate', 'parse_saml_xml'):
+        import saml_metadata
+        return getattr(saml_metadata, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 # ============================================================================
 # LUMINANCE API HELPERS
 # ============================================================================
 
+@operation('get_account_id')
 def get_account_id(session) -> Optional[int]:
     """
     Get the account_id from existing providers or return None.
@@ -152,7 +73,7 @@ def get_account_id(session) -> Optional[int]:
         # Try to get from /api/users/me first (works with session-based auth)
         try:
             response = session.get('/api/users/me')
-            user_data = response.json()
+            user_data = response_json(response)
             account_id = user_data.get('account_id')
             if account_id:
                 return account_id
@@ -161,11 +82,15 @@ def get_account_id(session) -> Optional[int]:
             pass
         
         # Fallback: get account_id from existing external providers
+        registry = get_provider_registry(session)
+        if registry.is_fresh:
+            for provider in registry.providers():
+                if provider.get('account_id'):
+                    return provider['account_id']
         try:
-            response = session.get('/api/external_providers?limit=1')
-            providers = response.json()
-            if providers and len(providers) > 0:
-                account_id = providers[0].get('account_id')
+            provider = next(iter_external_providers(session, page_size=1), None)
+            if provider:
+                account_id = provider.get('account_id')
                 if account_id:
                     return account_id
         except:
@@ -177,8 +102,8 @@ def get_account_id(session) -> Optional[int]:
 
 
 def get_base_uri(env_id: str) -> str:
-    """Get the base URI for the Luminance environment."""
-    return lumpy.api.default_base_uri(env_id)
+    """Get the base URI for the Luminance environment (see env_resolver.py)."""
+    return resolve_base_uri(env_id)
 
 
 def get_saml_callback_uri(base_uri: str) -> str:
@@ -186,76 +111,295 @@ def get_saml_callback_uri(base_uri: str) -> str:
     return f"{base_uri}/saml2/sp"
 
 
+# Providers requested per page by iter_external_providers
+PROVIDER_PAGE_SIZE = 200
+
+
+class ProviderPager:
+    """
+    limit/offset paging over /api/external_providers, independent of how
+    requests are made, so iter_external_providers and the async
+    aiter_external_providers share it. Request path(), hand the decoded page
+    to accept() and yield what it returns until done; once `unpaged` is set
+    (the server ignored offset), request path() once more and pass its items
+    through unpaged_items() instead.
+    """
+    def __init__(self, page_size: int = PROVIDER_PAGE_SIZE, filters: Optional[Dict] = None):
+        self.page_size = page_size
+        self.filters = filters or {}
+        self.offset = 0
+        self.done = False
+        self.unpaged = False
+        self._previous_first_id = None
+    
+    def path(self) -> str:
+        """Path of the next request."""
+        if self.unpaged:
+            query = urlencode(self.filters)
+        else:
+            query = urlencode(dict(self.filters, limit=self.page_size, offset=self.offset))
+        return f'/api/external_providers?{query}' if query else '/api/external_providers'
+    
+    def _matches(self, provider: Dict) -> bool:
+        return all(provider.get(key) == value for key, value in self.filters.items())
+    
+    def accept(self, page: List[Dict]) -> List[Dict]:
+        """The providers of one page to yield, advancing to the next page."""
+        if not page:
+            self.done = True
+            return []
+        
+        # A server that ignores offset hands back the same page again - fall back
+        # to a single unpaged request and skip what has already been yielded
+        first_id = page[0].get('id')
+        if self.offset and first_id is not None and first_id == self._previous_first_id:
+            self.unpaged = True
+            return []
+        self._previous_first_id = first_id
+        
+        # A short page is the last one; an oversized one means limit was ignored
+        if len(page) != self.page_size:
+            self.done = True
+        self.offset += len(page)
+        return [provider for provider in page if self._matches(provider)]
+    
+    def unpaged_items(self, providers: Iterable[Dict]) -> Iterator[Dict]:
+        """Filter the unpaged listing, skipping the providers already yielded from pages."""
+        self.done = True
+        return (provider for provider in islice(providers, self.offset, None) if self._matches(provider))
+
+
+def iter_external_providers(session, page_size: int = PROVIDER_PAGE_SIZE,
+                            filters: Optional[Dict] = None) -> Iterator[Dict]:
+    """
+    Lazily iterate over /api/external_providers, one page at a time.
+    
+    Pages are requested with limit/offset, so only one page is held in memory
+    and breaking out of the loop (e.g. after the first match) stops further
+    requests. Filters such as {'name': ..., 'type': ...} are sent as query
+    parameters for the collection router to apply, and are re-checked locally
+    in case the server ignores them.
+    """
+    pager = ProviderPager(page_size, filters)
+    while not pager.done:
+        if pager.unpaged:
+            # The whole list comes back at once, so decode it item by item (from
+            # the stream where the session supports it) instead of all at once
+            stream = {'stream': True} if getattr(session, 'supports_streaming', False) else {}
+            yield from pager.unpaged_items(iter_json_array(session.get(pager.path(), **stream)))
+            return
+        yield from pager.accept(response_json(session.get(pager.path())))
+
+
+def list_external_providers(session) -> List[Dict]:
+    """
+    Every provider, from one unpaged request (decoded from the stream where
+    the session supports it). For building a complete index; consumers that
+    can stop early should use iter_external_providers.
+    """
+    stream = {'stream': True} if getattr(session, 'supports_streaming', False) else {}
+    return list(iter_json_array(session.get('/api/external_providers', **stream)))
+
+
+def find_external_provider(session, name: str, provider_type: str) -> Optional[Dict]:
+    """Stream providers filtered by name and type and return the first match, or None."""
+    return next(iter_external_providers(session, filters={'name': name, 'type': provider_type}), None)
+
+
+# Seconds a fetched provider list is trusted before the registry lists again
+PROVIDER_REGISTRY_TTL = 300
+
+
+class ProviderRegistry:
+    """
+    Per-session index of /api/external_providers.
+    
+    The provider list is fetched once, in a single request, and indexed by
+    (name, type) and by id.
+    Providers returned by our own PUTs are recorded straight into the index,
+    so any number of lookups in one run costs a single list request. Lookups
+    by id never list: without a fresh listing the one provider is fetched on
+    its own. Call invalidate() (or let `ttl` seconds pass) to force a fresh
+    listing.
+    """
+    def __init__(self, session, ttl: float = PROVIDER_REGISTRY_TTL):
+        self.session = session
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._by_key = {}
+        self._by_id = {}
+        self._loaded_at = None
+    
+    @property
+    def is_fresh(self) -> bool:
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl
+    
+    @operation('list_external_providers')
+    def refresh(self):
+        """Re-fetch the full provider list from the API (one request, not one per page)."""
+        self.replace(list_external_providers(self.session))
+    
+    def replace(self, providers):
+        """Replace the index with a complete provider listing."""
+        providers = list(providers)
+        with self._lock:
+            self._by_key.clear()
+            self._by_id.clear()
+            for provider in providers:
+                self.record(provider)
+            self._loaded_at = time.monotonic()
+    
+    def record(self, provider: Dict):
+        """Add or update one provider (e.g. the body of a PUT response)."""
+        if not isinstance(provider, dict) or provider.get('id') is None:
+            return
+        with self._lock:
+            previous = self._by_id.get(provider['id'])
+            if previous is not None:
+                # Drop the old (name, type) entry in case the provider was renamed
+                self._by_key.pop((previous.get('name'), previous.get('type')), None)
+            self._by_id[provider['id']] = provider
+            self._by_key[(provider.get('name'), provider.get('type'))] = provider
+    
+    def _ensure_loaded(self):
+        with self._lock:
+            if not self.is_fresh:
+                self.refresh()
+    
+    def find(self, name: str, provider_type: str) -> Optional[Dict]:
+        """Return the provider with this name and type, or None."""
+        self._ensure_loaded()
+        return self._by_key.get((name, provider_type))
+    
+    def lookup(self, name: str, provider_type: str) -> Optional[Dict]:
+        """Return the indexed provider with this name and type without listing providers."""
+        return self._by_key.get((name, provider_type))
+    
+    def lookup_id(self, provider_id: int) -> Optional[Dict]:
+        """Return the indexed provider with this id without listing providers."""
+        return self._by_id.get(provider_id)
+    
+    def get(self, provider_id: int) -> Optional[Dict]:
+        """
+        Return the provider with this id, or None. Served from a fresh listing
+        if there is one, otherwise fetched with GET /api/external_providers/{id}.
+        """
+        with self._lock:
+            if self.is_fresh:
+                return self._by_id.get(provider_id)
+        try:
+            with operation('get_external_provider'):
+                provider = response_json(self.session.get(f'/api/external_providers/{provider_id}'))
+        except Exception as e:
+            if getattr(getattr(e, 'response', None), 'status_code', None) == 404:
+                return None
+            raise
+        self.record(provider)
+        return provider if isinstance(provider, dict) else None
+    
+    def providers(self) -> List[Dict]:
+        """Return every known provider."""
+        self._ensure_loaded()
+        return list(self._by_id.values())
+    
+    def invalidate(self):
+        """Forget the cached listing; the next lookup lists providers again."""
+        with self._lock:
+            self._loaded_at = None
+
+
+_registries = weakref.WeakKeyDictionary()
+_registries_lock = threading.Lock()
+
+
+def get_provider_registry(session) -> ProviderRegistry:
+    """Return the ProviderRegistry attached to this session, creating it on first use."""
+    with _registries_lock:
+        try:
+            registry = _registries.get(session)
+            if registry is None:
+                registry = _registries[session] = ProviderRegistry(session)
+        except TypeError:
+            # Session can't be weakly referenced - fall back to an unshared registry
+            registry = ProviderRegistry(session)
+        return registry
+
+
 def find_provider_by_name_type(session, name: str, provider_type: str) -> Optional[int]:
-    """Find an existing provider by name and type. Returns provider ID if found, None otherwise."""
+    """
+    Find an existing provider by name and type. Returns provider ID if found, None otherwise.
+    Lookups go through the session's ProviderRegistry, so only the first one lists providers.
+    """
     try:
-        response = session.get('/api/external_providers')
-        providers = response.json()
-        for provider in providers:
-            if provider.get('name') == name and provider.get('type') == provider_type:
-                return provider.get('id')
+        with span('find_provider_by_name_type', provider_name=name, provider_type=provider_type):
+            provider = get_provider_registry(session).find(name, provider_type)
+        return provider.get('id') if provider else None
+    except Exception as e:
+        print(f"Warning: Could not search for existing providers: {e}")
         return None
+
+
+def find_existing_provider(session, name: str, provider_type: str,
+                           provider_id: Optional[int] = None) -> Optional[Dict]:
+    """
+    Return the stored provider a setup call would update: provider_id if given,
+    otherwise the one with this name and type. None if there isn't one (or the
+    providers couldn't be listed).
+    """
+    try:
+        with span('find_existing_provider', provider_name=name, provider_type=provider_type):
+            registry = get_provider_registry(session)
+            return registry.get(provider_id) if provider_id else registry.find(name, provider_type)
     except Exception as e:
         print(f"Warning: Could not search for existing providers: {e}")
         return None
 
 
 # ============================================================================
-# PROVIDER SETUP FUNCTIONS
+# PROVIDER CONFIGURATION
 # ============================================================================
 
-def setup_saml_provider(
-    session,
-    saml_xml: str,
-    provider_name: str,
-    account_id: Optional[int] = None,
-    base_uri: Optional[str] = None,
-    provides: list = None,
-    name_key: Optional[str] = None,
-    email_key: Optional[str] = None,
-    provider_id: Optional[int] = None
-) -> Dict:
-    """
-    Set up a SAML2 SSO provider.
-    
-    Args:
-        session: Authenticated Luminance API session
-        saml_xml: SAML metadata XML string
-        provider_name: Name for the provider
-        account_id: Account ID (will be fetched if not provided)
-        base_uri: Base URI for callback (will be generated if not provided)
-        provides: List of capabilities ['auth', 'autoprovision', 'claims_mapping']
-        name_key: Optional SAML attribute key for user name
-        email_key: Optional SAML attribute key for user email
-        provider_id: Optional existing provider ID to update
-        
-    Returns:
-        Dictionary with provider data
-    """
-    if provides is None:
-        provides = ['auth']
-    
-    # Parse SAML XML
-    saml_data = parse_saml_xml(saml_xml)
+# Placeholder IDs for new providers. The collection router upserts on PUT and
+# assigns the real ID on insert, so these only need to be unlikely to exist.
+SAML_TEMP_PROVIDER_ID = 999999
+DOCUSIGN_TEMP_PROVIDER_ID = 999998
+
+DOCUSIGN_PRODUCTION_INTEGRATION_KEY = '824ad6b0-de12-4d65-a008-0f945cc9549c'  # Production (masked)
+DOCUSIGN_TESTING_INTEGRATION_KEY = '0f1754c4-b1b2-4817-9bcf-5908fa28d326'  # Testing
+
+
+def session_base_uri(session) -> str:
+    """Base URI of a lumpy.api.Session (base_url) or OAuthSession/SessionAuth (base_uri)."""
+    return (getattr(session, 'base_url', None) or session.base_uri).rstrip('/')
+
+
+def parse_saml_provider_fields(saml_xml: str, entity_id: Optional[str] = None) -> Dict[str, Optional[str]]:
+    """Parse SAML metadata (optionally one entity of an aggregate) and check it has the fields a SAML provider needs."""
+    from saml_metadata import parse_saml_xml
+    saml_data = parse_saml_xml(saml_xml, entity_id=entity_id)
     
     if not saml_data['entry_point']:
         raise ValueError("Could not extract entry_point from SAML XML")
     if not saml_data['public_cert']:
         raise ValueError("Could not extract public_cert from SAML XML")
     
-    # Get account_id if not provided
-    if account_id is None:
-        account_id = get_account_id(session)
-        if account_id is None:
-            raise ValueError(
-                "Could not determine account_id. Please provide it explicitly:\n"
-                "  setup_saml_provider(..., account_id=YOUR_ACCOUNT_ID)"
-            )
+    return saml_data
+
+
+def build_saml_provider_config(
+    saml_data: Dict[str, Optional[str]],
+    provider_name: str,
+    account_id: Optional[int],
+    base_uri: str,
+    provides: list = None,
+    name_key: Optional[str] = None,
+    email_key: Optional[str] = None
+) -> Dict:
+    """Build the /api/external_providers body for a SAML2 provider from parsed metadata."""
+    from saml_metadata import format_certificate
     
-    # Get base_uri if not provided (needed for callback URI)
-    if base_uri is None:
-        # Extract from session base_url
-        base_uri = session.base_url.rstrip('/')
+    if provides is None:
+        provides = ['auth']
     
     # Build provider configuration
     callback_uri = get_saml_callback_uri(base_uri)
@@ -290,81 +434,35 @@ def setup_saml_provider(
         except:
             pass
     
-    # Find existing provider if not specified
-    if not provider_id:
-        provider_id = find_provider_by_name_type(session, provider_name, 'saml2')
-    
-    # Create or update provider
-    # The collection router uses PUT with ID for upsert (create if doesn't exist, update if does)
-    if provider_id:
-        # Update existing provider
-        response = session.put(f'/api/external_providers/{provider_id}', json=provider_config)
-    else:
-        # For new providers, we need to use PUT with a high temporary ID
-        # The API will handle the actual ID assignment on insert
-        # Using a high number that's unlikely to conflict (collection router will assign real ID)
-        temp_id = 999999
-        response = session.put(f'/api/external_providers/{temp_id}', json=provider_config)
-    
-    if response.status_code not in [200, 201]:
-        raise Exception(f"Failed to create/update SAML provider: {response.status_code} - {response.text}")
-    
-    return response.json()
+    return provider_config
 
 
-def setup_docusign_provider(
-    session,
+def build_docusign_provider_config(
     account_id_docusign: str,
     base_url: str,
     provider_name: str = "DocuSign Integration",
     account_id: Optional[int] = None,
     integration_key: Optional[str] = None,
-    secret: Optional[str] = None,
-    provider_id: Optional[int] = None,
-    environment: str = 'production'  # 'production', 'testing', or 'development'
+    environment: str = 'production'
 ) -> Dict:
-    """
-    Set up a DocuSign provider.
-    
-    Args:
-        session: Authenticated Luminance API session
-        account_id_docusign: DocuSign Account ID (32-40 chars)
-        base_url: DocuSign base URL (e.g., 'account.docusign.net' or 'account-d.docusign.net')
-        provider_name: Name for the provider
-        account_id: Luminance account ID (will be fetched if not provided)
-        integration_key: DocuSign Integration Key (required for development, auto-set for prod/testing)
-        secret: DocuSign secret (will need to be set separately via updateSecret endpoint)
-        provider_id: Optional existing provider ID to update
-        
-    Returns:
-        Dictionary with provider data
-    """
-    # Get account_id if not provided
-    if account_id is None:
-        account_id = get_account_id(session)
-        if account_id is None:
-            # Don't fail immediately - try without it, API might accept it or give helpful error
-            print("   ⚠️  Warning: Could not determine account_id automatically.")
-            print("   Attempting to create provider anyway...")
-            print("   (If it fails, you'll need to provide account_id manually)")
-    
+    """Build the /api/external_providers body for a DocuSign provider."""
     # Determine host and identifier based on environment
     if 'account-d.docusign.net' in base_url or 'demo' in base_url.lower():
         host = 'account-d.docusign.net'
         if environment == 'testing':
-            identifier = '0f1754c4-b1b2-4817-9bcf-5908fa28d326'  # Testing
+            identifier = DOCUSIGN_TESTING_INTEGRATION_KEY
         else:
-            identifier = integration_key or '0f1754c4-b1b2-4817-9bcf-5908fa28d326'
+            identifier = integration_key or DOCUSIGN_TESTING_INTEGRATION_KEY
     else:
         host = 'account.docusign.net'
         if environment == 'production':
-            identifier = '824ad6b0-de12-4d65-a008-0f945cc9549c'  # Production (masked)
+            identifier = DOCUSIGN_PRODUCTION_INTEGRATION_KEY
         elif environment == 'development':
             if not integration_key:
                 raise ValueError("integration_key is required for development environment")
             identifier = integration_key
         else:
-            identifier = integration_key or '824ad6b0-de12-4d65-a008-0f945cc9549c'
+            identifier = integration_key or DOCUSIGN_PRODUCTION_INTEGRATION_KEY
     
     # Build provider configuration
     provider_config = {
@@ -382,53 +480,275 @@ def setup_docusign_provider(
     # Add account_id only if we have it (required by API)
     if account_id:
         provider_config['account_id'] = account_id
-    else:
-        print("   ⚠️  Warning: No account_id available - API will likely reject this request")
-        print("   The API requires account_id. You'll need to provide it manually.")
     
-    # Find existing provider if not specified
-    if not provider_id:
-        provider_id = find_provider_by_name_type(session, provider_name, 'docusign')
+    return provider_config
+
+
+def docusign_error_message(response, account_id: Optional[int]) -> str:
+    """Describe a failed DocuSign provider PUT."""
+    error_msg = f"Failed to create/update DocuSign provider: {response.status_code}"
+    try:
+        error_data = response_json(response)
+        if isinstance(error_data, dict):
+            error_msg += f"\n   Error: {error_data}"
+            if 'message' in error_data:
+                error_msg += f"\n   Message: {error_data['message']}"
+        else:
+            error_msg += f": {error_data}"
+    except:
+        error_msg += f"\n   Response: {response.text[:500]}"
+    
+    # If it's a 401/403 and we don't have account_id, provide helpful message
+    if response.status_code in [401, 403] and not account_id:
+        error_msg += "\n\n   💡 This might be because:"
+        error_msg += "\n   1. OAuth2 tokens don't work with /api endpoints"
+        error_msg += "\n   2. You need to provide account_id manually"
+        error_msg += "\n   3. Or use session-based auth instead (see AUTHENTICATION_OPTIONS.md)"
+    
+    return error_msg
+
+
+def _print_missing_account_id_warning():
+    # Don't fail immediately - try without it, API might accept it or give helpful error
+    print("   ⚠️  Warning: Could not determine account_id automatically.")
+    print("   Attempting to create provider anyway...")
+    print("   (If it fails, you'll need to provide account_id manually)")
+
+
+def _print_no_account_id_warning():
+    print("   ⚠️  Warning: No account_id available - API will likely reject this request")
+    print("   The API requires account_id. You'll need to provide it manually.")
+
+
+# Fields compared against the stored provider to decide whether a PUT is needed.
+# DocuSign's 'state' is deliberately not compared: re-running a wave must not
+# send an activated provider back to 'pending'.
+PROVIDER_DIFF_FIELDS = ('name', 'type', 'account_id', 'host', 'identifier', 'provides', 'options')
+# Fields only sent when a provider is created; an update leaves them as stored
+# (so an activated DocuSign provider isn't sent back to 'pending')
+PROVIDER_CREATE_ONLY_FIELDS = ('state',)
+
+
+def _normalize_field(field: str, value):
+    if field == 'provides' and isinstance(value, (list, tuple)):
+        return sorted(value)
+    if field == 'account_id' and value is not None:
+        return str(value)
+    return value
+
+
+def _normalize_option(key: str, value):
+    if key == 'public_cert' and isinstance(value, str):
+        # Same certificate regardless of line wrapping
+        return ''.join(value.split())
+    return value
+
+
+def provider_field_diff(desired: Dict, existing: Dict) -> Dict[str, Tuple]:
+    """
+    Return {field: (expected, actual)} for every compared field of `desired`
+    that differs from the stored provider `existing`.
+
+    Options are compared (and reported, as 'options.<key>') key by key, so
+    options the server adds on its side don't count as differences.
+    """
+    diff = {}
+    for field in PROVIDER_DIFF_FIELDS:
+        if field not in desired:
+            continue
+        wanted = desired[field]
+        if field == 'options':
+            stored = existing.get('options')
+            stored = stored if isinstance(stored, dict) else {}
+            for key, value in (wanted or {}).items():
+                if _normalize_option(key, value) != _normalize_option(key, stored.get(key)):
+                    diff[f'options.{key}'] = (value, stored.get(key))
+        elif _normalize_field(field, wanted) != _normalize_field(field, existing.get(field)):
+            diff[field] = (wanted, existing.get(field))
+    return diff
+
+
+def provider_config_changes(desired: Dict, existing: Dict) -> Dict:
+    """
+    Return the top-level fields of `desired` that differ from the stored
+    provider `existing`. An empty dict means a PUT would change nothing.
+    """
+    fields = {name.split('.', 1)[0] for name in provider_field_diff(desired, existing)}
+    return {field: desired[field] for field in PROVIDER_DIFF_FIELDS if field in fields}
+
+
+def plan_provider_upsert(desired: Dict, existing: Optional[Dict]) -> Tuple[str, Dict]:
+    """Return ('created' | 'updated' | 'unchanged', changed fields) for writing desired over existing."""
+    if not existing:
+        return 'created', dict(desired)
+    changes = provider_config_changes(desired, existing)
+    return ('updated' if changes else 'unchanged'), changes
+
+
+def provider_put_body(desired: Dict, outcome: str) -> Dict:
+    """The PUT body for a planned upsert: desired, minus create-only fields when updating."""
+    if outcome == 'created':
+        return desired
+    return {field: value for field, value in desired.items() if field not in PROVIDER_CREATE_ONLY_FIELDS}
+
+
+# ============================================================================
+# PROVIDER SETUP FUNCTIONS
+# ============================================================================
+
+@operation('setup_saml_provider')
+def setup_saml_provider(
+    session,
+    saml_xml: str,
+    provider_name: str,
+    account_id: Optional[int] = None,
+    base_uri: Optional[str] = None,
+    provides: list = None,
+    name_key: Optional[str] = None,
+    email_key: Optional[str] = None,
+    provider_id: Optional[int] = None,
+    entity_id: Optional[str] = None,
+    stats: Optional[Counter] = None
+) -> Dict:
+    """
+    Set up a SAML2 SSO provider. Nothing is written if the existing provider
+    already has this configuration.
+    
+    Args:
+        session: Authenticated Luminance API session
+        saml_xml: SAML metadata XML string
+        provider_name: Name for the provider
+        account_id: Account ID (will be fetched if not provided)
+        base_uri: Base URI for callback (will be generated if not provided)
+        provides: List of capabilities ['auth', 'autoprovision', 'claims_mapping']
+        name_key: Optional SAML attribute key for user name
+        email_key: Optional SAML attribute key for user email
+        provider_id: Optional existing provider ID to update
+        entity_id: entityID of the IdP to use when saml_xml is a federation aggregate
+        stats: Optional Counter; 'created', 'updated' or 'unchanged' is incremented
+        
+    Returns:
+        Dictionary with provider data
+    """
+    # Parse SAML XML
+    saml_data = parse_saml_provider_fields(saml_xml, entity_id)
+    
+    # Get account_id if not provided
+    if account_id is None:
+        account_id = get_account_id(session)
+        if account_id is None:
+            raise ValueError(
+                "Could not determine account_id. Please provide it explicitly:\n"
+                "  setup_saml_provider(..., account_id=YOUR_ACCOUNT_ID)"
+            )
+    
+    # Get base_uri if not provided (needed for callback URI)
+    if base_uri is None:
+        base_uri = session_base_uri(session)
+    
+    provider_config = build_saml_provider_config(
+        saml_data, provider_name, account_id, base_uri, provides, name_key, email_key
+    )
+    
+    # Compare with the existing provider (by ID if given, else by name) and skip no-op writes
+    existing = find_existing_provider(session, provider_name, 'saml2', provider_id)
+    outcome, _ = plan_provider_upsert(provider_config, existing)
+    if stats is not None:
+        stats[outcome] += 1
+    if outcome == 'unchanged':
+        return existing
     
     # Create or update provider
-    if provider_id:
-        response = session.put(f'/api/external_providers/{provider_id}', json=provider_config)
-    else:
-        # Use a high temp ID for new providers
-        temp_id = 999998
-        response = session.put(f'/api/external_providers/{temp_id}', json=provider_config)
+    # The collection router uses PUT with ID for upsert (create if doesn't exist, update if does)
+    provider_id = provider_id or (existing or {}).get('id')
+    with span('put_provider', outcome=outcome):
+        response = session.put(
+            f'/api/external_providers/{provider_id or SAML_TEMP_PROVIDER_ID}', json=provider_config
+        )
     
     if response.status_code not in [200, 201]:
-        error_msg = f"Failed to create/update DocuSign provider: {response.status_code}"
-        try:
-            error_data = response.json()
-            if isinstance(error_data, dict):
-                error_msg += f"\n   Error: {error_data}"
-                if 'message' in error_data:
-                    error_msg += f"\n   Message: {error_data['message']}"
-            else:
-                error_msg += f": {error_data}"
-        except:
-            error_msg += f"\n   Response: {response.text[:500]}"
-        
-        # If it's a 401/403 and we don't have account_id, provide helpful message
-        if response.status_code in [401, 403] and not account_id:
-            error_msg += "\n\n   💡 This might be because:"
-            error_msg += "\n   1. OAuth2 tokens don't work with /api endpoints"
-            error_msg += "\n   2. You need to provide account_id manually"
-            error_msg += "\n   3. Or use session-based auth instead (see AUTHENTICATION_OPTIONS.md)"
+        raise Exception(f"Failed to create/update SAML provider: {response.status_code} - {response.text}")
+    
+    provider_data = response_json(response)
+    get_provider_registry(session).record(provider_data)
+    return provider_data
+
+
+@operation('setup_docusign_provider')
+def setup_docusign_provider(
+    session,
+    account_id_docusign: str,
+    base_url: str,
+    provider_name: str = "DocuSign Integration",
+    account_id: Optional[int] = None,
+    integration_key: Optional[str] = None,
+    secret: Optional[str] = None,
+    provider_id: Optional[int] = None,
+    environment: str = 'production',  # 'production', 'testing', or 'development'
+    stats: Optional[Counter] = None
+) -> Dict:
+    """
+    Set up a DocuSign provider. The provider itself is only written if its
+    configuration differs from the existing one.
+    
+    Args:
+        session: Authenticated Luminance API session
+        account_id_docusign: DocuSign Account ID (32-40 chars)
+        base_url: DocuSign base URL (e.g., 'account.docusign.net' or 'account-d.docusign.net')
+        provider_name: Name for the provider
+        account_id: Luminance account ID (will be fetched if not provided)
+        integration_key: DocuSign Integration Key (required for development, auto-set for prod/testing)
+        secret: DocuSign secret (will need to be set separately via updateSecret endpoint)
+        provider_id: Optional existing provider ID to update
+        environment: 'production', 'testing' or 'development'
+        stats: Optional Counter; 'created', 'updated' or 'unchanged' is incremented
         
-        raise Exception(error_msg)
+    Returns:
+        Dictionary with provider data
+    """
+    # Get account_id if not provided
+    if account_id is None:
+        account_id = get_account_id(session)
+        if account_id is None:
+            _print_missing_account_id_warning()
+    
+    provider_config = build_docusign_provider_config(
+        account_id_docusign, base_url, provider_name, account_id, integration_key, environment
+    )
+    if not account_id:
+        _print_no_account_id_warning()
     
-    provider_data = response.json()
+    # Compare with the existing provider (by ID if given, else by name) and skip no-op writes
+    existing = find_existing_provider(session, provider_name, 'docusign', provider_id)
+    outcome, _ = plan_provider_upsert(provider_config, existing)
+    if stats is not None:
+        stats[outcome] += 1
     
-    # Update secret if provided
+    if outcome == 'unchanged':
+        provider_data = existing
+    else:
+        # Create or update provider
+        provider_id = provider_id or (existing or {}).get('id')
+        with span('put_provider', outcome=outcome):
+            response = session.put(
+                f'/api/external_providers/{provider_id or DOCUSIGN_TEMP_PROVIDER_ID}',
+                json=provider_put_body(provider_config, outcome)
+            )
+        
+        if response.status_code not in [200, 201]:
+            raise Exception(docusign_error_message(response, account_id))
+        
+        provider_data = response_json(response)
+        get_provider_registry(session).record(provider_data)
+    
+    # Update secret if provided (secrets can't be read back, so this always writes)
     if secret and 'id' in provider_data:
         update_secret(session, provider_data['id'], secret)
     
     return provider_data
 
 
+@operation('update_secret')
 def update_secret(session, provider_id: int, secret: str) -> bool:
     """Update the secret for an external provider."""
     try:
@@ -444,17 +764,300 @@ def update_secret(session, provider_id: int, secret: str) -> bool:
         raise Exception(f"Error updating secret: {e}")
 
 
+# ============================================================================
+# ENVIRONMENT PROVISIONING
+# ============================================================================
+
+def open_session(env_id: str, secret: str):
+    """Authenticate against an environment. Returns (session, base_uri)."""
+    base_uri = get_base_uri(env_id)
+    session = _lumpy_api().Session(base_uri)
+    with span('login', base_uri=base_uri):
+        session.login(secret)
+    if hooks_enabled():
+        session = InstrumentedSession(session)
+    # Retry 429/5xx with backoff and fail fast when the host is down (see resilience.py)
+    return ResilientSession(session, base_uri), base_uri
+
+
+def load_saml_xml(saml_xml: str, entity_id: Optional[str] = None) -> str:
+    """
+    Return SAML XML from a file path, or the value itself if it is not a file.
+    
+    With an entity_id, a file is treated as a federation aggregate and only that
+    entity's EntityDescriptor is read, via an entityID index (saml_index.py)
+    that is built once per file and reused across tenants.
+    """
+    if os.path.isfile(saml_xml):
+        if entity_id:
+            from saml_index import open_metadata_index
+            return open_metadata_index(saml_xml).entity_xml(entity_id)
+        with open(saml_xml, 'r') as f:
+            return f.read()
+    return saml_xml
+
+
+def provision_environment(session, base_uri: str, entry: Dict, verbose: bool = True,
+                          stats: Optional[Counter] = None) -> Dict:
+    """
+    Set up the SAML and/or DocuSign providers described by one manifest entry.
+
+    Failures are recorded per provider as {'error': ...} rather than raised,
+    so one bad provider doesn't stop the other being set up. Each provider's
+    outcome ('created', 'updated' or 'unchanged') is added to `stats` and
+    returned under results['outcomes'].
+    """
+    results = {}
+    outcomes = {}
+
+    # Set up SAML if provided
+    if entry.get('saml_xml'):
+        if verbose:
+            print("\nSetting up SAML provider...")
+        provider_stats = Counter()
+        try:
+            saml_provider = setup_saml_provider(
+                session=session,
+                saml_xml=load_saml_xml(entry['saml_xml'], entry.get('saml_entity_id')),
+                provider_name=entry.get('saml_name') or 'SAML SSO',
+                provides=entry.get('saml_provides') or ['auth'],
+                base_uri=base_uri,
+                entity_id=entry.get('saml_entity_id'),
+                stats=provider_stats
+            )
+            results['saml'] = saml_provider
+            outcomes['saml'] = next(iter(provider_stats))
+            if verbose:
+                print(f"✅ SAML provider {outcomes['saml']}: ID {saml_provider.get('id')}")
+        except Exception as e:
+            if verbose:
+                print(f"❌ Failed to set up SAML provider: {e}")
+            results['saml'] = {'error': str(e)}
+
+    # Set up DocuSign if provided
+    if entry.get('docusign_account_id') and entry.get('docusign_base_url'):
+        if verbose:
+            print("\nSetting up DocuSign provider...")
+        provider_stats = Counter()
+        try:
+            docusign_provider = setup_docusign_provider(
+                session=session,
+                account_id_docusign=entry['docusign_account_id'],
+                base_url=entry['docusign_base_url'],
+                provider_name=entry.get('docusign_name') or 'DocuSign Integration',
+                secret=entry.get('docusign_secret'),
+                environment=entry.get('docusign_env') or 'production',
+                stats=provider_stats
+            )
+            results['docusign'] = docusign_provider
+            outcomes['docusign'] = next(iter(provider_stats))
+            if verbose:
+                print(f"✅ DocuSign provider {outcomes['docusign']}: ID {docusign_provider.get('id')}")
+                if entry.get('docusign_secret'):
+                    print("✅ Secret updated")
+                else:
+                    print("⚠️  Secret not provided - provider will be in 'pending' state until secret is set")
+        except Exception as e:
+            if verbose:
+                print(f"❌ Failed to set up DocuSign provider: {e}")
+            results['docusign'] = {'error': str(e)}
+
+    if stats is not None:
+        stats.update(outcomes.values())
+    if outcomes:
+        results['outcomes'] = outcomes
+    return results
+
+
+# ============================================================================
+# BATCH PROVISIONING
+# ============================================================================
+
+# Manifest columns / keys understood by load_manifest()
+MANIFEST_FIELDS = (
+    'env_id', 'secret', 'saml_xml', 'saml_entity_id', 'saml_name', 'saml_provides',
+    'docusign_account_id', 'docusign_base_url', 'docusign_name',
+    'docusign_secret', 'docusign_env'
+)
+
+
+def _manifest_rows(f, path: str) -> Iterator[Dict]:
+    lower = path.lower()
+    if lower.endswith('.csv'):
+        import csv
+        yield from csv.DictReader(f)
+    elif lower.endswith(('.jsonl', '.ndjson')):
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+    else:
+        rows = json.load(f)
+        if isinstance(rows, dict):
+            rows = rows.get('environments', [])
+        yield from rows
+
+
+def iter_manifest(path: str) -> Iterator[Dict]:
+    """
+    Stream the entries of a batch manifest describing environments.
+
+    JSON manifests are a list of objects (or an object with an "environments"
+    list); JSONL manifests have one object per line and CSV manifests one row
+    per environment. CSV and JSONL are read incrementally, so huge fleets don't
+    have to fit in memory. Keys/columns are the MANIFEST_FIELDS above.
+    `secret_key` is accepted as an alias for `secret` (matching the Power Apps
+    export), `saml_provides` may be a list or a comma/space separated string,
+    and empty CSV cells are ignored.
+    """
+    with open(path, 'r', newline='') as f:
+        for index, row in enumerate(_manifest_rows(f, path), start=1):
+            entry = {k.strip(): v.strip() if isinstance(v, str) else v
+                     for k, v in row.items() if k and v not in (None, '')}
+            if 'secret' not in entry and 'secret_key' in entry:
+                entry['secret'] = entry.pop('secret_key')
+            if not entry.get('env_id'):
+                raise ValueError(f"Manifest entry {index} has no env_id")
+            provides = entry.get('saml_provides')
+            if isinstance(provides, str):
+                entry['saml_provides'] = provides.replace(',', ' ').split()
+            yield entry
+
+
+def load_manifest(path: str) -> List[Dict]:
+    """Load a whole batch manifest (see iter_manifest) and validate every entry up front."""
+    return list(iter_manifest(path))
+
+
+def backend_host(base_uri: str) -> str:
+    """
+    Return the shared backend host an environment is served from.
+
+    Every environment has its own hostname (`<env>.app.luminance.com`), but they
+    all share the `app.luminance.com` / `support.luminance.com` backends, so those
+    are what concurrency is capped against. Other hosts are returned unchanged.
+    """
+    host = (urlparse(base_uri).hostname or base_uri).lower()
+    labels = host.split('.')
+    if host.endswith('.luminance.com') and len(labels) > 3:
+        return '.'.join(labels[-3:])
+    return host
+
+
+class HostConcurrencyLimiter:
+    """Caps the number of environments in flight against one backend host (see `backend_host`)."""
+    def __init__(self, per_host_limit: int):
+        self.per_host_limit = per_host_limit
+        self._lock = threading.Lock()
+        self._semaphores = {}
+
+    @contextmanager
+    def limit(self, host: str):
+        with self._lock:
+            semaphore = self._semaphores.get(host)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self.per_host_limit)
+                self._semaphores[host] = semaphore
+        with semaphore:
+            yield
+
+
+def _provision_manifest_entry(entry: Dict, default_secret: Optional[str], limiter: HostConcurrencyLimiter) -> Dict:
+    """Log in and provision one manifest entry, never raising."""
+    started = time.monotonic()
+    result = {'env_id': entry['env_id']}
+    with span('provision_environment', env_id=entry['env_id']) as current:
+        try:
+            secret = entry.get('secret') or default_secret
+            if not secret:
+                raise ValueError("No secret in manifest entry and no --secret given")
+            base_uri = get_base_uri(entry['env_id'])
+            result['base_uri'] = base_uri
+            with limiter.limit(backend_host(base_uri)):
+                session, base_uri = open_session(entry['env_id'], secret)
+                result.update(provision_environment(session, base_uri, entry, verbose=False))
+            result['ok'] = not any(
+                isinstance(v, dict) and 'error' in v for v in (result.get('saml'), result.get('docusign'))
+            )
+        except Exception as e:
+            result['error'] = str(e)
+            result['ok'] = False
+        current.set_attribute('ok', result['ok'])
+    result['elapsed_seconds'] = round(time.monotonic() - started, 3)
+    return result
+
+
+def run_batch(
+    entries: List[Dict],
+    default_secret: Optional[str] = None,
+    max_workers: int = 8,
+    per_host_limit: int = 2
+) -> Dict:
+    """
+    Provision many environments concurrently.
+
+    Each entry is handled by one worker (login, then SAML, then DocuSign on the
+    same session); at most `max_workers` environments are in flight overall and
+    at most `per_host_limit` against any single backend host (all
+    `*.app.luminance.com` environments share one).
+
+    Returns:
+        Dictionary with per-environment `results` (in manifest order) plus
+        `succeeded`, `failed`, `providers` (created/updated/unchanged counts),
+        `wall_clock_seconds` and `environments_per_second`.
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    
+    limiter = HostConcurrencyLimiter(per_host_limit)
+    results = [None] * len(entries)
+    started = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(_provision_manifest_entry, entry, default_secret, limiter): index
+            for index, entry in enumerate(entries)
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            result = future.result()
+            results[futures[future]] = result
+            status = '✅' if result['ok'] else '❌'
+            detail = '' if result['ok'] else f" - {result.get('error') or 'provider setup failed'}"
+            print(f"{status} [{done}/{len(entries)}] {result['env_id']} ({result['elapsed_seconds']}s){detail}")
+
+    wall_clock = time.monotonic() - started
+    succeeded = sum(1 for r in results if r['ok'])
+    providers = Counter({'created': 0, 'updated': 0, 'unchanged': 0})
+    for result in results:
+        providers.update((result.get('outcomes') or {}).values())
+    return {
+        'results': results,
+        'succeeded': succeeded,
+        'failed': len(results) - succeeded,
+        'providers': dict(providers),
+        'wall_clock_seconds': round(wall_clock, 3),
+        'environments_per_second': round(len(results) / wall_clock, 3) if wall_clock > 0 else None
+    }
+
+
 # ============================================================================
 # MAIN EXECUTION
 # ============================================================================
 
 def main():
+    import argparse
+    
     parser = argparse.ArgumentParser(description='Set up external providers in Luminance')
-    parser.add_argument('--env-id', help='Luminance environment ID', required=True)
-    parser.add_argument('--secret', help='Luminance API secret key', required=True)
+    parser.add_argument('--env-id', help='Luminance environment ID')
+    parser.add_argument('--secret', help='Luminance API secret key (default for manifest entries without one)')
+    
+    # Batch options
+    parser.add_argument('--manifest', help='JSON or CSV manifest of environments to provision in one run')
+    parser.add_argument('--workers', type=int, default=8, help='Environments provisioned concurrently (batch mode)')
+    parser.add_argument('--per-host-limit', type=int, default=2,
+                       help='Maximum concurrent environments against one backend host, e.g. app.luminance.com (batch mode)')
     
     # SAML options
     parser.add_argument('--saml-xml', help='SAML XML metadata file or string')
+    parser.add_argument('--saml-entity-id', help='entityID of the IdP to use when --saml-xml is a federation aggregate')
     parser.add_argument('--saml-name', help='Name for SAML provider', default='SAML SSO')
     parser.add_argument('--saml-provides', nargs='+', choices=['auth', 'autoprovision', 'claims_mapping'],
                        default=['auth'], help='SAML provider capabilities')
@@ -467,62 +1070,64 @@ def main():
     parser.add_argument('--docusign-env', choices=['production', 'testing', 'development'],
                        default='production', help='DocuSign environment')
     
+    # Instrumentation
+    parser.add_argument('--metrics-out',
+                       help='Write per-request metrics here (.prom for Prometheus text, otherwise JSON)')
+    parser.add_argument('--trace-out',
+                       help='Write a span trace here (.otlp.json for OTLP/JSON, otherwise Chrome trace-event JSON)')
+    
     args = parser.parse_args()
     
+    metrics = enable_metrics() if args.metrics_out else None
+    tracer = enable_tracing() if args.trace_out else None
+    try:
+        return _run(parser, args)
+    finally:
+        if metrics is not None:
+            metrics.write(args.metrics_out)
+            print(f"Metrics written to {args.metrics_out}")
+        if tracer is not None:
+            tracer.write(args.trace_out)
+            print(f"Trace written to {args.trace_out}")
+
+
+def _run(parser, args):
+    if args.manifest:
+        entries = load_manifest(args.manifest)
+        print(f"Provisioning {len(entries)} environments "
+              f"({args.workers} workers, {args.per_host_limit} per host)...")
+        summary = run_batch(entries, default_secret=args.secret,
+                            max_workers=args.workers, per_host_limit=args.per_host_limit)
+        
+        print("\n" + "="*50)
+        print("RESULTS:")
+        print("="*50)
+        print(json.dumps(summary, indent=2))
+        print(f"\n{summary['succeeded']} succeeded, {summary['failed']} failed in "
+              f"{summary['wall_clock_seconds']}s ({summary['environments_per_second']} environments/s)")
+        print(f"Providers: {summary['providers']['created']} created, {summary['providers']['updated']} updated, "
+              f"{summary['providers']['unchanged']} unchanged")
+        return summary
+    
+    if not args.env_id or not args.secret:
+        parser.error('--env-id and --secret are required (or use --manifest)')
+    
     # Authenticate
     print("Authenticating...")
-    base_uri = lumpy.api.default_base_uri(args.env_id)
-    session = lumpy.api.Session(base_uri)
-    session.login(args.secret)
+    session, base_uri = open_session(args.env_id, args.secret)
     print("Authentication successful!")
     
-    results = {}
-    
-    # Set up SAML if provided
-    if args.saml_xml:
-        print("\nSetting up SAML provider...")
-        try:
-            # Check if it's a file path or XML string
-            if os.path.isfile(args.saml_xml):
-                with open(args.saml_xml, 'r') as f:
-                    saml_xml = f.read()
-            else:
-                saml_xml = args.saml_xml
-            
-            saml_provider = setup_saml_provider(
-                session=session,
-                saml_xml=saml_xml,
-                provider_name=args.saml_name,
-                provides=args.saml_provides,
-                base_uri=base_uri
-            )
-            results['saml'] = saml_provider
-            print(f"✅ SAML provider created/updated: ID {saml_provider.get('id')}")
-        except Exception as e:
-            print(f"❌ Failed to set up SAML provider: {e}")
-            results['saml'] = {'error': str(e)}
-    
-    # Set up DocuSign if provided
-    if args.docusign_account_id and args.docusign_base_url:
-        print("\nSetting up DocuSign provider...")
-        try:
-            docusign_provider = setup_docusign_provider(
-                session=session,
-                account_id_docusign=args.docusign_account_id,
-                base_url=args.docusign_base_url,
-                provider_name=args.docusign_name,
-                secret=args.docusign_secret,
-                environment=args.docusign_env
-            )
-            results['docusign'] = docusign_provider
-            print(f"✅ DocuSign provider created/updated: ID {docusign_provider.get('id')}")
-            if args.docusign_secret:
-                print("✅ Secret updated")
-            else:
-                print("⚠️  Secret not provided - provider will be in 'pending' state until secret is set")
-        except Exception as e:
-            print(f"❌ Failed to set up DocuSign provider: {e}")
-            results['docusign'] = {'error': str(e)}
+    results = provision_environment(session, base_uri, {
+        'saml_xml': args.saml_xml,
+        'saml_entity_id': args.saml_entity_id,
+        'saml_name': args.saml_name,
+        'saml_provides': args.saml_provides,
+        'docusign_account_id': args.docusign_account_id,
+        'docusign_base_url': args.docusign_base_url,
+        'docusign_name': args.docusign_name,
+        'docusign_secret': args.docusign_secret,
+        'docusign_env': args.docusign_env
+    })
     
     # Output results
     print("\n" + "="*50)
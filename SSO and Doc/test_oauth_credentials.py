@@ -3,10 +3,13 @@
 Quick test to verify OAuth2 credentials work
 """
 import os
+import sys
 import requests
 import base64
 from dotenv import load_dotenv
 
+from env_resolver import resolve_base_uri
+
 load_dotenv()
 
 CLIENT_ID = os.getenv("CLIENT_ID")
@@ -25,16 +28,8 @@ if not all([CLIENT_ID, CLIENT_SECRET, ENV_ID]):
     print("❌ Missing credentials in .env file")
     sys.exit(1)
 
-# Determine base URI
-if ENV_ID.startswith('http'):
-    base_uri = ENV_ID.rstrip('/')
-elif '.app.luminance.com' in ENV_ID or '.support.luminance.com' in ENV_ID:
-    base_uri = f"https://{ENV_ID}" if not ENV_ID.startswith('http') else ENV_ID
-    base_uri = base_uri.rstrip('/')
-elif len(ENV_ID) == 6 and ENV_ID.isdigit():
-    base_uri = f"https://{ENV_ID}.support.luminance.com"
-else:
-    base_uri = f"https://{ENV_ID}.app.luminance.com"
+# Determine base URI (monikers are probed on .app and .support, see env_resolver.py)
+base_uri = resolve_base_uri(ENV_ID)
 
 token_url = f"{base_uri}/auth/oauth2/token"
 
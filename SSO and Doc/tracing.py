@@ -0,0 +1,280 @@
+"""
+Span Tracing for Provisioning Runs
+
+Nested, timed spans around the steps of a run (resolve, token/login,
+get_account_id, provider lookups, PUTs, update_secret, retry backoff) and
+around every HTTP request, exportable for timeline/flame viewers:
+
+- Chrome trace-event JSON: open in chrome://tracing, https://ui.perfetto.dev
+  or speedscope
+- OTLP/JSON (the OpenTelemetry protobuf-JSON encoding of an
+  ExportTraceServiceRequest): import into Jaeger/Tempo, or POST it to a
+  collector's /v1/traces endpoint
+
+Every session_metrics.operation() is also a span, and HTTP requests become
+child spans through the session_metrics request hooks, so the session
+wrappers need no tracing code of their own. With tracing disabled, span() is
+a single check.
+
+Spans nest within a thread or asyncio task. Work handed to a thread pool
+starts new root spans on that thread, which timeline viewers show as their
+own track.
+
+Usage:
+    from tracing import enable_tracing, span
+
+    tracer = enable_tracing()
+    with span('provision', env_id='acme'):
+        ...
+    tracer.write('run.trace.json')       # Chrome trace-event JSON
+    tracer.write('run.otlp.json')        # OTLP/JSON
+"""
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+DEFAULT_SERVICE_NAME = 'luminance-provisioning'
+# Finished spans kept in memory; later ones are counted as dropped
+DEFAULT_MAX_SPANS = 200000
+SCOPE_NAME = 'luminance.provisioning'
+
+# OTLP span kinds and status codes
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_CLIENT = 3
+STATUS_CODE_UNSET = 0
+STATUS_CODE_ERROR = 2
+
+_current_span = contextvars.ContextVar('luminance_span', default=None)
+_tracer = None
+_tracer_lock = threading.Lock()
+# perf_counter_ns() gives precise durations; this offset turns it into Unix time
+_EPOCH_OFFSET_NS = time.time_ns() - time.perf_counter_ns()
+
+
+def _now_ns() -> int:
+    return _EPOCH_OFFSET_NS + time.perf_counter_ns()
+
+
+class Span:
+    """One timed step. Times are Unix nanoseconds."""
+    __slots__ = ('name', 'trace_id', 'span_id', 'parent_id', 'start_ns', 'end_ns', 'attributes', 'error',
+                 'kind', 'thread_id', 'thread_name')
+
+    def __init__(self, name: str, parent: Optional['Span'] = None, attributes: Optional[Dict] = None,
+                 kind: int = SPAN_KIND_INTERNAL, start_ns: Optional[int] = None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else '%032x' % random.getrandbits(128)
+        self.span_id = '%016x' % random.getrandbits(64)
+        self.parent_id = parent.span_id if parent else None
+        self.start_ns = start_ns if start_ns is not None else _now_ns()
+        self.end_ns = None
+        self.attributes = attributes or {}
+        self.error = None
+        self.kind = kind
+        thread = threading.current_thread()
+        self.thread_id = thread.ident
+        self.thread_name = thread.name
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    @property
+    def duration_ns(self) -> int:
+        return (self.end_ns or _now_ns()) - self.start_ns
+
+
+class _NoopSpan:
+    """Returned by span() while tracing is disabled, so callers never need to check."""
+    __slots__ = ()
+
+    def set_attribute(self, key: str, value):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Time the enclosed block as a span, nested under the current span. Usable
+    as a decorator too. An exception escaping the block marks the span as
+    failed and is re-raised.
+    """
+    tracer = _tracer
+    if tracer is None:
+        yield _NOOP_SPAN
+        return
+    current = Span(name, _current_span.get(), attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end_ns = _now_ns()
+        tracer.record(current)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+# ============================================================================
+# COLLECTION AND EXPORT
+# ============================================================================
+
+class Tracer:
+    """
+    Collects finished spans. Also a session_metrics request hook: each
+    RequestEvent is recorded as a client span under the span it was made in.
+    """
+    def __init__(self, service_name: str = DEFAULT_SERVICE_NAME, max_spans: int = DEFAULT_MAX_SPANS):
+        self.service_name = service_name
+        self.max_spans = max_spans
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.spans: List[Span] = []
+            self.dropped = 0
+
+    def record(self, finished: Span):
+        with self._lock:
+            if len(self.spans) < self.max_spans:
+                self.spans.append(finished)
+            else:
+                self.dropped += 1
+
+    def __call__(self, event):
+        # Called right after the request returns, so "now" is its end time
+        end_ns = _now_ns()
+        attributes = {
+            'http.method': event.method,
+            'http.url': event.url,
+            'http.route': event.endpoint,
+            'http.request_content_length': event.request_bytes,
+            'http.response_content_length': event.response_bytes
+        }
+        if event.status is not None:
+            attributes['http.status_code'] = event.status
+        if event.operation:
+            attributes['operation'] = event.operation
+        request_span = Span(f"{event.method} {event.endpoint}", _current_span.get(), attributes,
+                            kind=SPAN_KIND_CLIENT, start_ns=end_ns - int(event.elapsed * 1e9))
+        request_span.end_ns = end_ns
+        if event.error:
+            request_span.error = event.error
+        elif event.status is not None and event.status >= 400:
+            request_span.error = f"HTTP {event.status}"
+        self.record(request_span)
+
+    def _finished(self) -> List[Span]:
+        with self._lock:
+            return sorted(self.spans, key=lambda s: s.start_ns)
+
+    def to_chrome_trace(self) -> Dict:
+        """Chrome trace-event format: one complete ('X') event per span, in microseconds."""
+        pid = os.getpid()
+        events = []
+        threads = {}
+        for s in self._finished():
+            threads.setdefault(s.thread_id, s.thread_name)
+            args = dict(s.attributes, span_id=s.span_id, trace_id=s.trace_id)
+            if s.parent_id:
+                args['parent_id'] = s.parent_id
+            if s.error:
+                args['error'] = s.error
+            events.append({
+                'name': s.name,
+                'cat': 'http' if s.kind == SPAN_KIND_CLIENT else 'step',
+                'ph': 'X',
+                'ts': s.start_ns / 1000,
+                'dur': s.duration_ns / 1000,
+                'pid': pid,
+                'tid': s.thread_id,
+                'args': args
+            })
+        metadata = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': self.service_name}}]
+        metadata += [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+                     for tid, name in threads.items()]
+        return {'traceEvents': metadata + events, 'displayTimeUnit': 'ms',
+                'otherData': {'dropped_spans': self.dropped}}
+
+    def to_otlp(self) -> Dict:
+        """OTLP/JSON ExportTraceServiceRequest with every span under one resource and scope."""
+        spans = []
+        for s in self._finished():
+            otlp_span = {
+                'traceId': s.trace_id,
+                'spanId': s.span_id,
+                'name': s.name,
+                'kind': s.kind,
+                # 64-bit integers are strings in OTLP/JSON
+                'startTimeUnixNano': str(s.start_ns),
+                'endTimeUnixNano': str(s.end_ns or _now_ns()),
+                'attributes': _otlp_attributes(dict(s.attributes, **{'thread.name': s.thread_name})),
+                'status': {'code': STATUS_CODE_ERROR, 'message': s.error} if s.error else
+                          {'code': STATUS_CODE_UNSET}
+            }
+            if s.parent_id:
+                otlp_span['parentSpanId'] = s.parent_id
+            spans.append(otlp_span)
+        return {'resourceSpans': [{
+            'resource': {'attributes': _otlp_attributes({'service.name': self.service_name,
+                                                         'process.pid': os.getpid()})},
+            'scopeSpans': [{'scope': {'name': SCOPE_NAME}, 'spans': spans}]
+        }]}
+
+    def write(self, path: str):
+        """Write OTLP/JSON (*.otlp.json, *.otlp) or Chrome trace-event JSON (anything else)."""
+        content = self.to_otlp() if path.endswith(('.otlp.json', '.otlp')) else self.to_chrome_trace()
+        with open(path, 'w') as f:
+            json.dump(content, f)
+
+
+def _otlp_value(value) -> Dict:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def _otlp_attributes(attributes: Dict) -> List[Dict]:
+    return [{'key': key, 'value': _otlp_value(value)} for key, value in attributes.items() if value is not None]
+
+
+def enable_tracing(service_name: str = DEFAULT_SERVICE_NAME) -> Tracer:
+    """Start (once) and return the process-wide Tracer, and record HTTP requests as spans."""
+    global _tracer
+    from session_metrics import add_request_hook
+
+    with _tracer_lock:
+        if _tracer is None:
+            _tracer = Tracer(service_name)
+        tracer = _tracer
+    add_request_hook(tracer)
+    return tracer
+
+
+def disable_tracing() -> Optional[Tracer]:
+    """Stop tracing. Returns the Tracer (its spans are kept) or None if tracing was off."""
+    global _tracer
+    from session_metrics import remove_request_hook
+
+    with _tracer_lock:
+        tracer, _tracer = _tracer, None
+    if tracer is not None:
+        remove_request_hook(tracer)
+    return tracer
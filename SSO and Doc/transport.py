@@ -0,0 +1,118 @@
+"""
+Shared HTTP Transports
+
+One requests HTTPAdapter (and so one urllib3 connection pool) per Luminance
+host, shared by every OAuthSession, SessionAuth and token request in the
+process. Sessions keep their own cookies and headers, but the token request,
+the login handshake and the API calls to an environment all reuse the same
+kept-alive connections instead of each opening a fresh TCP+TLS connection.
+
+Pool sizes default to LUMINANCE_POOL_CONNECTIONS / LUMINANCE_POOL_MAXSIZE
+(or 10 / 32) and can be changed with configure_transports() before the first
+request to a host.
+
+transports.intercept(wrapper) routes sessions created from then on through
+wrapper(key, adapter) instead - e.g. cassette.py's record/replay adapter.
+
+Usage:
+    from transport import transports, configure_transports
+
+    configure_transports(pool_maxsize=64)        # e.g. for a 64-worker batch
+    session = requests.Session()
+    transports.mount(session, base_uri)
+"""
+import os
+import threading
+from typing import Callable, Dict, Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+
+# Distinct hosts whose pools the adapter keeps (one adapter per host here, so a few suffice)
+DEFAULT_POOL_CONNECTIONS = int(os.getenv("LUMINANCE_POOL_CONNECTIONS", "10"))
+# Kept-alive connections per host; should cover the number of threads using one host
+DEFAULT_POOL_MAXSIZE = int(os.getenv("LUMINANCE_POOL_MAXSIZE", "32"))
+
+
+def transport_key(url: str) -> str:
+    """scheme://host[:port]/ - the prefix a transport is mounted on."""
+    parsed = urlparse(url)
+    return f"{parsed.scheme}://{parsed.netloc}/"
+
+
+class TransportRegistry:
+    """Thread-safe map of host -> shared HTTPAdapter."""
+    def __init__(self, pool_connections: int = DEFAULT_POOL_CONNECTIONS,
+                 pool_maxsize: int = DEFAULT_POOL_MAXSIZE):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self._lock = threading.Lock()
+        self._adapters: Dict[str, HTTPAdapter] = {}
+        self._wrapper: Optional[Callable[[str, HTTPAdapter], BaseAdapter]] = None
+
+    def adapter_for(self, url: str) -> HTTPAdapter:
+        """Return the shared adapter for url's host, creating it on first use."""
+        key = transport_key(url)
+        with self._lock:
+            adapter = self._adapters.get(key)
+            if adapter is None:
+                # pool_block=False: a burst beyond pool_maxsize opens extra
+                # connections rather than waiting; only pool_maxsize are kept
+                adapter = self._adapters[key] = HTTPAdapter(
+                    pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize
+                )
+            return adapter
+
+    def mount(self, session: requests.Session, url: str) -> requests.Session:
+        """Route session's requests to url's host through the shared adapter."""
+        key = transport_key(url)
+        adapter = self.adapter_for(url)
+        wrapper = self._wrapper
+        session.mount(key, wrapper(key, adapter) if wrapper is not None else adapter)
+        return session
+
+    def intercept(self, wrapper: Optional[Callable[[str, HTTPAdapter], BaseAdapter]]):
+        """
+        Mount wrapper(key, shared_adapter) on sessions created from now on
+        (None goes back to the shared adapters). Returns the previous wrapper.
+        """
+        with self._lock:
+            previous, self._wrapper = self._wrapper, wrapper
+        return previous
+
+    def session(self, url: str) -> requests.Session:
+        """A new requests.Session (own cookies/headers) using the shared transport for url's host."""
+        return self.mount(requests.Session(), url)
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Drop-in for requests.request() that reuses the host's pooled connections."""
+        # Not closed: Session.close() would close the shared adapter's pools too
+        return self.session(url).request(method, url, **kwargs)
+
+    def stats(self) -> Dict[str, Dict]:
+        """Open pools per host, for diagnostics."""
+        with self._lock:
+            adapters = dict(self._adapters)
+        return {
+            key: {'pools': len(adapter.poolmanager.pools), 'pool_maxsize': adapter._pool_maxsize}
+            for key, adapter in adapters.items()
+        }
+
+    def close(self):
+        """Close every pooled connection (adapters stay usable and reconnect on demand)."""
+        with self._lock:
+            adapters = list(self._adapters.values())
+        for adapter in adapters:
+            adapter.close()
+
+
+transports = TransportRegistry()
+
+
+def configure_transports(pool_connections: Optional[int] = None, pool_maxsize: Optional[int] = None):
+    """Change pool sizes for hosts that haven't been used yet."""
+    if pool_connections is not None:
+        transports.pool_connections = pool_connections
+    if pool_maxsize is not None:
+        transports.pool_maxsize = pool_maxsize
@@ -0,0 +1,530 @@
+#!/usr/bin/env python3
+"""
+Shared Provisioning Work Queue
+
+A durable SQLite-backed queue of provisioning jobs (SAML, DocuSign and secret
+updates) that any number of worker processes - on one machine, or on several
+machines sharing the database file over a filesystem with working locks - can
+drain together.
+
+Jobs are claimed with time-bounded leases. A worker heartbeats the leases of
+the jobs it is running; if it dies, its leases expire and other workers
+reclaim the jobs. A job is only marked done by the worker that still holds
+its lease, so a worker that stalled past its lease can't overwrite the
+result of the worker that took over. Delivery is at-least-once; the setup
+functions are idempotent upserts (an unchanged provider is not rewritten), so
+running a reclaimed job again does not create duplicates.
+
+Job payloads use the same fields as the provisioning server's endpoints
+(see provisioning_server.py). SAML metadata is stored inline at enqueue time,
+so workers don't need access to the enqueuing machine's files.
+
+Usage:
+    python3 work_queue.py enqueue --db wave.sqlite --manifest wave.csv
+    python3 work_queue.py work --db wave.sqlite --secret <SECRET_KEY> [--concurrency 4] [--lease 60]
+    python3 work_queue.py status --db wave.sqlite
+"""
+import json
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from typing import Dict, Iterable, List, Optional
+
+from setup_external_providers import load_saml_xml
+
+JOB_KINDS = ('saml', 'docusign', 'secret')
+DEFAULT_LEASE_SECONDS = 60.0
+DEFAULT_MAX_ATTEMPTS = 5
+# Failed attempts wait RETRY_DELAY * 2**(attempt - 1) seconds (capped) before the job is claimable again
+RETRY_DELAY = 5.0
+MAX_RETRY_DELAY = 300.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    env_id TEXT NOT NULL,
+    dedupe_key TEXT,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    lease_owner TEXT,
+    lease_expires REAL,
+    available_at REAL NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_claimable ON jobs (status, lease_expires);
+-- The same provider can't be queued twice while an earlier job for it is still open
+CREATE UNIQUE INDEX IF NOT EXISTS jobs_open_dedupe ON jobs (dedupe_key)
+    WHERE status IN ('pending', 'leased');
+"""
+
+
+class Job:
+    """A claimed job. `attempt` is 1 for the first claim, 2 after one reclaim/retry, ..."""
+    def __init__(self, row: sqlite3.Row):
+        self.id = row['id']
+        self.kind = row['kind']
+        self.env_id = row['env_id']
+        self.payload = json.loads(row['payload'])
+        self.attempt = row['attempts']
+        self.max_attempts = row['max_attempts']
+
+    def __repr__(self):
+        return f"Job(id={self.id}, kind={self.kind!r}, env_id={self.env_id!r}, attempt={self.attempt})"
+
+
+# ============================================================================
+# QUEUE
+# ============================================================================
+
+class WorkQueue:
+    """
+    SQLite job queue with leases. Safe to share between threads (each thread
+    gets its own connection) and between processes.
+
+    Args:
+        path: Database file (created with 0600 permissions - payloads may hold secrets)
+        lease_seconds: How long a claim is valid without a heartbeat
+    """
+    def __init__(self, path: str, lease_seconds: float = DEFAULT_LEASE_SECONDS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self._local = threading.local()
+        if not os.path.exists(path):
+            os.close(os.open(path, os.O_CREAT | os.O_WRONLY, 0o600))
+        self._connection().executescript(_SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            # isolation_level=None: transactions are explicit (BEGIN IMMEDIATE below)
+            connection = sqlite3.connect(self.path, timeout=30.0, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def _transaction(self):
+        connection = self._connection()
+        # IMMEDIATE takes the write lock up front, so two workers can't both
+        # read the same pending rows and then race to claim them
+        connection.execute('BEGIN IMMEDIATE')
+        return connection
+
+    def close(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def enqueue(self, kind: str, env_id: str, payload: Dict, dedupe_key: Optional[str] = None,
+                max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> Optional[int]:
+        """
+        Add a job. Returns its id, or None if an open job with the same
+        dedupe_key is already queued.
+        """
+        return self.enqueue_many([(kind, env_id, payload, dedupe_key)], max_attempts)[0]
+
+    def enqueue_many(self, jobs: Iterable[tuple], max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> List[Optional[int]]:
+        """enqueue() for many (kind, env_id, payload, dedupe_key) tuples in one transaction."""
+        now = time.time()
+        ids = []
+        connection = self._transaction()
+        try:
+            for kind, env_id, payload, dedupe_key in jobs:
+                if kind not in JOB_KINDS:
+                    raise ValueError(f"Unknown job kind {kind!r} (expected one of {', '.join(JOB_KINDS)})")
+                cursor = connection.execute(
+                    "INSERT OR IGNORE INTO jobs (kind, env_id, dedupe_key, payload, max_attempts, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (kind, env_id, dedupe_key, json.dumps(dict(payload, env_id=env_id)), max_attempts, now, now)
+                )
+                ids.append(cursor.lastrowid if cursor.rowcount else None)
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return ids
+
+    def claim(self, worker_id: str, limit: int = 1) -> List[Job]:
+        """
+        Lease up to `limit` jobs to worker_id: pending jobs first-in first-out,
+        plus leased jobs whose lease has expired (their worker died). Jobs that
+        have used up max_attempts are marked failed instead of being handed out.
+        """
+        now = time.time()
+        connection = self._transaction()
+        try:
+            connection.execute(
+                "UPDATE jobs SET status = 'failed', lease_owner = NULL, updated_at = ?, "
+                "error = COALESCE(error, 'Lease expired') "
+                "WHERE status = 'leased' AND lease_expires < ? AND attempts >= max_attempts",
+                (now, now)
+            )
+            rows = connection.execute(
+                "SELECT id FROM jobs WHERE (status = 'pending' AND available_at <= ?) "
+                "OR (status = 'leased' AND lease_expires < ?) ORDER BY id LIMIT ?",
+                (now, now, limit)
+            ).fetchall()
+            ids = [row['id'] for row in rows]
+            if ids:
+                marks = ','.join('?' * len(ids))
+                connection.execute(
+                    f"UPDATE jobs SET status = 'leased', lease_owner = ?, lease_expires = ?, "
+                    f"attempts = attempts + 1, updated_at = ? WHERE id IN ({marks})",
+                    [worker_id, now + self.lease_seconds, now] + ids
+                )
+                rows = connection.execute(f"SELECT * FROM jobs WHERE id IN ({marks}) ORDER BY id", ids).fetchall()
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return [Job(row) for row in rows] if ids else []
+
+    def heartbeat(self, worker_id: str, job_ids: Iterable[int]) -> List[int]:
+        """Extend worker_id's leases on job_ids. Returns the ids whose lease was lost."""
+        job_ids = list(job_ids)
+        if not job_ids:
+            return []
+        now = time.time()
+        marks = ','.join('?' * len(job_ids))
+        connection = self._transaction()
+        try:
+            connection.execute(
+                f"UPDATE jobs SET lease_expires = ?, updated_at = ? "
+                f"WHERE id IN ({marks}) AND status = 'leased' AND lease_owner = ?",
+                [now + self.lease_seconds, now] + job_ids + [worker_id]
+            )
+            held = {row['id'] for row in connection.execute(
+                f"SELECT id FROM jobs WHERE id IN ({marks}) AND status = 'leased' AND lease_owner = ?",
+                job_ids + [worker_id]
+            )}
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return [job_id for job_id in job_ids if job_id not in held]
+
+    def _finish(self, worker_id: str, job: Job, status: str, result=None, error: Optional[str] = None,
+                delay: float = 0.0) -> bool:
+        now = time.time()
+        connection = self._transaction()
+        try:
+            cursor = connection.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, lease_owner = NULL, lease_expires = NULL, "
+                "available_at = ?, updated_at = ? WHERE id = ? AND status = 'leased' AND lease_owner = ?",
+                (status, json.dumps(result, default=str) if result is not None else None, error,
+                 now + delay, now, job.id, worker_id)
+            )
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return cursor.rowcount == 1
+
+    def complete(self, worker_id: str, job: Job, result=None) -> bool:
+        """Mark job done. Returns False if worker_id no longer holds its lease."""
+        return self._finish(worker_id, job, 'done', result=result)
+
+    def fail(self, worker_id: str, job: Job, error: str, retry: bool = True) -> bool:
+        """
+        Record a failed attempt: the job goes back to pending (after an
+        exponential backoff) while it has attempts left and retry is True,
+        otherwise it is marked failed. Returns False if worker_id no longer
+        holds its lease.
+        """
+        if retry and job.attempt < job.max_attempts:
+            delay = min(MAX_RETRY_DELAY, RETRY_DELAY * 2 ** (job.attempt - 1))
+            return self._finish(worker_id, job, 'pending', error=error, delay=delay)
+        return self._finish(worker_id, job, 'failed', error=error)
+
+    def requeue_failed(self) -> int:
+        """
+        Give failed jobs a fresh set of attempts. Returns how many were requeued.
+
+        Only the latest failed job per dedupe_key is requeued, and none whose
+        dedupe_key already has a pending or leased job (re-enqueued since),
+        so the open-job uniqueness of dedupe_key holds.
+        """
+        connection = self._transaction()
+        try:
+            cursor = connection.execute(
+                "UPDATE jobs SET status = 'pending', attempts = 0, available_at = 0, updated_at = ? "
+                "WHERE status = 'failed' AND (dedupe_key IS NULL OR ("
+                "NOT EXISTS (SELECT 1 FROM jobs AS open WHERE open.dedupe_key = jobs.dedupe_key "
+                "AND open.status IN ('pending', 'leased')) "
+                "AND id = (SELECT MAX(id) FROM jobs AS failed WHERE failed.dedupe_key = jobs.dedupe_key "
+                "AND failed.status = 'failed')))",
+                (time.time(),)
+            )
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return cursor.rowcount
+
+    def counts(self) -> Dict[str, int]:
+        """Jobs by status; expired leases are reported as 'expired' rather than 'leased'."""
+        counts = {'pending': 0, 'leased': 0, 'expired': 0, 'done': 0, 'failed': 0}
+        for row in self._connection().execute(
+            "SELECT CASE WHEN status = 'leased' AND lease_expires < ? THEN 'expired' ELSE status END AS state, "
+            "COUNT(*) AS n FROM jobs GROUP BY state", (time.time(),)
+        ):
+            counts[row['state']] = row['n']
+        return counts
+
+    def failures(self, limit: int = 20) -> List[Dict]:
+        return [dict(row) for row in self._connection().execute(
+            "SELECT id, kind, env_id, attempts, error FROM jobs WHERE status = 'failed' ORDER BY id LIMIT ?",
+            (limit,)
+        )]
+
+
+# ============================================================================
+# ENQUEUEING
+# ============================================================================
+
+def manifest_jobs(entry: Dict) -> List[tuple]:
+    """
+    The (kind, env_id, payload, dedupe_key) jobs for one manifest entry
+    (see setup_external_providers.iter_manifest).
+    """
+    env_id = entry['env_id']
+    common = {'secret': entry['secret']} if entry.get('secret') else {}
+    jobs = []
+    if entry.get('saml_xml'):
+        name = entry.get('saml_name') or 'SAML SSO'
+        jobs.append(('saml', env_id, dict(
+            common,
+            saml_xml=load_saml_xml(entry['saml_xml'], entry.get('saml_entity_id')),
+            saml_entity_id=entry.get('saml_entity_id'),
+            provider_name=name,
+            provides=entry.get('saml_provides') or ['auth']
+        ), f"saml:{env_id}:{name}"))
+    if entry.get('docusign_account_id') and entry.get('docusign_base_url'):
+        name = entry.get('docusign_name') or 'DocuSign Integration'
+        jobs.append(('docusign', env_id, dict(
+            common,
+            account_id_docusign=entry['docusign_account_id'],
+            base_url=entry['docusign_base_url'],
+            provider_name=name,
+            docusign_secret=entry.get('docusign_secret'),
+            environment=entry.get('docusign_env') or 'production'
+        ), f"docusign:{env_id}:{name}"))
+    return jobs
+
+
+def enqueue_manifest(queue: WorkQueue, entries: Iterable[Dict], max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+                     batch_size: int = 500) -> Dict[str, int]:
+    """Queue the jobs for every manifest entry. Returns {'queued': n, 'already_queued': n}."""
+    counts = {'queued': 0, 'already_queued': 0}
+    batch = []
+
+    def flush():
+        for job_id in queue.enqueue_many(batch, max_attempts):
+            counts['queued' if job_id is not None else 'already_queued'] += 1
+        batch.clear()
+
+    for entry in entries:
+        batch.extend(manifest_jobs(entry))
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return counts
+
+
+# ============================================================================
+# WORKERS
+# ============================================================================
+
+class _Heartbeat:
+    """Background thread extending the leases of the jobs a worker is running."""
+    def __init__(self, queue: WorkQueue, worker_id: str):
+        self.queue = queue
+        self.worker_id = worker_id
+        self.lost = set()
+        self._held = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.queue.close()
+
+    def hold(self, job: Job):
+        with self._lock:
+            self._held.add(job.id)
+
+    def release(self, job: Job) -> bool:
+        """Stop renewing job's lease. Returns False if the lease had already been lost."""
+        with self._lock:
+            self._held.discard(job.id)
+            if job.id in self.lost:
+                self.lost.discard(job.id)
+                return False
+            return True
+
+    def _run(self):
+        # Renew at a third of the lease so one missed beat doesn't lose it
+        while not self._stop.wait(self.queue.lease_seconds / 3):
+            with self._lock:
+                held = list(self._held)
+            try:
+                lost = self.queue.heartbeat(self.worker_id, held)
+            except sqlite3.Error as e:
+                print(f"⚠️  Heartbeat failed: {e}", file=sys.stderr)
+                continue
+            with self._lock:
+                self.lost.update(lost)
+
+
+def run_worker(queue: WorkQueue, service=None, worker_id: Optional[str] = None, concurrency: int = 4,
+               poll_interval: float = 2.0, exit_when_empty: bool = True, verbose: bool = True) -> Dict[str, int]:
+    """
+    Claim and run jobs on `concurrency` threads until the queue is drained
+    (or forever, polling every poll_interval seconds, if exit_when_empty is False).
+
+    Args:
+        queue: The WorkQueue
+        service: provisioning_server.ProvisioningService used to run jobs
+                 (default: one with a fresh warm-session pool)
+        worker_id: Lease owner name (default: host:pid:random)
+
+    Returns:
+        Counts of 'done', 'retried', 'failed' and 'lost' (lease taken over) jobs
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from provisioning_server import BadRequest, ProvisioningService
+
+    service = service or ProvisioningService()
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    heartbeat = _Heartbeat(queue, worker_id).start()
+    totals = {'done': 0, 'retried': 0, 'failed': 0, 'lost': 0}
+    totals_lock = threading.Lock()
+
+    def count(outcome):
+        with totals_lock:
+            totals[outcome] += 1
+
+    def run_job(job: Job):
+        heartbeat.hold(job)
+        try:
+            # A reclaimed or retried job may have created its provider before
+            # failing, so the warm provider listing can't be trusted
+            result, error = service.handle(f'/{job.kind}', job.payload, refresh_providers=job.attempt > 1), None
+        except Exception as e:
+            result, error = None, e
+        held = heartbeat.release(job)
+
+        if error is not None:
+            # Missing fields or unusable metadata won't get better on retry
+            retry = not isinstance(error, BadRequest)
+            if not held or not queue.fail(worker_id, job, str(error), retry=retry):
+                count('lost')
+            else:
+                count('retried' if retry and job.attempt < job.max_attempts else 'failed')
+            if verbose:
+                print(f"❌ {job}: {error}")
+            return
+        if held and queue.complete(worker_id, job, result):
+            count('done')
+            if verbose:
+                print(f"✅ {job}: {result.get('outcome', 'done')}")
+        else:
+            count('lost')
+            if verbose:
+                print(f"⚠️  {job}: lease was lost before completion; result discarded")
+
+    def loop():
+        while True:
+            jobs = queue.claim(worker_id)
+            if not jobs:
+                counts = queue.counts()
+                # Jobs leased elsewhere may still come back (worker died, or a retry is due)
+                if exit_when_empty and not (counts['pending'] or counts['leased']):
+                    return
+                time.sleep(poll_interval)
+                continue
+            for job in jobs:
+                run_job(job)
+
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='queue-worker') as pool:
+            for future in [pool.submit(loop) for _ in range(concurrency)]:
+                future.result()
+    finally:
+        heartbeat.stop()
+    return totals
+
+
+def main():
+    import argparse
+    from setup_external_providers import iter_manifest
+
+    parser = argparse.ArgumentParser(description='Shared provisioning work queue')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    enqueue = commands.add_parser('enqueue', help='Queue the jobs in a manifest')
+    enqueue.add_argument('--db', required=True, help='Queue database file')
+    enqueue.add_argument('--manifest', required=True, help='CSV, JSON or JSONL manifest (see --manifest in setup_external_providers.py)')
+    enqueue.add_argument('--max-attempts', type=int, default=DEFAULT_MAX_ATTEMPTS)
+
+    work = commands.add_parser('work', help='Run jobs until the queue is drained')
+    work.add_argument('--db', required=True, help='Queue database file')
+    work.add_argument('--secret', help='Luminance API secret key for jobs queued without one')
+    work.add_argument('--concurrency', type=int, default=4, help='Jobs run at once by this process')
+    work.add_argument('--lease', type=float, default=DEFAULT_LEASE_SECONDS, help='Lease length in seconds')
+    work.add_argument('--follow', action='store_true', help='Keep polling for new jobs instead of exiting')
+
+    status = commands.add_parser('status', help='Show job counts')
+    status.add_argument('--db', required=True, help='Queue database file')
+    status.add_argument('--requeue-failed', action='store_true', help='Give failed jobs another set of attempts')
+
+    args = parser.parse_args()
+
+    if args.command == 'enqueue':
+        queue = WorkQueue(args.db)
+        counts = enqueue_manifest(queue, iter_manifest(args.manifest), max_attempts=args.max_attempts)
+        print(f"✅ Queued {counts['queued']} jobs ({counts['already_queued']} already queued)")
+        return counts
+
+    if args.command == 'work':
+        from provisioning_server import ProvisioningService
+        queue = WorkQueue(args.db, lease_seconds=args.lease)
+        totals = run_worker(queue, ProvisioningService(default_secret=args.secret),
+                            concurrency=args.concurrency, exit_when_empty=not args.follow)
+        print(f"\n{totals['done']} done, {totals['retried']} retried, {totals['failed']} failed, "
+              f"{totals['lost']} lost to other workers")
+        print(json.dumps(queue.counts()))
+        return totals
+
+    queue = WorkQueue(args.db)
+    if args.requeue_failed:
+        print(f"Requeued {queue.requeue_failed()} failed jobs")
+    counts = queue.counts()
+    print(json.dumps(counts, indent=2))
+    for failure in queue.failures():
+        print(f"❌ job {failure['id']} ({failure['kind']} {failure['env_id']}, "
+              f"{failure['attempts']} attempts): {failure['error']}")
+    return counts
+
+
+if __name__ == "__main__":
+    main()